@@ -0,0 +1,207 @@
+"""
+Lokaler Ersatz für api.speisekammer.app und die OpenFoodFacts-API.
+
+Erzeugt einen reproduzierbaren Bestand (fester Seed) und zählt jede Anfrage,
+damit Benchmarks ohne Netzwerk und ohne echten Token laufen.
+"""
+from dataclasses import dataclass, field
+from aiohttp import web
+import asyncio
+import json
+import random
+import time
+
+COMMUNITY_ID = "bench-community"
+
+
+@dataclass
+class FakeServerConfig:
+    items: int = 100  # Artikel insgesamt, gleichmäßig auf die Lagerorte verteilt
+    locations: int = 5
+    latency_ms: float = 0  # feste Verzögerung pro Anfrage
+    jitter_ms: float = 0  # zusätzliche zufällige Verzögerung (0 bis jitter_ms)
+    error_rate: float = 0.0  # Anteil der Anfragen mit 503
+    throttle_rate: float = 0.0  # Anteil der Anfragen mit 429 + Retry-After
+    retry_after: int = 1  # Sekunden im Retry-After-Header
+    off_missing_rate: float = 0.1  # Anteil der GTINs, die OpenFoodFacts nicht kennt
+    description_bytes: int = 40  # Länge der Artikelbeschreibung (Größe der Antworten)
+    seed: int = 1
+
+
+@dataclass
+class RequestStats:
+    """Anfragen je Route, damit Fan-out-Regressionen sichtbar werden"""
+
+    requests: dict = field(default_factory=dict)
+    statuses: dict = field(default_factory=dict)
+    bytes_sent: int = 0
+
+    def reset(self):
+        self.requests.clear()
+        self.statuses.clear()
+        self.bytes_sent = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "total": sum(self.requests.values()),
+            "requests": dict(sorted(self.requests.items())),
+            "statuses": {str(status): count for status, count in sorted(self.statuses.items())},
+            "bytes_sent": self.bytes_sent,
+        }
+
+
+def make_gtin(number: int) -> str:
+    """13-stellige GTIN mit gültiger Prüfziffer"""
+    digits = f"400{number:09d}"
+    checksum = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(digits))
+    return digits + str((10 - checksum % 10) % 10)
+
+
+class FakeSpeisekammer:
+    def __init__(self, config: FakeServerConfig):
+        self.config = config
+        self.stats = RequestStats()
+        self._random = random.Random(config.seed)
+        self.locations = [
+            {"id": f"loc-{i}", "name": f"Lagerort {i}"} for i in range(config.locations)
+        ]
+        self.stock = {loc["id"]: {} for loc in self.locations}
+        self.versions = {loc["id"]: 1 for loc in self.locations}
+        now_ms = int(time.time() * 1000)
+        for number in range(config.items):
+            gtin = make_gtin(number)
+            loc_id = self.locations[number % config.locations]["id"]
+            self.stock[loc_id][gtin] = {
+                "gtin": gtin,
+                "name": f"Artikel {number}",
+                "description": ("x" * config.description_bytes),
+                "attributes": [{
+                    "count": self._random.randint(1, 5),
+                    # Ablaufdaten von vor einer Woche bis in einem Jahr
+                    "bestBeforeDate": {"ts": now_ms + self._random.randint(-7, 365) * 86400000},
+                }],
+            }
+
+    def gtins(self) -> list:
+        return [gtin for items in self.stock.values() for gtin in items]
+
+    def change_events(self, changes: int) -> list:
+        """
+        Bestand zufällig ändern (Menge neu würfeln) und die passenden
+        Push-Ereignisse liefern, ein Ereignis pro Lagerort.
+        """
+        events = {}
+        for _ in range(changes):
+            loc_id = self._random.choice(self.locations)["id"]
+            if not self.stock[loc_id]:
+                continue
+            gtin = self._random.choice(list(self.stock[loc_id]))
+            item = self.stock[loc_id][gtin]
+            item["attributes"] = [{**item["attributes"][0], "count": self._random.randint(0, 5)}]
+            self.versions[loc_id] += 1
+            event = events.setdefault(loc_id, {"community_id": COMMUNITY_ID, "location_id": loc_id, "items": []})
+            event["items"].append(item)
+        return list(events.values())
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self._middleware])
+        app.router.add_get("/communities", self._communities, name="communities")
+        app.router.add_get(
+            "/communities/{community}/storage-locations", self._storage_locations, name="storage_locations"
+        )
+        app.router.add_get("/stock/{community}/{location}", self._stock, name="stock")
+        app.router.add_put("/stock/{community}/{location}", self._put_stock, name="stock_put")
+        app.router.add_get("/stock/{community}/{location}/{gtin}", self._stock_item, name="stock_item")
+        app.router.add_get("/api/v2/product/{gtin}.json", self._openfoodfacts, name="openfoodfacts")
+        return app
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler):
+        route = request.match_info.route.name or "unbekannt"
+        self.stats.requests[route] = self.stats.requests.get(route, 0) + 1
+        delay = self.config.latency_ms + self._random.random() * self.config.jitter_ms
+        if delay:
+            await asyncio.sleep(delay / 1000)
+        roll = self._random.random()
+        if roll < self.config.error_rate:
+            response = web.Response(status=503, text="Service Unavailable")
+        elif roll < self.config.error_rate + self.config.throttle_rate:
+            response = web.Response(
+                status=429, text="Too Many Requests", headers={"Retry-After": str(self.config.retry_after)}
+            )
+        else:
+            response = await handler(request)
+        self.stats.statuses[response.status] = self.stats.statuses.get(response.status, 0) + 1
+        self.stats.bytes_sent += response.content_length or 0
+        return response
+
+    @staticmethod
+    def _json(data, **kwargs) -> web.Response:
+        return web.Response(body=json.dumps(data).encode(), content_type="application/json", **kwargs)
+
+    async def _communities(self, request):
+        return self._json([{"id": COMMUNITY_ID, "name": "Benchmark"}])
+
+    async def _storage_locations(self, request):
+        return self._json(self.locations)
+
+    async def _stock(self, request):
+        loc_id = request.match_info["location"]
+        if loc_id not in self.stock:
+            return web.Response(status=404)
+        etag = f'"{loc_id}-{self.versions[loc_id]}"'
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers={"ETag": etag})
+        return self._json(list(self.stock[loc_id].values()), headers={"ETag": etag})
+
+    async def _stock_item(self, request):
+        item = self.stock.get(request.match_info["location"], {}).get(request.match_info["gtin"])
+        if item is None:
+            return web.Response(status=404)
+        return self._json(item)
+
+    async def _put_stock(self, request):
+        loc_id = request.match_info["location"]
+        if loc_id not in self.stock:
+            return web.Response(status=404)
+        payload = await request.json()
+        for item in payload if isinstance(payload, list) else [payload]:
+            gtin = str(item.get("gtin"))
+            existing = self.stock[loc_id].get(gtin, {"gtin": gtin, "name": "Unbekannt"})
+            if "attributes" in item:
+                attributes = item["attributes"]
+            else:
+                attributes = [{"count": item.get("count", 0), "bestBeforeDate": item.get("bestBeforeDate")}]
+            self.stock[loc_id][gtin] = {**existing, "attributes": attributes}
+        self.versions[loc_id] += 1
+        return self._json(payload)
+
+    async def _openfoodfacts(self, request):
+        gtin = request.match_info["gtin"]
+        # Deterministisch je GTIN, unabhängig von der Reihenfolge der Anfragen
+        if random.Random(gtin).random() < self.config.off_missing_rate:
+            return self._json({"status": 0, "status_verbose": "product not found"}, status=404)
+        return self._json({
+            "status": 1,
+            "product": {
+                "product_name": f"Produkt {gtin}",
+                "image_front_small_url": f"https://images.example/{gtin}.200.jpg",
+            },
+        })
+
+
+async def post_events(session, webhook_url: str, events: list) -> dict:
+    """Änderungen wie das Backend an den Webhook von Home Assistant schicken"""
+    async with session.post(webhook_url, json={"events": events}) as resp:
+        return await resp.json()
+
+
+async def start_server(config: FakeServerConfig):
+    """Server auf einem freien Port starten -> (FakeSpeisekammer, base_url, runner)"""
+    fake = FakeSpeisekammer(config)
+    runner = web.AppRunner(fake.app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return fake, f"http://127.0.0.1:{port}", runner
@@ -0,0 +1,254 @@
+"""
+Benchmark der Integration gegen den lokalen Ersatzserver (benchmarks/fake_server.py).
+
+Treibt die echten Codepfade – Coordinator-Refresh, StorageLocationSensor,
+SingleItemSensor-Lookup und Inventur start/scan/stop – mit einer Home Assistant
+Instanz in einem temporären Konfigurationsverzeichnis und gibt pro Szenario
+Laufzeit, Anfragen je Endpunkt, Attributgröße und Speicher als JSON aus.
+
+Aufruf (im Wurzelverzeichnis des Repos, Home Assistant muss installiert sein):
+
+    python -m benchmarks.run --items 10 100 1000 10000 --locations 1 10 50 --output results.json
+"""
+from pathlib import Path
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from homeassistant.core import HomeAssistant  # noqa: E402
+
+from benchmarks.fake_server import COMMUNITY_ID, FakeServerConfig, make_gtin, start_server  # noqa: E402
+from custom_components.speisekammer.api import SpeisekammerAPI  # noqa: E402
+from custom_components.speisekammer.coordinator import SpeisekammerCoordinator  # noqa: E402
+from custom_components.speisekammer.inventur import Inventur  # noqa: E402
+from custom_components.speisekammer.metrics import Metrics  # noqa: E402
+from custom_components.speisekammer.product_cache import ProductCache  # noqa: E402
+from custom_components.speisekammer.push import parse_push_events  # noqa: E402
+from custom_components.speisekammer.sensor import SingleItemSensor, StorageLocationSensor  # noqa: E402
+from custom_components.speisekammer.write_queue import WriteQueue  # noqa: E402
+
+ENTRY_ID = "benchmark"
+
+
+class Phase:
+    """Misst Laufzeit, Serveranfragen und Speicher eines Abschnitts"""
+
+    def __init__(self, fake, memory: bool):
+        self._fake = fake
+        self._memory = memory
+        self.result = {}
+
+    def __enter__(self):
+        self._fake.stats.reset()
+        if self._memory:
+            tracemalloc.reset_peak()
+            self._mem_start = tracemalloc.get_traced_memory()[0]
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.result["wall_ms"] = round((time.perf_counter() - self._start) * 1000, 3)
+        self.result["server"] = self._fake.stats.as_dict()
+        if self._memory:
+            current, peak = tracemalloc.get_traced_memory()
+            self.result["memory"] = {
+                "delta_bytes": current - self._mem_start,
+                "peak_bytes": peak - self._mem_start,
+            }
+        return False
+
+
+def attribute_sizes(sensors) -> dict:
+    sizes = [len(json.dumps(sensor.extra_state_attributes, default=str)) for sensor in sensors]
+    return {"total_bytes": sum(sizes), "max_bytes": max(sizes, default=0)}
+
+
+async def run_case(args, items: int, locations: int) -> dict:
+    config = FakeServerConfig(
+        items=items,
+        locations=locations,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        description_bytes=args.description_bytes,
+        seed=args.seed,
+    )
+    fake, base_url, runner = await start_server(config)
+    memory = not args.no_memory
+    result = {"items": items, "locations": locations, "phases": {}}
+    phases = result["phases"]
+
+    with tempfile.TemporaryDirectory() as config_dir:
+        hass = HomeAssistant(config_dir)
+        api = SpeisekammerAPI(
+            "benchmark-token",
+            parallel_limit=args.parallel,
+            metrics=Metrics(),
+            base_url=base_url,
+            off_base_url=base_url,
+        )
+        product_cache = ProductCache(hass, api)
+        coordinator = SpeisekammerCoordinator(hass, api, COMMUNITY_ID, product_cache, ENTRY_ID)
+        write_queue = WriteQueue(hass, api, COMMUNITY_ID, ENTRY_ID, on_written=coordinator.apply_local_write)
+        inventur = Inventur(hass, api, ENTRY_ID, COMMUNITY_ID, coordinator, write_queue)
+        try:
+            # Erster Abruf: alle Lagerorte + OpenFoodFacts für jede GTIN
+            with Phase(fake, memory) as phase:
+                await coordinator.async_refresh()
+            phase.result["success"] = coordinator.last_update_success
+            phases["refresh_cold"] = phase.result
+
+            # Planmäßiger Takt direkt danach: kein Lagerort fällig, also keine Anfragen
+            with Phase(fake, memory) as phase:
+                await coordinator.async_refresh()
+            phase.result["success"] = coordinator.last_update_success
+            phases["refresh_tick"] = phase.result
+
+            # Alle Lagerorte fällig: nur bedingte Anfragen (304), kein Neuaufbau
+            coordinator.scheduler.force(None, time.time())
+            with Phase(fake, memory) as phase:
+                await coordinator.async_refresh()
+            phase.result["success"] = coordinator.last_update_success
+            phases["refresh_warm"] = phase.result
+
+            # Sensoren bauen ihre Tabellen aus dem Snapshot
+            sensors = {}
+            for compact in (False, True):
+                with Phase(fake, memory) as phase:
+                    sensors[compact] = [
+                        StorageLocationSensor(coordinator, loc_id, name, compact=compact)
+                        for loc_id, name in coordinator.locations.items()
+                    ]
+                phase.result["attributes"] = attribute_sizes(sensors[compact])
+                phases["sensor_build_compact" if compact else "sensor_build"] = phase.result
+
+            with Phase(fake, memory) as phase:
+                full = [
+                    StorageLocationSensor(coordinator, loc_id, name, max_rows=0)
+                    for loc_id, name in coordinator.locations.items()
+                ]
+            phase.result["attributes"] = attribute_sizes(full)
+            phases["sensor_build_unlimited"] = phase.result
+
+            # Lookups über den SingleItemSensor: Treffer aus dem Index, Fehlgriffe über die API
+            lookup = SingleItemSensor([coordinator])
+            lookup.hass = hass
+            known = fake.gtins()[:args.lookups]
+            unknown = [make_gtin(items + number) for number in range(args.lookups)]
+            for name, gtins in (("lookup_hit", known), ("lookup_miss", unknown)):
+                with Phase(fake, memory) as phase:
+                    for gtin in gtins:
+                        hass.states.async_set("input_text.gtin_eingabe", gtin)
+                        await lookup._async_lookup()
+                phase.result["lookups"] = len(gtins)
+                phases[name] = phase.result
+
+            # Push: Änderungen wie vom Webhook übernehmen, nur betroffene Sensoren bauen neu
+            events = parse_push_events({"events": fake.change_events(args.push_changes)}, COMMUNITY_ID)
+            with Phase(fake, memory) as phase:
+                applied = coordinator.apply_push(events)
+                rebuilt = 0
+                for sensor in sensors[False]:
+                    if coordinator.get_version(sensor._location_id) != sensor._version:
+                        sensor._update_from_snapshot()
+                        rebuilt += 1
+            phase.result["events"] = len(events)
+            phase.result["applied"] = applied
+            phase.result["sensors_rebuilt"] = rebuilt
+            phases["push_apply"] = phase.result
+
+            # Inventur im größten Lagerort: start, Scans (bekannt + unbekannt), stop
+            location_id = max(coordinator.locations, key=lambda loc_id: len(coordinator.get_items(loc_id)))
+            with Phase(fake, memory) as phase:
+                await inventur.start(location_id)
+            phase.result["articles"] = len(inventur.get_table_data())
+            phases["inventur_start"] = phase.result
+
+            scans = [item["gtin"] for item in coordinator.get_items(location_id)][:args.scans]
+            scans += unknown[:max(args.scans - len(scans), 0)]
+            with Phase(fake, memory) as phase:
+                for gtin in scans:
+                    await inventur.scan_article(gtin)
+            phase.result["scans"] = len(scans)
+            phases["inventur_scan"] = phase.result
+
+            with Phase(fake, memory) as phase:
+                summary = await inventur.stop()
+            phase.result["summary"] = {
+                "updated": (summary or {}).get("updated", 0),
+                "failed": len((summary or {}).get("failed", {})),
+                "pending": len(write_queue),
+            }
+            phases["inventur_stop"] = phase.result
+
+            result["metrics"] = api.metrics.as_dict()
+        finally:
+            await write_queue.async_shutdown()
+            await coordinator.async_shutdown()
+            await api.async_close()
+            await hass.async_stop(force=True)
+            await runner.cleanup()
+    return result
+
+
+async def main(args) -> dict:
+    if not args.no_memory:
+        tracemalloc.start()
+    results = []
+    for items in args.items:
+        for locations in args.locations:
+            results.append(await run_case(args, items, locations))
+            print(f"{items} Artikel / {locations} Lagerorte fertig", file=sys.stderr)
+    return {
+        "config": {
+            "latency_ms": args.latency_ms,
+            "jitter_ms": args.jitter_ms,
+            "error_rate": args.error_rate,
+            "throttle_rate": args.throttle_rate,
+            "parallel": args.parallel,
+            "description_bytes": args.description_bytes,
+            "lookups": args.lookups,
+            "scans": args.scans,
+            "push_changes": args.push_changes,
+            "seed": args.seed,
+            "memory_tracing": not args.no_memory,
+        },
+        "results": results,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Speisekammer Benchmark gegen einen lokalen Ersatzserver")
+    parser.add_argument("--items", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--locations", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--latency-ms", type=float, default=5)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--parallel", type=int, default=4, help="gleichzeitige Anfragen beim Fan-out")
+    parser.add_argument("--description-bytes", type=int, default=40)
+    parser.add_argument("--lookups", type=int, default=20)
+    parser.add_argument("--scans", type=int, default=50)
+    parser.add_argument("--push-changes", type=int, default=20, help="geänderte Artikel im Push-Szenario")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-memory", action="store_true", help="tracemalloc abschalten (genauere Laufzeiten)")
+    parser.add_argument("--output", help="JSON in diese Datei statt auf stdout")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    report = asyncio.run(main(arguments))
+    if arguments.output:
+        Path(arguments.output).write_text(json.dumps(report, indent=2))
+    else:
+        print(json.dumps(report, indent=2))
@@ -1,49 +1,251 @@
-from homeassistant.core import HomeAssistant
+from homeassistant.const import EVENT_HOMEASSISTANT_CLOSE
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.start import async_at_started
 from homeassistant.config_entries import ConfigEntry
-from .const import DOMAIN, CONF_TOKEN, CONF_COMMUNITY_ID
+from datetime import timedelta
+from .const import (
+    DOMAIN,
+    CONF_TOKEN,
+    CONF_COMMUNITY_ID,
+    CONF_COMMUNITIES,
+    CONF_TIMEOUT,
+    CONF_PRODUCT_CACHE_TTL,
+    CONF_PARALLEL_REQUESTS,
+    CONF_EXPIRY_DAYS,
+    CONF_SLOW_CALL_MS,
+    CONF_MAX_SCAN_INTERVAL,
+    CONF_PUSH,
+    CONF_WEBHOOK_ID,
+    CONF_IMAGE_PROXY,
+    CONF_IMAGE_CACHE_MB,
+    CONF_SHOPPING_EXPIRY_DAYS,
+    DEFAULT_TIMEOUT,
+    DEFAULT_PRODUCT_CACHE_TTL,
+    DEFAULT_PARALLEL_REQUESTS,
+    DEFAULT_EXPIRY_DAYS,
+    DEFAULT_SLOW_CALL_MS,
+    DEFAULT_MAX_SCAN_INTERVAL,
+    DEFAULT_PUSH,
+    DEFAULT_IMAGE_PROXY,
+    DEFAULT_IMAGE_CACHE_MB,
+    DEFAULT_SHOPPING_EXPIRY_DAYS,
+)
 from .api import SpeisekammerAPI
-from .inventur import Inventur, InventurSensor, register_services
+from .coordinator import SpeisekammerCoordinator
+from .history import ConsumptionHistory
+from .image_proxy import ImageCache, SpeisekammerImageView
+from .metrics import Metrics
+from .product_cache import ProductCache
+from .push import async_register_webhook, generate_webhook_id
+from .shopping import ShoppingList
+from .services import async_register_services, async_unregister_services
+from .write_queue import WriteQueue
 import logging
+import time
 
 _LOGGER = logging.getLogger(__name__)
+IMAGE_CACHE_KEY = "speisekammer_image_cache"
+SHARED_API_KEY = "speisekammer_shared_api"
+
+
+def entry_communities(entry: ConfigEntry) -> dict:
+    """Communities eines Eintrags als id -> name (ältere Einträge kennen nur eine)"""
+    communities = entry.data.get(CONF_COMMUNITIES)
+    if communities:
+        return dict(communities)
+    return {entry.data[CONF_COMMUNITY_ID]: entry.title}
+
+
+def storage_id(entry: ConfigEntry, community_id: str) -> str:
+    """Schlüssel für Snapshot, Warteschlange und Inventur auf der Platte"""
+    # Die erste Community behält die bisherigen Schlüssel, damit nichts verloren geht
+    if community_id == entry.data[CONF_COMMUNITY_ID]:
+        return entry.entry_id
+    return f"{entry.entry_id}_{community_id}"
+
 
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry):
     """Setup der Integration über ConfigEntry"""
+    setup_start = time.monotonic()
     hass.data.setdefault(DOMAIN, {})
 
     token = entry.data[CONF_TOKEN]
-    community_id = entry.data[CONF_COMMUNITY_ID]
-    api = SpeisekammerAPI(token)
+    timeout = entry.options.get(CONF_TIMEOUT, DEFAULT_TIMEOUT)
+    # Ein HTTP-Pool für alle Einträge, eine API-Instanz (Token) pro Eintrag für alle Communities
+    session = hass.data.get("speisekammer_session")
+    if session is None or session.closed:
+        session = SpeisekammerAPI.create_session(timeout)
+        hass.data["speisekammer_session"] = session
+
+        async def async_close_session(_event, session=session):
+            if not session.closed:
+                await session.close()
+
+        # Beim Beenden von Home Assistant werden Einträge nicht entladen: Pool trotzdem schließen
+        hass.data["speisekammer_session_unsub"] = hass.bus.async_listen_once(
+            EVENT_HOMEASSISTANT_CLOSE, async_close_session
+        )
+    api = SpeisekammerAPI(
+        token,
+        session=session,
+        timeout=timeout,
+        parallel_limit=entry.options.get(CONF_PARALLEL_REQUESTS, DEFAULT_PARALLEL_REQUESTS),
+        metrics=Metrics(slow_call_ms=entry.options.get(CONF_SLOW_CALL_MS, DEFAULT_SLOW_CALL_MS)),
+    )
+    # Die gemeinsamen Caches (Produktdaten, Bilder) dürfen an keinem Eintrag hängen:
+    # eigene API ohne Token auf dem gemeinsamen Pool, mit eigenen Metriken
+    shared_api = hass.data.get(SHARED_API_KEY)
+    if shared_api is None:
+        shared_api = SpeisekammerAPI(
+            "",
+            session=session,
+            timeout=timeout,
+            parallel_limit=entry.options.get(CONF_PARALLEL_REQUESTS, DEFAULT_PARALLEL_REQUESTS),
+            metrics=Metrics(slow_call_ms=entry.options.get(CONF_SLOW_CALL_MS, DEFAULT_SLOW_CALL_MS)),
+        )
+        hass.data[SHARED_API_KEY] = shared_api
+
+    # Produktcache wird von allen Einträgen gemeinsam genutzt
+    product_cache = hass.data.get("speisekammer_product_cache")
+    if product_cache is None:
+        ttl = timedelta(days=entry.options.get(CONF_PRODUCT_CACHE_TTL, DEFAULT_PRODUCT_CACHE_TTL))
+        product_cache = ProductCache(hass, shared_api, ttl=ttl)
+        await product_cache.async_load()
+        hass.data["speisekammer_product_cache"] = product_cache
+
+    # Produktbilder über einen gemeinsamen lokalen Cache statt direkt aus dem Internet
+    image_cache = None
+    if entry.options.get(CONF_IMAGE_PROXY, DEFAULT_IMAGE_PROXY):
+        image_cache = hass.data.get(IMAGE_CACHE_KEY)
+        if image_cache is None:
+            max_bytes = entry.options.get(CONF_IMAGE_CACHE_MB, DEFAULT_IMAGE_CACHE_MB) * 1024 * 1024
+            image_cache = ImageCache(hass, shared_api, hass.config.path(".storage", f"{DOMAIN}_images"), max_bytes)
+            await image_cache.async_load()
+            hass.data[IMAGE_CACHE_KEY] = image_cache
+        if not hass.data.get("speisekammer_image_view"):
+            # Views lassen sich nicht abmelden: einmal pro Home Assistant Lauf
+            hass.http.register_view(SpeisekammerImageView(hass, IMAGE_CACHE_KEY))
+            hass.data["speisekammer_image_view"] = True
+
+    push = entry.options.get(CONF_PUSH, DEFAULT_PUSH)
+    communities = {}
+    snapshot_restored = {}
+    for community_id, name in entry_communities(entry).items():
+        # Verbrauchsverlauf: Mengenänderungen je GTIN in einer kleinen SQLite-Datei
+        history = ConsumptionHistory(
+            hass, hass.config.path(".storage", f"{DOMAIN}.history.{storage_id(entry, community_id)}.db")
+        )
+        await history.async_open()
+
+        # Ein Coordinator je Community holt den Bestand für deren Sensoren und Services
+        coordinator = SpeisekammerCoordinator(
+            hass, api, community_id, product_cache, storage_id(entry, community_id),
+            expiry_days=entry.options.get(CONF_EXPIRY_DAYS, DEFAULT_EXPIRY_DAYS),
+            max_scan_interval=entry.options.get(CONF_MAX_SCAN_INTERVAL, DEFAULT_MAX_SCAN_INTERVAL),
+            push=push,
+            image_cache=image_cache,
+            history=history,
+        )
+        if await coordinator.async_restore_snapshot():
+            # Entities starten mit dem letzten Snapshot, der erste echte Abruf
+            # läuft erst, wenn Home Assistant fertig gestartet ist
+            async def async_first_refresh(_hass, coordinator=coordinator):
+                await coordinator.async_refresh()
+
+            entry.async_on_unload(async_at_started(hass, async_first_refresh))
+        else:
+            # Erste Einrichtung: ohne Snapshot kennen wir die Lagerorte noch nicht
+            await coordinator.async_config_entry_first_refresh()
+
+        # Alle Bestandsänderungen laufen über die Warteschlange (Retry, Backoff, Bündelung)
+        @callback
+        def handle_written(location_id, items, coordinator=coordinator):
+            coordinator.apply_local_write(location_id, items)
+            hass.async_create_task(coordinator.async_request_refresh())
+
+        write_queue = WriteQueue(
+            hass, api, community_id, storage_id(entry, community_id), on_written=handle_written
+        )
+        await write_queue.async_load()
+
+        # Mindestbestände für die Einkaufsliste
+        shopping = ShoppingList(
+            hass, coordinator, storage_id(entry, community_id),
+            entry.options.get(CONF_SHOPPING_EXPIRY_DAYS, DEFAULT_SHOPPING_EXPIRY_DAYS),
+        )
+        await shopping.async_load()
+
+        communities[community_id] = {
+            "community_id": community_id,
+            "name": name,
+            "coordinator": coordinator,
+            "write_queue": write_queue,
+            "history": history,
+            "shopping": shopping,
+        }
+        snapshot_restored[community_id] = coordinator.snapshot_restored
 
     # Speichere API und Config
     hass.data[DOMAIN][entry.entry_id] = {
         "api": api,
-        "community_id": community_id,
+        "communities": communities,
         "config": entry.data,
     }
 
-    # --- Update Stock Service ---
-    async def handle_update_stock(call):
-        location_id = call.data.get("location_id")
-        items = call.data.get("items")
-        _LOGGER.debug("Update stock: location=%s, items=%s", location_id, items)
-        await api.update_stock(community_id, location_id, items)
-    
-    hass.services.async_register(DOMAIN, "update_stock", handle_update_stock)
-    _LOGGER.info("Service speisekammer.update_stock registriert")
-    
-    # --- Inventur Services ---
-    # Wir erstellen die Inventur hier, Sensor wird in sensor.py registriert
-    inventur = Inventur(hass, api, entry_id=entry.entry_id, community_id=community_id)
-    # Sensor wird erst in sensor.py erzeugt, wir übergeben inventur nur an register_services
-    # register_services wird von sensor.py aufgerufen, daher hier nicht nötig
-
-    # Sensor Plattform forwarden
+    # Optionaler Push-Weg: Änderungen per Webhook statt häufiger Abfragen
+    if push:
+        if CONF_WEBHOOK_ID not in entry.data:
+            hass.config_entries.async_update_entry(
+                entry, data={**entry.data, CONF_WEBHOOK_ID: generate_webhook_id()}
+            )
+        entry.async_on_unload(async_register_webhook(hass, entry.data[CONF_WEBHOOK_ID], communities))
+
+    # Services einmal für alle Einträge; sie suchen sich die Community selbst
+    async_register_services(hass)
+
+    # Optionen (z.B. Timeout) greifen erst nach einem Reload
+    entry.async_on_unload(entry.add_update_listener(async_reload_entry))
+
+    # Sensor Plattform forwarden (Inventur und Inventur-Sensor je Community entstehen dort)
     await hass.config_entries.async_forward_entry_setups(entry, ["sensor"])
+
+    hass.data[DOMAIN][entry.entry_id]["setup"] = {
+        "duration_ms": round((time.monotonic() - setup_start) * 1000, 1),
+        "snapshot_restored": snapshot_restored,
+    }
+    _LOGGER.debug("Setup in %.1f ms", (time.monotonic() - setup_start) * 1000)
     return True
 
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry):
     """Integration entladen"""
     await hass.config_entries.async_unload_platforms(entry, ["sensor"])
-    hass.data[DOMAIN].pop(entry.entry_id)
+    data = hass.data[DOMAIN].pop(entry.entry_id)
+    for community in data["communities"].values():
+        if "inventur" in community:
+            await community["inventur"].async_save()
+        await community["write_queue"].async_shutdown()
+        await community["coordinator"].async_shutdown()
+        await community["history"].async_close()
+    product_cache = hass.data.get("speisekammer_product_cache")
+    if product_cache is not None:
+        await product_cache.async_save()
+        if not hass.data[DOMAIN]:
+            hass.data.pop("speisekammer_product_cache")
+    if not hass.data[DOMAIN]:
+        hass.data.pop(IMAGE_CACHE_KEY, None)
+    await data["api"].async_close()
+    if not hass.data[DOMAIN]:
+        # Letzter Eintrag: gemeinsamen HTTP-Pool schließen und Services entfernen
+        hass.data.pop(SHARED_API_KEY, None)
+        session = hass.data.pop("speisekammer_session", None)
+        unsub_close = hass.data.pop("speisekammer_session_unsub", None)
+        if unsub_close is not None:
+            unsub_close()
+        if session is not None and not session.closed:
+            await session.close()
+        async_unregister_services(hass)
     return True
+
+async def async_reload_entry(hass: HomeAssistant, entry: ConfigEntry):
+    """Integration nach Änderung der Optionen neu laden"""
+    await hass.config_entries.async_reload(entry.entry_id)
@@ -1,13 +1,249 @@
 import aiohttp
+import asyncio
+import hashlib
 import logging
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from .const import (
+    API_BASE_URL,
+    OFF_BASE_URL,
+    DEFAULT_TIMEOUT,
+    DEFAULT_PARALLEL_REQUESTS,
+    CONNECTION_LIMIT,
+    CONNECTION_LIMIT_PER_HOST,
+    DNS_CACHE_TTL,
+    KEEPALIVE_TIMEOUT,
+    MICRO_CACHE_TTL,
+)
+from .metrics import Metrics
 
 _LOGGER = logging.getLogger(__name__)
 
+
+class SpeisekammerApiError(Exception):
+    """Fehlerantwort der Speisekammer API (inkl. Retry-After bei 429/503)"""
+
+    def __init__(self, status: int, message: str = "", retry_after: float = None):
+        super().__init__(f"{status} {message}".strip())
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        return self.status == 429 or self.status >= 500
+
+
+def _parse_retry_after(value):
+    """Retry-After als Sekunden (Zahl oder HTTP-Datum)"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(tz=timezone.utc)).total_seconds(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def build_item_payload(gtin: str, count: int, best_before: str, description: str = "") -> dict:
+    """
+    Payload für einen Artikel im Format von PUT /stock.
+    best_before: ISO-Datum string z.B. '2025-09-17'
+    """
+    # Timestamp aus ISO-Datum
+    try:
+        dt = datetime.fromisoformat(best_before).replace(tzinfo=timezone.utc)
+        ts = int(dt.timestamp() * 1000)  # Millisekunden
+    except Exception:
+        ts = int(datetime.now(tz=timezone.utc).timestamp() * 1000)
+
+    return {
+        "gtin": gtin,
+        "description": description,
+        "attributes": [
+            {
+                "count": count,
+                "bestBeforeDate": {
+                    "ts": ts
+                }
+            }
+        ]
+    }
+
+
+class SingleFlight:
+    """
+    Gleichzeitige identische Aufrufe teilen sich eine laufende Anfrage; das
+    Ergebnis bleibt `ttl` Sekunden gültig, damit Bursts nur eine Anfrage kosten.
+    Leere Ergebnisse (Fehler, 404) werden nicht zwischengespeichert.
+    """
+
+    def __init__(self, ttl: float, metrics: Metrics, name: str):
+        self._ttl = ttl
+        self._metrics = metrics
+        self._name = name
+        self._inflight = {}  # key -> Task
+        self._waiters = {}  # key -> Anzahl wartender Aufrufer
+        self._recent = {}  # key -> (zeitpunkt, ergebnis)
+
+    async def run(self, key, call):
+        recent = self._recent.get(key)
+        if recent is not None:
+            if time.monotonic() - recent[0] < self._ttl:
+                self._metrics.cache_hit(self._name)
+                return recent[1]
+            del self._recent[key]
+
+        task = self._inflight.get(key)
+        if task is None:
+            self._metrics.cache_miss(self._name)
+            task = asyncio.ensure_future(call())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        else:
+            self._metrics.cache_hit(self._name)
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            # shield: bricht ein Aufrufer ab (z.B. first_match), laufen die anderen weiter
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # Ohne weitere Wartende braucht niemand das Ergebnis mehr
+            if self._waiters.get(key) == 1 and self._inflight.get(key) is task:
+                task.cancel()
+            raise
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+
+    def _finished(self, key, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if task.cancelled() or task.exception() is not None:
+            return
+        if task.result():
+            now = time.monotonic()
+            if len(self._recent) > 256:
+                self._recent = {k: v for k, v in self._recent.items() if now - v[0] < self._ttl}
+            self._recent[key] = (now, task.result())
+
+    def forget(self, prefix: str):
+        """Zwischengespeicherte Ergebnisse verwerfen, z.B. nach einem Schreibvorgang"""
+        for key in [key for key in self._recent if key.startswith(prefix)]:
+            del self._recent[key]
+
+
 class SpeisekammerAPI:
-    def __init__(self, token: str):
+    def __init__(
+        self,
+        token: str,
+        session: aiohttp.ClientSession = None,
+        timeout: float = DEFAULT_TIMEOUT,
+        parallel_limit: int = DEFAULT_PARALLEL_REQUESTS,
+        metrics: Metrics = None,
+        base_url: str = API_BASE_URL,
+        off_base_url: str = OFF_BASE_URL,
+    ):
         self._token = token
-        self._base_url = "https://api.speisekammer.app"
+        self._base_url = base_url.rstrip("/")
+        self.off_base_url = off_base_url.rstrip("/")
+        self._timeout = aiohttp.ClientTimeout(total=timeout)
+        self._parallel_limit = parallel_limit
+        self.metrics = metrics or Metrics()
+        # url -> {"etag", "last_modified", "hash", "items"} für bedingte Abrufe
+        self._stock_cache = {}
+        # Gleiche GET-Anfragen (API bzw. OpenFoodFacts) nur einmal gleichzeitig
+        self._flight = SingleFlight(MICRO_CACHE_TTL, self.metrics, "dedup")
+        self._off_flight = SingleFlight(MICRO_CACHE_TTL, self.metrics, "openfoodfacts_dedup")
+        # Eine fremde Session (z.B. von Home Assistant) wird nie von uns geschlossen
+        self._session = session
+        self._owns_session = session is None
+
+    @staticmethod
+    def create_session(timeout: float = DEFAULT_TIMEOUT) -> aiohttp.ClientSession:
+        """Session mit Connection-Pool und Keep-Alive (auch zum Teilen zwischen Einträgen)"""
+        connector = aiohttp.TCPConnector(
+            limit=CONNECTION_LIMIT,
+            limit_per_host=CONNECTION_LIMIT_PER_HOST,
+            ttl_dns_cache=DNS_CACHE_TTL,
+            keepalive_timeout=KEEPALIVE_TIMEOUT,
+        )
+        return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout))
+
+    def get_session(self) -> aiohttp.ClientSession:
+        """Langlebige Session mit Connection-Pool und Keep-Alive liefern"""
+        if self._session is None or self._session.closed:
+            self._session = self.create_session(self._timeout.total)
+            self._owns_session = True
+        return self._session
+
+    @asynccontextmanager
+    async def _request(self, endpoint: str, method: str, url: str, **kwargs):
+        """HTTP-Anfrage über die gemeinsame Session, mit Metriken je Endpunkt"""
+        with self.metrics.track(endpoint) as call:
+            async with self.get_session().request(method, url, timeout=self._timeout, **kwargs) as resp:
+                call.status = resp.status
+                # Content-Length fehlt bei chunked/komprimierten Antworten: den Body
+                # selbst zählen; json()/text() verwenden ihn danach ohne neues Lesen
+                call.bytes = len(await resp.read())
+                yield resp
+
+    async def async_close(self):
+        """Eigene Session schließen (beim Entladen des ConfigEntry)"""
+        if self._owns_session and self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def gather_limited(self, calls, limit: int = None) -> list:
+        """
+        Aufrufe parallel ausführen, höchstens `limit` gleichzeitig.
+        calls: Funktionen ohne Argumente, die eine Coroutine liefern
+        """
+        semaphore = asyncio.Semaphore(limit or self._parallel_limit)
+
+        async def run(call):
+            async with semaphore:
+                return await call()
+
+        return await asyncio.gather(*(run(call) for call in calls))
+
+    async def first_match(self, calls, limit: int = None):
+        """
+        Wie gather_limited, liefert aber das erste Ergebnis != None
+        und bricht alle noch laufenden Aufrufe ab.
+        """
+        semaphore = asyncio.Semaphore(limit or self._parallel_limit)
+
+        async def run(call):
+            async with semaphore:
+                try:
+                    return await call()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    _LOGGER.debug("Teilanfrage fehlgeschlagen: %s", e)
+                    return None
+
+        tasks = [asyncio.ensure_future(run(call)) for call in calls]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                if result is not None:
+                    return result
+            return None
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def fetch_product(self, gtin: str) -> dict:
+        """OpenFoodFacts-Abfrage über die gemeinsame Session, gleiche GTINs nur einmal gleichzeitig"""
+        return await self._off_flight.run(
+            gtin, lambda: fetch_openfoodfacts(gtin, self.get_session(), self.metrics, self.off_base_url)
+        )
 
     def _headers(self):
         return {
@@ -17,57 +253,127 @@ class SpeisekammerAPI:
 
     async def get_communities(self):
         url = f"{self._base_url}/communities"
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=self._headers()) as resp:
-                if resp.status == 200:
-                    return await resp.json()
-                _LOGGER.error("Fehler beim Abrufen der Communities: %s", resp.status)
-                return []
+        return await self._flight.run(url, lambda: self._get_communities(url))
+
+    async def _get_communities(self, url: str):
+        async with self._request("communities", "GET", url, headers=self._headers()) as resp:
+            if resp.status == 200:
+                return await resp.json()
+            _LOGGER.error("Fehler beim Abrufen der Communities: %s", resp.status)
+            return []
 
     async def get_storage_locations(self, community_id: str):
         url = f"{self._base_url}/communities/{community_id}/storage-locations"
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=self._headers()) as resp:
-                if resp.status == 200:
-                    return await resp.json()
-                _LOGGER.error("Fehler beim Abrufen der Lagerorte: %s", resp.status)
-                return []
+        return await self._flight.run(url, lambda: self._get_storage_locations(url))
+
+    async def _get_storage_locations(self, url: str):
+        async with self._request("storage_locations", "GET", url, headers=self._headers()) as resp:
+            if resp.status == 200:
+                return await resp.json()
+            _LOGGER.error("Fehler beim Abrufen der Lagerorte: %s", resp.status)
+            return []
 
     async def get_items(self, community_id: str, storage_location_id: str):
         url = f"{self._base_url}/stock/{community_id}/{storage_location_id}"
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=self._headers()) as resp:
-                if resp.status == 200:
-                    return await resp.json()
-                _LOGGER.error(
-                    "Fehler beim Abrufen der Artikel: %s – URL: %s",
-                    resp.status,
-                    url
-                )
-                return []
+        return await self._flight.run(url, lambda: self._get_items(url))
+
+    async def _get_items(self, url: str):
+        cached = self._stock_cache.get(url)
+        headers = self._headers()
+        if cached:
+            # Bedingter Abruf: unveränderter Bestand kostet nur eine 304-Antwort
+            if cached["etag"]:
+                headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                headers["If-Modified-Since"] = cached["last_modified"]
+        async with self._request("stock", "GET", url, headers=headers) as resp:
+            if resp.status == 304 and cached:
+                self.metrics.cache_hit("stock_etag")
+                return cached["items"]
+            self.metrics.cache_miss("stock_etag")
+            if resp.status == 200:
+                body = await resp.read()
+                items = await resp.json()
+                self._stock_cache[url] = {
+                    "etag": resp.headers.get("ETag"),
+                    "last_modified": resp.headers.get("Last-Modified"),
+                    # Inhalts-Hash als Fallback, falls der Server keine Validatoren liefert
+                    "hash": hashlib.sha1(body).hexdigest(),
+                    "items": items,
+                }
+                return items
+            _LOGGER.error(
+                "Fehler beim Abrufen der Artikel: %s – URL: %s",
+                resp.status,
+                url
+            )
+            # None statt []: ein Fehler ist kein leerer Lagerort
+            return None
+
+    def stock_version(self, community_id: str, storage_location_id: str):
+        """Inhalts-Hash des zuletzt abgerufenen Bestands eines Lagerorts"""
+        cached = self._stock_cache.get(f"{self._base_url}/stock/{community_id}/{storage_location_id}")
+        return cached["hash"] if cached else None
 
     async def get_item_by_gtin(self, community_id: str, location_id: str, gtin: str):
         url = f"{self._base_url}/stock/{community_id}/{location_id}/{gtin}"
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=self._headers()) as resp:
-                if resp.status == 200:
-                    return await resp.json()
-                elif resp.status == 404:
-                    _LOGGER.info("GTIN %s nicht gefunden in Lagerort %s", gtin, location_id)
-                    return None
-                else:
-                    _LOGGER.error("Fehler beim Abrufen des Artikels: %s – URL: %s", resp.status, url)
-                    return None
+        return await self._flight.run(url, lambda: self._get_item_by_gtin(url, location_id, gtin))
 
-    async def update_stock(self, community_id: str, location_id: str, items: list):
+    async def _get_item_by_gtin(self, url: str, location_id: str, gtin: str):
+        async with self._request("stock_item", "GET", url, headers=self._headers()) as resp:
+            if resp.status == 200:
+                return await resp.json()
+            elif resp.status == 404:
+                _LOGGER.info("GTIN %s nicht gefunden in Lagerort %s", gtin, location_id)
+                return None
+            else:
+                _LOGGER.error("Fehler beim Abrufen des Artikels: %s – URL: %s", resp.status, url)
+                return None
+
+    async def get_items_for_locations(self, community_id: str, location_ids) -> dict:
+        """Bestand mehrerer Lagerorte parallel abrufen (location_id -> items, None bei Fehler)"""
+        location_ids = list(location_ids)
+        results = await self.gather_limited(
+            lambda loc_id=loc_id: self.get_items(community_id, loc_id) for loc_id in location_ids
+        )
+        return dict(zip(location_ids, results))
+
+    async def find_item_by_gtin(self, community_id: str, location_ids, gtin: str):
+        """GTIN in mehreren Lagerorten parallel suchen, erster Treffer gewinnt -> (location_id, item)"""
+
+        async def lookup(loc_id):
+            item = await self.get_item_by_gtin(community_id, loc_id, gtin)
+            return (loc_id, item) if item else None
+
+        return await self.first_match(lambda loc_id=loc_id: lookup(loc_id) for loc_id in location_ids)
+
+    async def put_stock(self, community_id: str, location_id: str, payload):
+        """PUT /stock; wirft SpeisekammerApiError bei einer Fehlerantwort"""
         url = f"{self._base_url}/stock/{community_id}/{location_id}"
-        async with aiohttp.ClientSession() as session:
-            async with session.put(url, headers=self._headers(), json=items) as resp:
+        try:
+            async with self._request("stock_put", "PUT", url, headers=self._headers(), json=payload) as resp:
                 if resp.status == 200:
-                    _LOGGER.info("Lagerbestand erfolgreich aktualisiert für %s", location_id)
                     return await resp.json()
-                _LOGGER.error("Fehler beim Aktualisieren des Lagerbestands: %s – URL: %s", resp.status, url)
-                return None
+                text = await resp.text()
+                raise SpeisekammerApiError(resp.status, text, _parse_retry_after(resp.headers.get("Retry-After")))
+        finally:
+            # Danach frisch lesen: kein Ergebnis von vor dem Schreiben weitergeben
+            self.forget_cached(community_id, location_id)
+
+    def forget_cached(self, community_id: str, location_id: str = ""):
+        """Kurzzeit-Ergebnisse eines Lagerorts bzw. (ohne Lagerort) der ganzen Community verwerfen"""
+        self._flight.forget(f"{self._base_url}/stock/{community_id}/{location_id}")
+        if not location_id:
+            self._flight.forget(f"{self._base_url}/communities/{community_id}/")
+
+    async def update_stock(self, community_id: str, location_id: str, items: list):
+        try:
+            result = await self.put_stock(community_id, location_id, items)
+        except SpeisekammerApiError as e:
+            _LOGGER.error("Fehler beim Aktualisieren des Lagerbestands: %s – Lagerort: %s", e.status, location_id)
+            return None
+        _LOGGER.info("Lagerbestand erfolgreich aktualisiert für %s", location_id)
+        return result
 
     # NEU: Artikel hinzufügen / aktualisieren
     async def add_item(self, community_id: str, location_id: str, gtin: str, count: int, best_before: str, description: str = ""):
@@ -75,32 +381,34 @@ class SpeisekammerAPI:
         Fügt einen Artikel hinzu oder aktualisiert ihn.
         best_before: ISO-Datum string z.B. '2025-09-17'
         """
-        # Timestamp aus ISO-Datum
+        payload = build_item_payload(gtin, count, best_before, description)
         try:
-            dt = datetime.fromisoformat(best_before).replace(tzinfo=timezone.utc)
-            ts = int(dt.timestamp() * 1000)  # Millisekunden
-        except Exception:
-            ts = int(datetime.now(tz=timezone.utc).timestamp() * 1000)
-
-        payload = {
-            "gtin": gtin,
-            "description": description,
-            "attributes": [
-                {
-                    "count": count,
-                    "bestBeforeDate": {
-                        "ts": ts
-                    }
-                }
-            ]
-        }
+            result = await self.put_stock(community_id, location_id, payload)
+        except SpeisekammerApiError as e:
+            _LOGGER.error("Fehler beim Hinzufügen des Artikels: %s", e)
+            raise
+        _LOGGER.info("Artikel erfolgreich hinzugefügt: %s (%s Stück) in %s", gtin, count, location_id)
+        return result
 
-        url = f"{self._base_url}/stock/{community_id}/{location_id}"
-        async with aiohttp.ClientSession() as session:
-            async with session.put(url, headers=self._headers(), json=payload) as resp:
-                text = await resp.text()
-                if resp.status == 200:
-                    _LOGGER.info("Artikel erfolgreich hinzugefügt: %s (%s Stück) in %s", gtin, count, location_id)
-                    return await resp.json()
-                _LOGGER.error("Fehler beim Hinzufügen des Artikels: %s – %s", resp.status, text)
-                raise Exception(f"Fehler beim Hinzufügen des Artikels: {resp.status} {text}")
+
+# --------------------------
+# Hilfsfunktion für OpenFoodFacts
+# --------------------------
+async def fetch_openfoodfacts(
+    gtin: str, session: aiohttp.ClientSession, metrics: Metrics = None, base_url: str = OFF_BASE_URL
+) -> dict:
+    url = f"{base_url}/api/v2/product/{gtin}.json"
+    metrics = metrics or Metrics()
+    try:
+        with metrics.track("openfoodfacts") as call:
+            async with session.get(url) as response:
+                call.status = response.status
+                call.bytes = len(await response.read())
+                if response.status == 200:
+                    return await response.json()
+                if response.status == 404:
+                    # Produkt bei OpenFoodFacts unbekannt
+                    return {"status": 0}
+    except Exception as e:
+        _LOGGER.warning("OpenFoodFacts Fehler für GTIN %s: %s", gtin, e)
+    return {}
@@ -0,0 +1,52 @@
+import logging
+import re
+
+_LOGGER = logging.getLogger(__name__)
+
+_SEPARATORS = re.compile(r"[;,\t]")
+
+
+def parse_bulk_entries(items=None, data: str = None) -> list:
+    """
+    Artikel für Bulk-Services einlesen.
+    items: Liste aus GTINs oder Dicts (gtin, count, date, location_name)
+    data: Text mit einem Artikel pro Zeile: gtin[,count[,date[,location_name]]]
+    Ungültige Einträge bekommen den Schlüssel "error".
+    """
+    entries = []
+    for item in items or []:
+        if isinstance(item, dict):
+            entry = dict(item)
+            # Die Einzel-Services heißen das Datum unterschiedlich
+            entry.setdefault("date", entry.pop("best_before", None) or entry.pop("mhd", None))
+        else:
+            entry = {"gtin": item}
+        entries.append(entry)
+
+    for line_no, line in enumerate((data or "").splitlines(), start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        fields = [field.strip() for field in _SEPARATORS.split(line)]
+        if line_no == 1 and not fields[0].isdigit():
+            # Kopfzeile einer CSV-Datei
+            continue
+        entry = {"gtin": fields[0]}
+        if len(fields) > 1 and fields[1]:
+            entry["count"] = fields[1]
+        if len(fields) > 2 and fields[2]:
+            entry["date"] = fields[2]
+        if len(fields) > 3 and fields[3]:
+            entry["location_name"] = fields[3]
+        entries.append(entry)
+
+    for entry in entries:
+        entry["gtin"] = str(entry.get("gtin") or "").strip()
+        if not entry["gtin"]:
+            entry["error"] = "GTIN fehlt"
+            continue
+        try:
+            entry["count"] = int(entry.get("count", 1))
+        except (TypeError, ValueError):
+            entry["error"] = f"Ungültige Menge: {entry.get('count')}"
+    return entries
@@ -1,16 +1,56 @@
 from homeassistant import config_entries
+from homeassistant.core import callback
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
+import homeassistant.helpers.config_validation as cv
 import voluptuous as vol
-from .const import DOMAIN, CONF_TOKEN, CONF_COMMUNITY_ID
+from .const import (
+    DOMAIN,
+    CONF_TOKEN,
+    CONF_COMMUNITY_ID,
+    CONF_COMMUNITIES,
+    CONF_TIMEOUT,
+    CONF_PRODUCT_CACHE_TTL,
+    CONF_PARALLEL_REQUESTS,
+    CONF_COMPACT_ATTRIBUTES,
+    CONF_MAX_ROWS,
+    CONF_EXPIRY_DAYS,
+    CONF_SCAN_DEBOUNCE_MS,
+    CONF_SLOW_CALL_MS,
+    CONF_MAX_SCAN_INTERVAL,
+    CONF_PUSH,
+    CONF_IMAGE_PROXY,
+    CONF_IMAGE_CACHE_MB,
+    CONF_SHOPPING_EXPIRY_DAYS,
+    DEFAULT_TIMEOUT,
+    DEFAULT_PRODUCT_CACHE_TTL,
+    DEFAULT_PARALLEL_REQUESTS,
+    DEFAULT_COMPACT_ATTRIBUTES,
+    DEFAULT_MAX_ROWS,
+    DEFAULT_EXPIRY_DAYS,
+    DEFAULT_SCAN_DEBOUNCE_MS,
+    DEFAULT_SLOW_CALL_MS,
+    DEFAULT_MAX_SCAN_INTERVAL,
+    DEFAULT_PUSH,
+    DEFAULT_IMAGE_PROXY,
+    DEFAULT_IMAGE_CACHE_MB,
+    DEFAULT_SHOPPING_EXPIRY_DAYS,
+)
 from .api import SpeisekammerAPI
 
 class SpeisekammerConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
     VERSION = 1
 
+    @staticmethod
+    @callback
+    def async_get_options_flow(config_entry):
+        return SpeisekammerOptionsFlow(config_entry)
+
     async def async_step_user(self, user_input=None):
         errors = {}
         if user_input is not None:
             token = user_input[CONF_TOKEN]
-            api = SpeisekammerAPI(token)
+            # Für die einmalige Prüfung reicht die gemeinsame Session von Home Assistant
+            api = SpeisekammerAPI(token, session=async_get_clientsession(self.hass))
             communities = await api.get_communities()
 
             if communities:
@@ -35,19 +75,92 @@ class SpeisekammerConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
         }
 
         if user_input is not None:
-            community_id = user_input[CONF_COMMUNITY_ID]
-            return self.async_create_entry(
-                title=community_options[community_id],
-                data={
-                    CONF_TOKEN: self._token,
-                    CONF_COMMUNITY_ID: community_id
-                }
-            )
+            # Mehrere Communities (Haushalte) teilen sich Token, HTTP-Pool und Produktcache
+            community_ids = [c for c in community_options if c in user_input[CONF_COMMUNITY_ID]]
+            if not community_ids:
+                errors["base"] = "no_communities"
+            else:
+                return self.async_create_entry(
+                    title=", ".join(community_options[c] for c in community_ids),
+                    data={
+                        CONF_TOKEN: self._token,
+                        CONF_COMMUNITY_ID: community_ids[0],
+                        CONF_COMMUNITIES: {c: community_options[c] for c in community_ids},
+                    }
+                )
 
         return self.async_show_form(
             step_id="select_community",
             data_schema=vol.Schema({
-                vol.Required(CONF_COMMUNITY_ID): vol.In(community_options)
+                vol.Required(CONF_COMMUNITY_ID): cv.multi_select(community_options)
             }),
             errors=errors
         )
+
+
+class SpeisekammerOptionsFlow(config_entries.OptionsFlow):
+    def __init__(self, config_entry):
+        self._config_entry = config_entry
+
+    async def async_step_init(self, user_input=None):
+        if user_input is not None:
+            return self.async_create_entry(title="", data=user_input)
+
+        options = self._config_entry.options
+        return self.async_show_form(
+            step_id="init",
+            data_schema=vol.Schema({
+                vol.Optional(
+                    CONF_TIMEOUT,
+                    default=options.get(CONF_TIMEOUT, DEFAULT_TIMEOUT)
+                ): vol.All(vol.Coerce(int), vol.Range(min=5, max=120)),
+                vol.Optional(
+                    CONF_PRODUCT_CACHE_TTL,
+                    default=options.get(CONF_PRODUCT_CACHE_TTL, DEFAULT_PRODUCT_CACHE_TTL)
+                ): vol.All(vol.Coerce(int), vol.Range(min=1, max=365)),
+                vol.Optional(
+                    CONF_PARALLEL_REQUESTS,
+                    default=options.get(CONF_PARALLEL_REQUESTS, DEFAULT_PARALLEL_REQUESTS)
+                ): vol.All(vol.Coerce(int), vol.Range(min=1, max=16)),
+                vol.Optional(
+                    CONF_COMPACT_ATTRIBUTES,
+                    default=options.get(CONF_COMPACT_ATTRIBUTES, DEFAULT_COMPACT_ATTRIBUTES)
+                ): bool,
+                vol.Optional(
+                    CONF_MAX_ROWS,
+                    default=options.get(CONF_MAX_ROWS, DEFAULT_MAX_ROWS)
+                ): vol.All(vol.Coerce(int), vol.Range(min=0, max=10000)),
+                vol.Optional(
+                    CONF_EXPIRY_DAYS,
+                    default=options.get(CONF_EXPIRY_DAYS, DEFAULT_EXPIRY_DAYS)
+                ): vol.All(vol.Coerce(int), vol.Range(min=1, max=60)),
+                vol.Optional(
+                    CONF_SCAN_DEBOUNCE_MS,
+                    default=options.get(CONF_SCAN_DEBOUNCE_MS, DEFAULT_SCAN_DEBOUNCE_MS)
+                ): vol.All(vol.Coerce(int), vol.Range(min=0, max=10000)),
+                vol.Optional(
+                    CONF_SLOW_CALL_MS,
+                    default=options.get(CONF_SLOW_CALL_MS, DEFAULT_SLOW_CALL_MS)
+                ): vol.All(vol.Coerce(int), vol.Range(min=0, max=60000)),
+                vol.Optional(
+                    CONF_MAX_SCAN_INTERVAL,
+                    default=options.get(CONF_MAX_SCAN_INTERVAL, DEFAULT_MAX_SCAN_INTERVAL)
+                ): vol.All(vol.Coerce(int), vol.Range(min=10, max=1440)),
+                vol.Optional(
+                    CONF_PUSH,
+                    default=options.get(CONF_PUSH, DEFAULT_PUSH)
+                ): bool,
+                vol.Optional(
+                    CONF_IMAGE_PROXY,
+                    default=options.get(CONF_IMAGE_PROXY, DEFAULT_IMAGE_PROXY)
+                ): bool,
+                vol.Optional(
+                    CONF_IMAGE_CACHE_MB,
+                    default=options.get(CONF_IMAGE_CACHE_MB, DEFAULT_IMAGE_CACHE_MB)
+                ): vol.All(vol.Coerce(int), vol.Range(min=1, max=2000)),
+                vol.Optional(
+                    CONF_SHOPPING_EXPIRY_DAYS,
+                    default=options.get(CONF_SHOPPING_EXPIRY_DAYS, DEFAULT_SHOPPING_EXPIRY_DAYS)
+                ): vol.All(vol.Coerce(int), vol.Range(min=0, max=60)),
+            })
+        )
@@ -1,3 +1,88 @@
+from datetime import timedelta
+
 DOMAIN = "speisekammer"
 CONF_TOKEN = "token"
 CONF_COMMUNITY_ID = "community_id"
+CONF_COMMUNITIES = "communities"  # id -> name, mehrere Communities in einem Eintrag
+
+# Optionen
+CONF_TIMEOUT = "timeout"
+CONF_PRODUCT_CACHE_TTL = "product_cache_ttl"
+CONF_PARALLEL_REQUESTS = "parallel_requests"
+CONF_COMPACT_ATTRIBUTES = "compact_attributes"
+CONF_MAX_ROWS = "max_rows"
+CONF_EXPIRY_DAYS = "expiry_days"
+CONF_SCAN_DEBOUNCE_MS = "scan_debounce_ms"
+CONF_SLOW_CALL_MS = "slow_call_ms"
+CONF_MAX_SCAN_INTERVAL = "max_scan_interval"
+CONF_PUSH = "push_updates"
+CONF_WEBHOOK_ID = "webhook_id"
+CONF_IMAGE_PROXY = "image_proxy"
+CONF_IMAGE_CACHE_MB = "image_cache_mb"
+CONF_SHOPPING_EXPIRY_DAYS = "shopping_expiry_days"
+
+# HTTP-Verbindung
+API_BASE_URL = "https://api.speisekammer.app"
+OFF_BASE_URL = "https://world.openfoodfacts.org"
+DEFAULT_TIMEOUT = 30  # Sekunden
+CONNECTION_LIMIT = 20
+CONNECTION_LIMIT_PER_HOST = 8
+DNS_CACHE_TTL = 300  # Sekunden
+KEEPALIVE_TIMEOUT = 60  # Sekunden
+DEFAULT_PARALLEL_REQUESTS = 4  # gleichzeitige Anfragen beim Fan-out
+STOCK_BATCH_SIZE = 50  # Artikel pro PUT /stock Anfrage
+DEFAULT_SLOW_CALL_MS = 0  # langsame Aufrufe ab dieser Dauer loggen, 0 = aus
+MICRO_CACHE_TTL = 2  # Sekunden, in denen gleiche GET-Anfragen das letzte Ergebnis teilen
+
+# Abfrageintervall für den Lagerbestand (adaptiv je Lagerort)
+SCAN_INTERVAL = timedelta(minutes=10)  # Startwert und Intervall für die Lagerort-Liste
+MIN_SCAN_INTERVAL = timedelta(minutes=1)  # nach Änderungen und lokalen Schreibvorgängen
+DEFAULT_MAX_SCAN_INTERVAL = 60  # Minuten, Obergrenze für ruhige Lagerorte
+DEFAULT_PUSH = False  # Änderungen per Webhook empfangen
+PUSH_CONSISTENCY_INTERVAL = timedelta(hours=1)  # Abgleich per Abfrage, solange Push aktiv ist
+SNAPSHOT_SAVE_DELAY = 10  # Sekunden
+
+# OpenFoodFacts-Produktcache
+DEFAULT_PRODUCT_CACHE_TTL = 30  # Tage
+PRODUCT_CACHE_NEGATIVE_TTL = timedelta(days=1)  # für unbekannte GTINs (404)
+PRODUCT_CACHE_MAX_SIZE = 5000
+PRODUCT_CACHE_SAVE_DELAY = 30  # Sekunden
+STORAGE_VERSION = 1
+
+# Lokaler Bildcache (Produktbilder über Home Assistant statt direkt von OpenFoodFacts)
+DEFAULT_IMAGE_PROXY = True
+DEFAULT_IMAGE_CACHE_MB = 50  # Gesamtgröße auf der Platte, älteste Bilder werden verdrängt
+IMAGE_URL_PATH = "/api/speisekammer/image"
+IMAGE_THUMBNAIL_SIZE = 128  # Pixel, längere Seite
+IMAGE_MAX_SOURCE_BYTES = 5 * 1024 * 1024
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Verbrauchsverlauf (SQLite je Community)
+HISTORY_FLUSH_DELAY = 30  # Sekunden, Änderungen werden gebündelt geschrieben
+HISTORY_RETENTION_DAYS = 400
+DEFAULT_HISTORY_DAYS = 30  # Zeitraum für Verbrauchsraten
+
+# Einkaufsliste
+DEFAULT_SHOPPING_EXPIRY_DAYS = 2  # Ware, die innerhalb dieser Tage abläuft, zählt nicht zum Bestand
+DEFAULT_SHOPPING_LIST_ENTITY = "todo.shopping_list"
+SHOPPING_SAVE_DELAY = 5  # Sekunden
+
+# Inventur
+INVENTUR_SAVE_DELAY = 5  # Sekunden
+DEFAULT_SCAN_DEBOUNCE_MS = 500  # höchstens ein State-Write pro Fenster
+
+# Sensor-Attribute
+DEFAULT_COMPACT_ATTRIBUTES = False
+DEFAULT_MAX_ROWS = 100  # Zeilen im "table"-Attribut, 0 = unbegrenzt
+
+# Suche
+DEFAULT_SEARCH_LIMIT = 20  # Treffer pro Suchanfrage
+
+# Ablaufdaten
+DEFAULT_EXPIRY_DAYS = 3  # "läuft bald ab" = innerhalb dieser Tage
+
+# Schreib-Warteschlange
+QUEUE_FLUSH_DELAY = 2  # Sekunden, in denen Änderungen gesammelt werden
+QUEUE_SAVE_DELAY = 1  # Sekunden
+QUEUE_BACKOFF_BASE = 5  # Sekunden
+QUEUE_BACKOFF_MAX = 900  # Sekunden
@@ -0,0 +1,363 @@
+from datetime import timedelta
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.event import async_track_point_in_time
+from homeassistant.helpers.storage import Store
+from homeassistant.helpers.update_coordinator import DataUpdateCoordinator, UpdateFailed
+from homeassistant.util import dt as dt_util
+from .api import SpeisekammerAPI
+from .const import (
+    DOMAIN,
+    SCAN_INTERVAL,
+    MIN_SCAN_INTERVAL,
+    DEFAULT_MAX_SCAN_INTERVAL,
+    PUSH_CONSISTENCY_INTERVAL,
+    SNAPSHOT_SAVE_DELAY,
+    STORAGE_VERSION,
+    DEFAULT_EXPIRY_DAYS,
+)
+from .expiry import ExpiryIndex
+from .locations import LocationRegistry
+from .poll_scheduler import PollScheduler
+from .search_index import SearchIndex
+from .totals import TotalsIndex
+from .product_cache import ProductCache
+from .stock_index import StockIndex, normalize_gtin, to_stock_item
+import itertools
+import logging
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class SpeisekammerCoordinator(DataUpdateCoordinator):
+    """Holt den Bestand aller Lagerorte (Intervall adaptiv je Lagerort) und teilt ihn mit allen Entities"""
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        api: SpeisekammerAPI,
+        community_id: str,
+        product_cache: ProductCache,
+        entry_id: str,
+        expiry_days: int = DEFAULT_EXPIRY_DAYS,
+        max_scan_interval: int = DEFAULT_MAX_SCAN_INTERVAL,
+        push: bool = False,
+        image_cache=None,
+        history=None,
+    ):
+        super().__init__(hass, _LOGGER, name=DOMAIN, update_interval=SCAN_INTERVAL)
+        self.api = api
+        self.community_id = community_id
+        self.storage_id = entry_id
+        self.product_cache = product_cache
+        self.image_cache = image_cache
+        self.history = history
+        self.index = StockIndex()
+        self.expiry = ExpiryIndex()
+        self.search = SearchIndex()
+        self.totals = TotalsIndex()
+        self.expiry_window = timedelta(days=expiry_days).total_seconds()
+        self._unsub_expiry_timer = None
+        max_interval = timedelta(minutes=max_scan_interval).total_seconds()
+        if push:
+            # Änderungen kommen per Webhook, Abfragen dienen nur noch dem Abgleich
+            consistency = PUSH_CONSISTENCY_INTERVAL.total_seconds()
+            self.scheduler = PollScheduler(consistency, consistency, max(max_interval, consistency))
+        else:
+            self.scheduler = PollScheduler(
+                MIN_SCAN_INTERVAL.total_seconds(), SCAN_INTERVAL.total_seconds(), max_interval
+            )
+        self.push_enabled = push
+        self.push_stats = {"events": 0, "applied": 0, "last": None}
+        # Versionen lokaler/Push-Änderungen; Start bei der Uhrzeit, damit sich auch
+        # nach einem Neustart keine Version aus dem Snapshot wiederholt
+        self._local_versions = itertools.count(int(time.time() * 1000))
+        # Einzige Quelle für die Lagerorte; die Liste wird höchstens alle SCAN_INTERVAL neu geladen
+        self.registry = LocationRegistry(SCAN_INTERVAL.total_seconds())
+        # Letzter Snapshot auf der Platte, damit Entities beim Start sofort Daten haben
+        self._snapshot_store = Store(hass, STORAGE_VERSION, f"{DOMAIN}.snapshot.{entry_id}")
+        self.snapshot_restored = False
+
+    async def async_restore_snapshot(self) -> bool:
+        """Letzten Snapshot ohne Netzwerkzugriff laden"""
+        data = await self._snapshot_store.async_load()
+        if not data or not data.get("locations"):
+            return False
+        self.data = data
+        self.registry.restore(data["locations"])
+        self.index.rebuild(data["stock"])
+        self.search.rebuild(data["stock"])
+        self.totals.rebuild(data["stock"])
+        for loc_id, items in data["stock"].items():
+            self.expiry.update_location(loc_id, items)
+        self.snapshot_restored = True
+        _LOGGER.debug("Snapshot wiederhergestellt: %d Lagerorte", len(data["locations"]))
+        return True
+
+    async def _async_update_data(self):
+        now = time.time()
+        previous = self.data or {}
+        try:
+            if not previous or self.registry.expired:
+                locations = await self.api.get_storage_locations(self.community_id)
+                if not locations and self.data:
+                    raise UpdateFailed("Keine Lagerorte erhalten")
+                self.registry.update(locations)
+            location_names = dict(self.registry.names)
+            self.scheduler.sync_locations(location_names)
+
+            # Nur fällige Lagerorte abrufen, parallel (begrenzt durch das Limit der API)
+            fetched = await self.api.get_items_for_locations(self.community_id, self.scheduler.due(now))
+
+            previous_stock = previous.get("stock", {})
+            previous_versions = previous.get("versions", {})
+            stock = {loc_id: previous_stock.get(loc_id, []) for loc_id in location_names}
+            versions = {loc_id: previous_versions.get(loc_id) for loc_id in location_names}
+            changed = []
+            for loc_id, items in fetched.items():
+                if items is None:
+                    # Abruf fehlgeschlagen (z.B. 429/5xx): alter Stand bleibt stehen
+                    self.scheduler.record(loc_id, False, now)
+                    continue
+                version = self.api.stock_version(self.community_id, loc_id)
+                is_changed = version is not None and version != previous_versions.get(loc_id)
+                if previous_versions.get(loc_id) is None:
+                    # Erster Abruf ist die Ausgangsbasis, keine Änderung
+                    self.scheduler.baseline(loc_id, now)
+                else:
+                    self.scheduler.record(loc_id, is_changed, now)
+                if is_changed:
+                    if previous and loc_id in previous_stock:
+                        # Erster Stand eines Lagerorts ist nur die Ausgangsbasis
+                        self._record_history(loc_id, previous_stock[loc_id], items)
+                    stock[loc_id] = items
+                    versions[loc_id] = version
+                    changed.append(loc_id)
+            removed = [loc_id for loc_id in previous_stock if loc_id not in stock]
+
+            if changed or removed or not previous:
+                # Produktdaten nur für GTINs holen, die noch nicht im Cache sind
+                await self.product_cache.async_prefetch(
+                    {item.get("gtin") for loc_id in changed for item in stock[loc_id]}
+                )
+                self.index.rebuild(stock)
+                # Ablauf- und Suchindex nur für geänderte Lagerorte abgleichen
+                for loc_id in changed:
+                    self.expiry.update_location(loc_id, stock[loc_id])
+                    self.search.update_location(loc_id, stock[loc_id])
+                    self.totals.update_location(loc_id, stock[loc_id])
+                for loc_id in removed:
+                    self.expiry.remove_location(loc_id)
+                    self.search.remove_location(loc_id)
+                    self.totals.remove_location(loc_id)
+                self._schedule_expiry_timer()
+                self._snapshot_store.async_delay_save(lambda: self.data, SNAPSHOT_SAVE_DELAY)
+            else:
+                # Nichts geändert: Snapshot und Index unverändert weiterverwenden
+                stock = previous_stock
+        except UpdateFailed:
+            raise
+        except Exception as e:
+            raise UpdateFailed(f"Fehler beim Abrufen des Lagerbestands: {e}") from e
+        finally:
+            self._schedule_next_poll()
+
+        return {
+            "locations": location_names,
+            "stock": stock,
+            "versions": versions,
+        }
+
+    def _schedule_next_poll(self):
+        """Nächsten Abruf auf den frühesten fälligen Lagerort legen"""
+        next_poll = self.scheduler.next_poll()
+        delay = SCAN_INTERVAL.total_seconds() if next_poll is None else next_poll - time.time()
+        self.update_interval = timedelta(seconds=max(delay, self.scheduler.min_interval))
+
+    async def async_force_refresh(self, location_ids=None):
+        """Manuelle Aktualisierung (Service speisekammer.refresh); ohne IDs alle Lagerorte"""
+        if location_ids is None:
+            self.registry.invalidate()
+            self.api.forget_cached(self.community_id)
+        else:
+            for location_id in location_ids:
+                self.api.forget_cached(self.community_id, location_id)
+        self.scheduler.force(location_ids, time.time())
+        await self.async_refresh()
+
+    async def async_shutdown(self):
+        self._cancel_expiry_timer()
+        await super().async_shutdown()
+
+    def _cancel_expiry_timer(self):
+        if self._unsub_expiry_timer:
+            self._unsub_expiry_timer()
+            self._unsub_expiry_timer = None
+
+    def _schedule_expiry_timer(self):
+        """Ein einziger Timer auf den nächsten Ablauf, statt zu pollen"""
+        self._cancel_expiry_timer()
+        next_change = self.expiry.next_change(time.time(), self.expiry_window)
+        if next_change is None:
+            return
+        self._unsub_expiry_timer = async_track_point_in_time(
+            self.hass, self._handle_expiry_timer, dt_util.utc_from_timestamp(next_change + 1)
+        )
+
+    @callback
+    def _handle_expiry_timer(self, _now):
+        self._unsub_expiry_timer = None
+        self.async_update_listeners()
+        self._schedule_expiry_timer()
+
+    @property
+    def locations(self) -> dict:
+        """Lagerorte als id -> name"""
+        return self.registry.names
+
+    @property
+    def location_map(self) -> dict:
+        """Lagerorte als name -> id"""
+        return self.registry.ids
+
+    def get_items(self, location_id: str) -> list:
+        """Artikel eines Lagerorts aus dem letzten Snapshot"""
+        return (self.data or {}).get("stock", {}).get(location_id, [])
+
+    def get_version(self, location_id: str):
+        """Version des Bestands eines Lagerorts; ändert sich bei jedem neuen Inhalt"""
+        return (self.data or {}).get("versions", {}).get(location_id)
+
+    def get_image(self, gtin: str) -> str:
+        return self.local_image(self.product_cache.image_url(gtin))
+
+    def local_image(self, url: str) -> str:
+        """Bild-URL über den lokalen Bildcache, falls aktiviert"""
+        if self.image_cache is None or not url:
+            return url
+        return self.image_cache.local_url(url)
+
+    def find_gtin(self, gtin: str) -> list:
+        """Alle (location_id, item) Paare mit dieser GTIN, direkt aus dem Index"""
+        return list(self.index.lookup(gtin).items())
+
+    async def async_find_gtin(self, gtin: str) -> list:
+        """Wie find_gtin, fragt bei einem Index-Miss aber die API für alle Lagerorte ab"""
+        matches = self.find_gtin(gtin)
+        if matches:
+            self.api.metrics.cache_hit("gtin_index")
+            return matches
+        self.api.metrics.cache_miss("gtin_index")
+        match = await self.api.find_item_by_gtin(self.community_id, list(self.locations), normalize_gtin(gtin))
+        if match:
+            self._store_item(*match)
+            matches.append(match)
+        return matches
+
+    def apply_local_write(self, location_id: str, items: list):
+        """Erfolgreiche Schreibvorgänge sofort in Snapshot und Index übernehmen"""
+        # Der Lagerort ist gerade aktiv: bald bestätigen und vorerst häufiger abfragen
+        self.scheduler.boost(location_id, time.time())
+        for item in items:
+            if item.get("gtin") is None:
+                continue
+            self._store_item(location_id, to_stock_item(item, self.index.get(item["gtin"], location_id)))
+
+    @callback
+    def apply_push(self, events: list) -> int:
+        """
+        Änderungsmeldungen (siehe push.parse_push_events) in Snapshot und Indizes
+        übernehmen. Nur betroffene Lagerorte erhalten eine neue Version, alle
+        anderen Sensoren überspringen die Aktualisierung. Liefert die Anzahl
+        übernommener Ereignisse.
+        """
+        applied = 0
+        refetch = []
+        for event in events:
+            location_id = event["location_id"]
+            if location_id not in self.locations:
+                _LOGGER.debug("Push für unbekannten Lagerort %s, Lagerorte werden neu geladen", location_id)
+                self.registry.invalidate()
+                refetch.append(location_id)
+                continue
+            if "stock" in event:
+                self._replace_location(location_id, event["stock"])
+            elif event["items"] or event["removed"]:
+                for item in event["items"]:
+                    self._store_item(location_id, to_stock_item(item, self.index.get(item["gtin"], location_id)))
+                for gtin in event["removed"]:
+                    self._remove_item(location_id, gtin)
+            else:
+                # Hinweis ohne Inhalt: nur diesen Lagerort abfragen
+                refetch.append(location_id)
+                continue
+            applied += 1
+
+        self.push_stats["events"] += len(events)
+        self.push_stats["applied"] += applied
+        self.push_stats["last"] = time.time()
+        if refetch:
+            for location_id in refetch:
+                self.api.forget_cached(self.community_id, location_id)
+            self.scheduler.force(refetch, time.time())
+            self.hass.async_create_task(self.async_request_refresh())
+        if applied:
+            self._snapshot_store.async_delay_save(lambda: self.data, SNAPSHOT_SAVE_DELAY)
+            self.async_update_listeners()
+        return applied
+
+    def _record_history(self, location_id: str, old_items: list, new_items: list):
+        if self.history is not None:
+            self.history.record(location_id, old_items, new_items)
+
+    def total_count(self, gtin) -> float:
+        """Menge einer GTIN über alle Lagerorte"""
+        return self.totals.total(gtin)
+
+    def _replace_location(self, location_id: str, items: list):
+        stock = self.data["stock"]
+        self._record_history(location_id, stock.get(location_id, []), items)
+        stock[location_id] = list(items)
+        self.data.setdefault("versions", {})[location_id] = f"push-{next(self._local_versions)}"
+        self.index.rebuild(stock)
+        self.expiry.update_location(location_id, stock[location_id])
+        self.search.update_location(location_id, stock[location_id])
+        self.totals.update_location(location_id, stock[location_id])
+        self._schedule_expiry_timer()
+
+    def _remove_item(self, location_id: str, gtin):
+        gtin = normalize_gtin(gtin)
+        stock = (self.data or {}).get("stock", {})
+        if location_id in stock:
+            location_items = [
+                existing for existing in stock[location_id]
+                if normalize_gtin(existing.get("gtin")) != gtin
+            ]
+            self._record_history(location_id, stock[location_id], location_items)
+            stock[location_id] = location_items
+            self.data.setdefault("versions", {})[location_id] = f"local-{next(self._local_versions)}"
+        self.index.remove_item(location_id, gtin)
+        self.expiry.remove_item(location_id, gtin)
+        self.search.remove_item(location_id, gtin)
+        self.totals.remove_item(location_id, gtin)
+        self._schedule_expiry_timer()
+
+    def _store_item(self, location_id: str, item: dict):
+        gtin = normalize_gtin(item.get("gtin"))
+        stock = (self.data or {}).get("stock", {})
+        if location_id in stock:
+            # Neue Liste statt Änderung in-place: die alte gehört auch dem ETag-Cache der API
+            location_items = [
+                existing for existing in stock[location_id]
+                if normalize_gtin(existing.get("gtin")) != gtin
+            ]
+            location_items.append(item)
+            self._record_history(location_id, stock[location_id], location_items)
+            stock[location_id] = location_items
+            # Lokale Version erzwingt den Neuaufbau der betroffenen Sensoren
+            self.data.setdefault("versions", {})[location_id] = f"local-{next(self._local_versions)}"
+        self.index.set_item(location_id, item)
+        self.expiry.set_item(location_id, item)
+        self.search.set_item(location_id, item)
+        self.totals.set_item(location_id, item)
+        self._schedule_expiry_timer()
@@ -0,0 +1,54 @@
+from homeassistant.components.diagnostics import async_redact_data
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+from .const import DOMAIN, CONF_TOKEN, CONF_WEBHOOK_ID
+import time
+
+TO_REDACT = {CONF_TOKEN, CONF_WEBHOOK_ID}
+
+
+async def async_get_config_entry_diagnostics(hass: HomeAssistant, entry: ConfigEntry) -> dict:
+    """Diagnosedaten für den Download in Home Assistant"""
+    data = hass.data[DOMAIN][entry.entry_id]
+    return {
+        "entry": async_redact_data(entry.as_dict(), TO_REDACT),
+        "setup": data.get("setup", {}),
+        "communities": {
+            community_id: _community_diagnostics(community)
+            for community_id, community in data["communities"].items()
+        },
+        "metrics": data["api"].metrics.as_dict(),
+        "shared_metrics": _shared_metrics(hass),
+        "image_cache": _image_cache_diagnostics(hass),
+    }
+
+
+def _shared_metrics(hass: HomeAssistant):
+    # Produkt- und Bildcache gehören allen Einträgen gemeinsam
+    shared_api = hass.data.get("speisekammer_shared_api")
+    return shared_api.metrics.as_dict() if shared_api is not None else None
+
+
+def _image_cache_diagnostics(hass: HomeAssistant):
+    image_cache = hass.data.get("speisekammer_image_cache")
+    if image_cache is None:
+        return None
+    return {"images": len(image_cache), "bytes": image_cache.total_bytes}
+
+
+def _community_diagnostics(community: dict) -> dict:
+    coordinator = community["coordinator"]
+    return {
+        "coordinator": {
+            "last_update_success": coordinator.last_update_success,
+            "locations": len(coordinator.locations),
+            "items": sum(len(coordinator.get_items(loc_id)) for loc_id in coordinator.locations),
+            "indexed_gtins": len(coordinator.index),
+            "expiry_entries": len(coordinator.expiry),
+            "update_interval_s": coordinator.update_interval.total_seconds(),
+            "polling": coordinator.scheduler.as_dict(time.time()),
+            "push": {"enabled": coordinator.push_enabled, **coordinator.push_stats},
+        },
+        "write_queue": {"pending": len(community["write_queue"])},
+        "shopping": {"thresholds": len(community["shopping"]), "indexed_totals": len(coordinator.totals)},
+    }
@@ -0,0 +1,91 @@
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, timezone
+from .stock_index import normalize_gtin
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def parse_best_before(value):
+    """bestBeforeDate ({"ts": ms}, Millisekunden oder ISO-Datum) als Unix-Zeit in Sekunden"""
+    if isinstance(value, dict):
+        value = value.get("ts")
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return value / 1000
+    try:
+        dt = datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+class ExpiryIndex:
+    """Alle Artikel mit MHD über alle Lagerorte, sortiert nach Ablaufzeitpunkt"""
+
+    def __init__(self):
+        # Sortierte Einträge (ts, location_id, gtin, name, count)
+        self._entries = []
+        # (location_id, gtin) -> Einträge dieses Artikels, zum gezielten Entfernen
+        self._by_key = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def set_item(self, location_id: str, item: dict):
+        """Artikel (neu) eintragen; ersetzt vorhandene Einträge desselben Artikels"""
+        gtin = normalize_gtin(item.get("gtin"))
+        self.remove_item(location_id, gtin)
+        entries = []
+        for attr in item.get("attributes") or []:
+            count = attr.get("count", 0)
+            ts = parse_best_before(attr.get("bestBeforeDate"))
+            if count > 0 and ts is not None:
+                entry = (ts, location_id, gtin, item.get("name") or "Unbekannt", count)
+                insort(self._entries, entry)
+                entries.append(entry)
+        if entries:
+            self._by_key[(location_id, gtin)] = entries
+
+    def remove_item(self, location_id: str, gtin):
+        for entry in self._by_key.pop((location_id, normalize_gtin(gtin)), []):
+            pos = bisect_left(self._entries, entry)
+            if pos < len(self._entries) and self._entries[pos] == entry:
+                del self._entries[pos]
+
+    def update_location(self, location_id: str, items: list):
+        """Lagerort abgleichen: nur hinzugekommene, geänderte und entfernte Artikel anfassen"""
+        current = {normalize_gtin(item.get("gtin")): item for item in items if item.get("gtin") is not None}
+        for loc_id, gtin in [key for key in self._by_key if key[0] == location_id]:
+            if gtin not in current:
+                self.remove_item(loc_id, gtin)
+        for item in current.values():
+            self.set_item(location_id, item)
+
+    def remove_location(self, location_id: str):
+        for loc_id, gtin in [key for key in self._by_key if key[0] == location_id]:
+            self.remove_item(loc_id, gtin)
+
+    def expired(self, now: float) -> list:
+        """Einträge mit MHD vor `now`, älteste zuerst"""
+        return self._entries[:bisect_left(self._entries, (now,))]
+
+    def expiring(self, now: float, window: float) -> list:
+        """Einträge, deren MHD zwischen `now` und `now + window` liegt"""
+        start = bisect_left(self._entries, (now,))
+        end = bisect_right(self._entries, (now + window, chr(0x10FFFF)))
+        return self._entries[start:end]
+
+    def next_change(self, now: float, window: float):
+        """Nächster Zeitpunkt, an dem ein Artikel abläuft oder in das Fenster rutscht"""
+        candidates = []
+        pos = bisect_right(self._entries, (now, chr(0x10FFFF)))
+        if pos < len(self._entries):
+            candidates.append(self._entries[pos][0])
+        pos = bisect_right(self._entries, (now + window, chr(0x10FFFF)))
+        if pos < len(self._entries):
+            candidates.append(self._entries[pos][0] - window)
+        return min(candidates) if candidates else None
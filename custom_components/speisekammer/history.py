@@ -0,0 +1,215 @@
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.event import async_call_later
+from .const import HISTORY_FLUSH_DELAY, HISTORY_RETENTION_DAYS
+from .stock_index import normalize_gtin
+import asyncio
+import logging
+import sqlite3
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+DAY = 86400
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS gtins (id INTEGER PRIMARY KEY, gtin TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS locations (id INTEGER PRIMARY KEY, location_id TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS deltas (
+    ts INTEGER NOT NULL,
+    gtin_id INTEGER NOT NULL,
+    location_id INTEGER NOT NULL,
+    delta NUMERIC NOT NULL,
+    consumed_total NUMERIC NOT NULL
+);
+CREATE INDEX IF NOT EXISTS deltas_gtin_ts ON deltas (gtin_id, ts, consumed_total, delta);
+CREATE INDEX IF NOT EXISTS deltas_ts ON deltas (ts);
+"""
+
+
+def item_count(item: dict):
+    return sum(attr.get("count", 0) or 0 for attr in item.get("attributes") or [])
+
+
+def stock_totals(items: list) -> dict:
+    """Menge je GTIN in einer Artikelliste"""
+    totals = {}
+    for item in items:
+        gtin = item.get("gtin")
+        if gtin is None:
+            continue
+        gtin = normalize_gtin(gtin)
+        totals[gtin] = totals.get(gtin, 0) + item_count(item)
+    return totals
+
+
+def stock_deltas(old_items: list, new_items: list) -> dict:
+    """Mengenänderung je GTIN zwischen zwei Ständen eines Lagerorts (nur != 0)"""
+    old = stock_totals(old_items)
+    new = stock_totals(new_items)
+    deltas = {}
+    for gtin in old.keys() | new.keys():
+        delta = new.get(gtin, 0) - old.get(gtin, 0)
+        if delta:
+            deltas[gtin] = delta
+    return deltas
+
+
+class ConsumptionHistory:
+    """
+    Verbrauchsverlauf einer Community in SQLite. Gespeichert werden nur
+    Mengenänderungen je GTIN und Lagerort (GTINs, Lagerorte und Zeitpunkte als
+    Ganzzahlen), jeweils mit dem laufenden Gesamtverbrauch der GTIN. Der
+    Verbrauch in einem Zeitraum ist damit eine Differenz: ein Indexzugriff je
+    Produkt statt einer Summe über alle Zeilen.
+    """
+
+    def __init__(self, hass: HomeAssistant, path: str):
+        self.hass = hass
+        self._path = path
+        self._conn = None
+        self._lock = asyncio.Lock()  # eine Verbindung, immer nur ein Executor-Thread
+        self._gtin_ids = {}
+        self._location_ids = {}
+        self._pending = []  # (ts, gtin, location_id, delta, consumed_total), wird gebündelt geschrieben
+        self._consumed = {}  # gtin -> laufender Gesamtverbrauch
+        self._unsub_flush = None
+        self.started = None  # Beginn der Aufzeichnung
+
+    def __len__(self):
+        return len(self._pending)
+
+    async def async_open(self):
+        async with self._lock:
+            await self.hass.async_add_executor_job(self._open)
+        _LOGGER.debug("Verbrauchsverlauf geöffnet: %s", self._path)
+
+    def _open(self):
+        conn = sqlite3.connect(self._path, check_same_thread=False)
+        conn.executescript(_SCHEMA)
+        now = int(time.time())
+        conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('started', ?)", (now,))
+        conn.execute("DELETE FROM deltas WHERE ts < ?", (now - HISTORY_RETENTION_DAYS * DAY,))
+        conn.commit()
+        self.started = conn.execute("SELECT value FROM meta WHERE key = 'started'").fetchone()[0]
+        self._gtin_ids = dict(conn.execute("SELECT gtin, id FROM gtins"))
+        self._location_ids = dict(conn.execute("SELECT location_id, id FROM locations"))
+        self._consumed = dict(conn.execute(
+            "SELECT g.gtin, (SELECT consumed_total FROM deltas WHERE gtin_id = g.id"
+            " ORDER BY ts DESC, consumed_total DESC LIMIT 1) AS total FROM gtins g WHERE total IS NOT NULL"
+        ))
+        self._conn = conn
+
+    async def async_close(self):
+        await self.async_flush()
+        async with self._lock:
+            if self._conn is not None:
+                await self.hass.async_add_executor_job(self._conn.close)
+                self._conn = None
+
+    @callback
+    def record(self, location_id: str, old_items: list, new_items: list, ts: float = None):
+        """Unterschied zweier Stände eines Lagerorts vormerken (ohne Plattenzugriff)"""
+        deltas = stock_deltas(old_items, new_items)
+        if not deltas:
+            return
+        ts = int(ts or time.time())
+        for gtin, delta in deltas.items():
+            consumed = self._consumed.get(gtin, 0) + max(-delta, 0)
+            self._consumed[gtin] = consumed
+            self._pending.append((ts, gtin, location_id, delta, consumed))
+        if self._unsub_flush is None:
+            self._unsub_flush = async_call_later(self.hass, HISTORY_FLUSH_DELAY, self._handle_flush_timer)
+
+    @callback
+    def _handle_flush_timer(self, _now):
+        self._unsub_flush = None
+        self.hass.async_create_task(self.async_flush())
+
+    async def async_flush(self):
+        if self._unsub_flush is not None:
+            self._unsub_flush()
+            self._unsub_flush = None
+        if not self._pending or self._conn is None:
+            return
+        rows, self._pending = self._pending, []
+        async with self._lock:
+            try:
+                await self.hass.async_add_executor_job(self._write, rows)
+            except sqlite3.Error as e:
+                _LOGGER.warning("Verbrauchsverlauf konnte nicht gespeichert werden: %s", e)
+
+    def _key_id(self, table: str, column: str, ids: dict, key: str) -> int:
+        key_id = ids.get(key)
+        if key_id is None:
+            key_id = self._conn.execute(f"INSERT INTO {table} ({column}) VALUES (?)", (key,)).lastrowid
+            ids[key] = key_id
+        return key_id
+
+    def _write(self, rows: list):
+        try:
+            self._insert(rows)
+        except sqlite3.Error:
+            # Zurückgerollte IDs nicht weiterverwenden
+            self._gtin_ids = dict(self._conn.execute("SELECT gtin, id FROM gtins"))
+            self._location_ids = dict(self._conn.execute("SELECT location_id, id FROM locations"))
+            raise
+
+    def _insert(self, rows: list):
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO deltas (ts, gtin_id, location_id, delta, consumed_total) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (
+                        ts,
+                        self._key_id("gtins", "gtin", self._gtin_ids, gtin),
+                        self._key_id("locations", "location_id", self._location_ids, location_id),
+                        delta,
+                        consumed,
+                    )
+                    for ts, gtin, location_id, delta, consumed in rows
+                ],
+            )
+
+    async def _async_query(self, sql: str, params: tuple) -> list:
+        await self.async_flush()
+        if self._conn is None:
+            return []
+        async with self._lock:
+            return await self.hass.async_add_executor_job(
+                lambda: self._conn.execute(sql, params).fetchall()
+            )
+
+    async def async_consumption(self, days: float, gtin: str = None) -> dict:
+        """
+        Verbrauch je GTIN der letzten `days` Tage als gtin -> {"consumed", "per_day"};
+        per_day bezieht sich auf den tatsächlich aufgezeichneten Zeitraum.
+        """
+        now = time.time()
+        since = int(now - days * DAY)
+        # Stand vor der ersten Änderung im Zeitraum, je GTIN ein Zugriff über den Index
+        # (bei gleicher Sekunde ist die erste Änderung die mit dem kleinsten Stand)
+        sql = (
+            "SELECT g.gtin, (SELECT consumed_total - MAX(-delta, 0) FROM deltas"
+            " WHERE gtin_id = g.id AND ts >= ? ORDER BY ts, consumed_total, delta LIMIT 1) AS base"
+            " FROM gtins g WHERE base IS NOT NULL"
+        )
+        params = (since,)
+        if gtin is not None:
+            sql += " AND g.gtin = ?"
+            params += (normalize_gtin(gtin),)
+        rows = await self._async_query(sql, params)
+        window = max(now - max(since, self.started or since), DAY) / DAY
+        result = {}
+        for row_gtin, base in rows:
+            consumed = self._consumed.get(row_gtin, 0) - base
+            result[row_gtin] = {"consumed": consumed, "per_day": round(consumed / window, 3)}
+        return result
+
+    async def async_changes(self, gtin: str, days: float) -> list:
+        """Mengenänderungen einer GTIN über alle Lagerorte als [(ts, delta)], älteste zuerst"""
+        return await self._async_query(
+            "SELECT d.ts, SUM(d.delta) FROM deltas d JOIN gtins g ON g.id = d.gtin_id"
+            " WHERE g.gtin = ? AND d.ts >= ? GROUP BY d.ts ORDER BY d.ts",
+            (normalize_gtin(gtin), int(time.time() - days * DAY)),
+        )
@@ -0,0 +1,221 @@
+from collections import OrderedDict
+from aiohttp import web
+from homeassistant.components.http import HomeAssistantView
+from homeassistant.core import HomeAssistant
+from .api import SingleFlight, SpeisekammerAPI
+from .const import (
+    IMAGE_URL_PATH,
+    IMAGE_THUMBNAIL_SIZE,
+    IMAGE_MAX_SOURCE_BYTES,
+    IMAGE_CACHE_CONTROL,
+)
+import hashlib
+import io
+import logging
+import os
+import re
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow gehört zu Home Assistant, ohne wird das Original gespeichert
+    Image = None
+
+_LOGGER = logging.getLogger(__name__)
+_KEY_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+def image_key(url: str) -> str:
+    # OpenFoodFacts-URLs enthalten die Bildrevision: gleiche URL = gleiches Bild
+    return hashlib.sha256(url.encode()).hexdigest()[:32]
+
+
+def make_thumbnail(data: bytes, size: int = IMAGE_THUMBNAIL_SIZE) -> bytes:
+    """Bild auf höchstens size x size verkleinern (JPEG); läuft im Executor"""
+    if Image is None:
+        return data
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.thumbnail((size, size))
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            out = io.BytesIO()
+            image.save(out, format="JPEG", quality=80, optimize=True)
+    except Exception as e:
+        _LOGGER.debug("Bild konnte nicht verkleinert werden, Original wird gespeichert: %s", e)
+        return data
+    return out.getvalue() if out.tell() < len(data) else data
+
+
+def content_type(data: bytes) -> str:
+    if data.startswith(b"\x89PNG"):
+        return "image/png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/jpeg"
+
+
+class ImageCache:
+    """
+    Produktbilder lokal ausliefern: einmal laden, verkleinern und unter ihrem
+    Hash auf der Platte ablegen. Die Gesamtgröße ist begrenzt, verdrängt werden
+    die am längsten nicht angefragten Bilder (LRU).
+    """
+
+    def __init__(self, hass: HomeAssistant, api: SpeisekammerAPI, directory: str, max_bytes: int):
+        self.hass = hass
+        self.api = api
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._sources = {}  # key -> Quell-URL; nur bekannte Bilder werden ausgeliefert
+        self._files = OrderedDict()  # key -> Dateigröße, älteste Anfrage zuerst
+        self._total = 0
+        # Gleichzeitige Anfragen (mehrere Tablets) laden ein Bild nur einmal
+        self._flight = SingleFlight(0, api.metrics, "image_proxy_dedup")
+
+    def __len__(self):
+        return len(self._files)
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._directory, key[:2], key)
+
+    async def async_load(self):
+        """Vorhandene Bilder einlesen, nach letzter Nutzung sortiert"""
+        files = await self.hass.async_add_executor_job(self._scan)
+        for key, size in files:
+            self._files[key] = size
+            self._total += size
+        _LOGGER.debug("Bildcache geladen: %d Bilder, %d Bytes", len(self._files), self._total)
+        await self._async_evict()
+
+    def _scan(self) -> list:
+        found = []
+        if not os.path.isdir(self._directory):
+            return found
+        for sub in os.scandir(self._directory):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if _KEY_RE.match(entry.name):
+                    stat = entry.stat()
+                    found.append((stat.st_mtime, entry.name, stat.st_size))
+        found.sort()
+        return [(key, size) for _, key, size in found]
+
+    def local_url(self, url: str) -> str:
+        """Lokale URL für ein Produktbild (ohne Netzwerkzugriff)"""
+        if not url:
+            return ""
+        key = image_key(url)
+        self._sources[key] = url
+        return f"{IMAGE_URL_PATH}/{key}"
+
+    async def async_get(self, key: str):
+        """Bilddaten aus dem Cache, sonst laden und verkleinern; None, wenn unbekannt"""
+        if key in self._files:
+            try:
+                data = await self.hass.async_add_executor_job(self._read, key)
+            except OSError:
+                # Datei fehlt (z.B. von Hand gelöscht): neu laden
+                self._total -= self._files.pop(key)
+            else:
+                self._files.move_to_end(key)
+                self.api.metrics.cache_hit("image_proxy")
+                return data
+        url = self._sources.get(key)
+        if url is None:
+            return None
+        return await self._flight.run(key, lambda: self._async_fetch(key, url))
+
+    def _read(self, key: str) -> bytes:
+        path = self._path(key)
+        with open(path, "rb") as file:
+            data = file.read()
+        # mtime merkt sich die letzte Nutzung über Neustarts hinweg
+        os.utime(path)
+        return data
+
+    def _write(self, key: str, data: bytes):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as file:
+            file.write(data)
+        os.replace(tmp, path)
+
+    def _delete(self, keys: list):
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    async def _async_fetch(self, key: str, url: str):
+        self.api.metrics.cache_miss("image_proxy")
+        try:
+            with self.api.metrics.track("image") as call:
+                async with self.api.get_session().get(url) as response:
+                    call.status = response.status
+                    if response.status != 200:
+                        return None
+                    raw = await response.content.read(IMAGE_MAX_SOURCE_BYTES + 1)
+                    call.bytes = len(raw)
+        except Exception as e:
+            _LOGGER.warning("Produktbild %s konnte nicht geladen werden: %s", url, e)
+            return None
+        if len(raw) > IMAGE_MAX_SOURCE_BYTES:
+            _LOGGER.warning("Produktbild %s ist zu groß", url)
+            return None
+
+        data = await self.hass.async_add_executor_job(make_thumbnail, raw)
+        try:
+            await self.hass.async_add_executor_job(self._write, key, data)
+        except OSError as e:
+            _LOGGER.warning("Produktbild konnte nicht gespeichert werden: %s", e)
+            return data
+        self._total += len(data) - self._files.pop(key, 0)
+        self._files[key] = len(data)
+        await self._async_evict()
+        return data
+
+    async def _async_evict(self):
+        evicted = []
+        while self._total > self._max_bytes and len(self._files) > 1:
+            key, size = self._files.popitem(last=False)
+            self._total -= size
+            evicted.append(key)
+        if evicted:
+            _LOGGER.debug("Bildcache: %d Bilder verdrängt", len(evicted))
+            await self.hass.async_add_executor_job(self._delete, evicted)
+
+
+class SpeisekammerImageView(HomeAssistantView):
+    """
+    Liefert Produktbilder aus dem lokalen Cache. Ohne Anmeldung, weil Dashboards
+    sie per <img> laden; ausgeliefert werden nur Bilder, deren Quelle die
+    Integration selbst kennt, es ist also kein offener Proxy.
+    """
+
+    url = IMAGE_URL_PATH + "/{key}"
+    name = "api:speisekammer:image"
+    requires_auth = False
+
+    def __init__(self, hass: HomeAssistant, data_key: str):
+        self.hass = hass
+        self._data_key = data_key
+
+    async def get(self, request: web.Request, key: str) -> web.Response:
+        cache = self.hass.data.get(self._data_key)
+        if cache is None or not _KEY_RE.match(key):
+            return web.Response(status=404)
+        # Inhalt unter einer URL ändert sich nie: Browser müssen nicht nachfragen
+        headers = {"Cache-Control": IMAGE_CACHE_CONTROL, "ETag": f'"{key}"'}
+        if request.headers.get("If-None-Match") == f'"{key}"':
+            return web.Response(status=304, headers=headers)
+        data = await cache.async_get(key)
+        if data is None:
+            return web.Response(status=404)
+        return web.Response(body=data, content_type=content_type(data), headers=headers)
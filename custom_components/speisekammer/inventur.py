@@ -1,5 +1,9 @@
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.debounce import Debouncer
 from homeassistant.helpers.entity import Entity
+from homeassistant.helpers.storage import Store
+from .const import STORAGE_VERSION, INVENTUR_SAVE_DELAY, DEFAULT_SCAN_DEBOUNCE_MS, SCAN_INTERVAL
+from .locations import LocationRegistry
 import logging
 
 DOMAIN = "speisekammer"
@@ -8,14 +12,64 @@ _LOGGER = logging.getLogger(__name__)
 class Inventur:
     """Verwaltet die Inventur eines Lagerorts"""
 
-    def __init__(self, hass: HomeAssistant, api, entry_id: str, community_id: str):
+    def __init__(self, hass: HomeAssistant, api, entry_id: str, community_id: str, coordinator=None, write_queue=None):
         self.hass = hass
         self.api = api
         self.entry_id = entry_id
         self.community_id = community_id
+        self.coordinator = coordinator
+        self.write_queue = write_queue
         self._inventur = {}
+        self._rows = {}  # gtin -> Tabellenzeile, nur geänderte werden neu gebaut
+        self._listeners = []
         self.running = False
-        self.location_map = {}  # name -> id
+        self.location_id = None  # inventierter Lagerort, Ziel für GTINs ohne Treffer
+        # Lagerorte kommen aus dem Coordinator; ohne ihn (z.B. im Benchmark) ein eigenes Register
+        self.registry = coordinator.registry if coordinator else LocationRegistry(SCAN_INTERVAL.total_seconds())
+        self.failed = {}  # gtin -> Fehlergrund beim letzten Zurückschreiben
+        self._store = Store(hass, STORAGE_VERSION, f"{DOMAIN}.inventur.{entry_id}")
+
+    async def async_restore(self):
+        """Unterbrochene Inventur von der Platte wiederherstellen (ohne API-Aufrufe)"""
+        data = await self._store.async_load()
+        if not data or not data.get("running"):
+            return
+        self._inventur = data.get("inventur", {})
+        if not self.registry.names and data.get("id_to_name_map"):
+            # Ältere Zwischenstände bringen ihre eigene Lagerort-Liste mit
+            self.registry.restore(data["id_to_name_map"])
+        self.failed = data.get("failed", {})
+        self.location_id = data.get("location_id")
+        self.running = True
+        await self._update_state()
+        _LOGGER.info("Inventur wiederhergestellt: %d Artikel", len(self._inventur))
+
+    async def async_save(self):
+        """Ausstehende Änderungen sofort schreiben (z.B. beim Entladen)"""
+        if self.running:
+            await self._store.async_save(self._data_to_save())
+
+    def _data_to_save(self):
+        return {
+            "running": self.running,
+            "location_id": self.location_id,
+            "inventur": self._inventur,
+            "id_to_name_map": dict(self.registry.names),
+            "failed": self.failed,
+        }
+
+    async def _get_items(self, location_id: str):
+        """Artikel eines Lagerorts, bevorzugt aus dem Snapshot des Coordinators"""
+        if self.coordinator and location_id in self.coordinator.locations:
+            return self.coordinator.get_items(location_id)
+        return await self.api.get_items(self.community_id, location_id) or []
+
+    async def _find_gtin(self, gtin: str):
+        """(location_id, item) Paare für eine GTIN"""
+        if self.coordinator:
+            return await self.coordinator.async_find_gtin(gtin)
+        match = await self.api.find_item_by_gtin(self.community_id, list(self.registry.names), gtin)
+        return [match] if match else []
 
     async def start(self, location_id: str = None):
         """Inventur starten und Artikel aus Lager laden"""
@@ -23,17 +77,15 @@ class Inventur:
             _LOGGER.error("Keine Community-ID vorhanden – Inventur kann nicht starten")
             return
 
-        # Location Map erstellen, falls nicht vorhanden
-        if not self.location_map:
-            locations = await self.api.get_storage_locations(self.community_id)
-            self.location_map = {loc["name"]: loc["id"] for loc in locations}
-            self.id_to_name_map = {loc["id"]: loc["name"] for loc in locations}
+        # Nur ohne Coordinator selbst laden, sonst ist das Register schon aktuell
+        if not self.coordinator and (not self.registry.names or self.registry.expired):
+            self.registry.update(await self.api.get_storage_locations(self.community_id))
 
         if not location_id:
             lagerort_entity = self.hass.states.get("input_select.lagerort_auswahl")
             if lagerort_entity:
                 name = lagerort_entity.state
-                location_id = self.location_map.get(name)
+                location_id = self.registry.id(name)
                 if not location_id:
                     _LOGGER.warning("Ungültiger Lagerort ausgewählt: %s", name)
                     return
@@ -42,8 +94,10 @@ class Inventur:
                 _LOGGER.warning("Kein Lagerort ausgewählt – Inventur kann nicht starten")
                 return
 
-        items = await self.api.get_items(self.community_id, location_id) or []
+        items = await self._get_items(location_id)
         self._inventur = {}
+        self.failed = {}
+        self.location_id = location_id
         self.running = True
         for item in items:
             total_count = sum(attr.get("count", 0) for attr in item.get("attributes") or [])
@@ -53,15 +107,15 @@ class Inventur:
                 "ist": 0,
                 "mhd": (item.get("attributes")[0].get("bestBeforeDate") 
                         if item.get("attributes") else None),
-                "lager": self.id_to_name_map.get(location_id, "Unbekannt")
+                "lager": self.registry.name(location_id),
+                "lager_id": location_id,
             }
         _LOGGER.info("Inventur gestartet: %d Artikel geladen", len(self._inventur))
         await self._update_state()
 
     async def scan_article(self, gtin: str, count: int = 1, mhd: str = None):
-        _LOGGER.info("Scan: GTIN='%s', aktuelles _inventur keys=%s", gtin, list(self._inventur.keys()))
-
         """Artikel scannen / Menge erhöhen"""
+        _LOGGER.debug("Scan: GTIN='%s'", gtin)
         if not self.running:
             _LOGGER.warning("Inventur nicht gestartet")
             return
@@ -70,134 +124,211 @@ class Inventur:
         gtin = str(gtin).strip()    
 
         # Wenn Artikel schon existiert, Menge erhöhen
+        if gtin in self._inventur:
+            self._apply_scan(gtin, count, mhd)
+            return await self._update_state([gtin])
+
+        # GTIN über den Index suchen (API nur bei Index-Miss)
+        matches = await self._find_gtin(gtin)
+        self._apply_scan(gtin, count, mhd, matches[0] if matches else None)
+        await self._update_state([gtin])
+
+    async def scan_articles(self, entries: list) -> list:
+        """Viele Scans in einem Durchgang; GTINs werden nur gegen den Snapshot aufgelöst"""
+        if not self.running:
+            _LOGGER.warning("Inventur nicht gestartet")
+            return [{"gtin": entry["gtin"], "status": "Inventur nicht gestartet"} for entry in entries]
+
+        results = []
+        touched = set()
+        for entry in entries:
+            gtin = entry["gtin"]
+            if "error" in entry:
+                results.append({"gtin": gtin, "status": entry["error"]})
+                continue
+            if gtin in self._inventur:
+                status = "gezählt"
+                self._apply_scan(gtin, entry["count"], entry.get("date"))
+            else:
+                matches = self.coordinator.find_gtin(gtin) if self.coordinator else []
+                status = "neu" if matches else "unbekannt"
+                self._apply_scan(gtin, entry["count"], entry.get("date"), matches[0] if matches else None)
+            touched.add(gtin)
+            results.append({"gtin": gtin, "status": status, "ist": self._inventur[gtin]["ist"]})
+
+        _LOGGER.info("Bulk-Scan: %d Einträge, %d Artikel geändert", len(entries), len(touched))
+        await self._update_state(touched)
+        return results
+
+    def _apply_scan(self, gtin: str, count: int, mhd: str = None, match=None):
+        """Zählung eines Scans übernehmen; match = (location_id, item) für neue Artikel"""
         if gtin in self._inventur:
             self._inventur[gtin]["ist"] += count
             if mhd:
                 self._inventur[gtin]["mhd"] = mhd
-            return await self._update_state()
-
-        # GTIN in allen Lagerorten suchen
-        found = False
-        for loc_name, loc_id in self.location_map.items():
-            items = await self.api.get_items(self.community_id, loc_id) or []
-            for item in items:
-                # --- hier GTIN normalisieren ---
-                item_gtin = str(item.get("gtin")).strip()
-                if item_gtin == gtin:
-                    name = item.get("name") or "Unbekannt"
-                    soll = sum(attr.get("count", 0) for attr in item.get("attributes") or [])
-                    item_mhd = mhd or (item.get("attributes")[0].get("bestBeforeDate") 
-                                       if item.get("attributes") else None)
-                    self._inventur[gtin] = {
-                        "name": name,
-                        "soll": soll,
-                        "ist": count,
-                        "mhd": item_mhd,
-                        "lager": loc_name
-                    }
-                    found = True
-                    break
-            if found:
-                break
-
-        # Wenn nirgendwo gefunden, trotzdem Eintrag erstellen
-        if not found:
+            return
+
+        if match:
+            loc_id, item = match
+            name = item.get("name") or "Unbekannt"
+            soll = sum(attr.get("count", 0) for attr in item.get("attributes") or [])
+            item_mhd = mhd or (item.get("attributes")[0].get("bestBeforeDate") 
+                               if item.get("attributes") else None)
+            self._inventur[gtin] = {
+                "name": name,
+                "soll": soll,
+                "ist": count,
+                "mhd": item_mhd,
+                "lager": self.registry.name(loc_id),
+                "lager_id": loc_id,
+            }
+        else:
+            # Wenn nirgendwo gefunden, gehört der Artikel in den inventierten Lagerort
             self._inventur[gtin] = {
                 "name": "Unbekannt",
                 "soll": 0,
                 "ist": count,
                 "mhd": mhd,
-                "lager": "Unbekannt"
+                "lager": self.registry.name(self.location_id),
+                "lager_id": self.location_id,
             }
 
-        await self._update_state()
-
-    async def stop(self):
-        """Inventur stoppen und Änderungen ins Lager übertragen"""
+    async def stop(self, discard_failed: bool = False):
+        """
+        Inventur stoppen und Änderungen ins Lager übertragen. Mit discard_failed
+        werden nicht übertragbare Artikel verworfen und die Inventur trotzdem beendet.
+        """
         if not self.running:
             _LOGGER.warning("Inventur nicht gestartet")
             return
 
-        updated_items = []
+        # Geänderte Artikel nach Lagerort gruppieren
+        batches = {}
+        self.failed = {}
         for gtin, data in self._inventur.items():
-            if data["ist"] != data["soll"]:
-                updated_items.append({
-                    "gtin": gtin,
-                    "count": data["ist"],
-                    "bestBeforeDate": data["mhd"]
-                })
-
-        if updated_items:
-            for item in updated_items:
-                await self.api.update_stock(
-                    self.community_id,
-                    self.location_map.get(self._inventur[item["gtin"]]["lager"], 
-                                          self._inventur[item["gtin"]]["lager"]),
-                    [item]
-                )
-
-        _LOGGER.info("Inventur beendet, %d Artikel aktualisiert", len(updated_items))
+            if data["ist"] == data["soll"]:
+                continue
+            # Die ID übersteht Umbenennungen; ältere Einträge kennen nur den Namen
+            location_id = data.get("lager_id") or self.registry.id(data["lager"]) or self.location_id
+            if location_id not in self.registry:
+                self.failed[gtin] = "Unbekannter Lagerort"
+                continue
+            batches.setdefault(location_id, []).append({
+                "gtin": gtin,
+                "count": data["ist"],
+                "bestBeforeDate": data["mhd"]
+            })
+
+        # Über die Warteschlange: ein (ggf. gestückelter) PUT pro Lagerort, Lagerorte parallel.
+        # Vorübergehende Fehler (429, Netzwerk) wiederholt die Warteschlange selbst.
+        # Die Warteschlange schreibt auch fremde Änderungen (add_item, update_stock):
+        # gezählt werden nur die eigenen Einträge
+        enqueued = {}
+        for location_id, items in batches.items():
+            for key, item in zip(self.write_queue.enqueue(location_id, items), items):
+                enqueued[(location_id, key)] = item["gtin"]
+        summary = await self.write_queue.async_flush()
+        updated = len(enqueued.keys() & summary["written_keys"])
+        for (location_id, key), gtin in enqueued.items():
+            reason = summary["rejected"].get((location_id, key))
+            if reason is not None:
+                self.failed[gtin] = reason
+        if summary["pending"]:
+            _LOGGER.info("Inventur: %d Änderungen werden später erneut übertragen", summary["pending"])
+
+        failed = dict(self.failed)
+        for gtin, reason in failed.items():
+            _LOGGER.warning("Inventur: Artikel %s nicht übertragen: %s", gtin, reason)
+        if failed and not discard_failed:
+            # Fehlgeschlagene Artikel bleiben für einen erneuten Versuch in der Inventur
+            self._inventur = {gtin: data for gtin, data in self._inventur.items() if gtin in failed}
+            _LOGGER.warning(
+                "Inventur nicht vollständig beendet: %d Artikel aktualisiert, %d fehlgeschlagen",
+                updated, len(failed)
+            )
+            await self._update_state()
+        else:
+            _LOGGER.info("Inventur beendet, %d Artikel aktualisiert, %d verworfen", updated, len(failed))
+            await self._finish()
+        return {"updated": updated, "failed": failed}
+
+    async def abort(self):
+        """Inventur ohne Übertragen beenden, z.B. wenn Artikel dauerhaft abgelehnt werden"""
+        if not self.running:
+            _LOGGER.warning("Inventur nicht gestartet")
+            return
+        _LOGGER.info("Inventur abgebrochen, %d Artikel verworfen", len(self._inventur))
+        await self._finish()
+
+    async def _finish(self):
         self._inventur.clear()
+        self.failed = {}
+        self.location_id = None
         self.running = False
+        # Abgeschlossene Sitzung braucht keinen Zwischenstand mehr
+        await self._store.async_remove()
         await self._update_state()
 
     def get_table_data(self):
         """Daten für Flex-Table Sensor"""
-        return [
-            {
-                "Name": data["name"],
-                "Barcode": gtin,
-                "Menge_SOLL": data["soll"],
-                "Menge_IST": data["ist"],
-                "Lager": data["lager"],
-                "MHD": data["mhd"]
-            }
-            for gtin, data in self._inventur.items()
-        ]
-
-    async def _update_state(self):
-        """Aktualisiert den globalen Zustand für Lovelace"""
+        return list(self._rows.values())
+
+    @staticmethod
+    def _make_row(gtin: str, data: dict) -> dict:
+        return {
+            "Name": data["name"],
+            "Barcode": gtin,
+            "Menge_SOLL": data["soll"],
+            "Menge_IST": data["ist"],
+            "Lager": data["lager"],
+            "MHD": data["mhd"]
+        }
+
+    @callback
+    def add_listener(self, update_callback):
+        """Callback bei jeder Änderung; liefert eine Funktion zum Abmelden"""
+        self._listeners.append(update_callback)
+        return lambda: self._listeners.remove(update_callback)
+
+    def publish_table(self) -> list:
+        """Tabelle für Lovelace bereitstellen (einmal pro gebündeltem State-Write)"""
+        table = self.get_table_data()
         self.hass.data.setdefault("speisekammer_inventur", {})
-        self.hass.data["speisekammer_inventur"][self.entry_id] = self.get_table_data()
-
-
-def register_services(hass: HomeAssistant, inventur: Inventur, sensor: 'InventurSensor'):
-    """Registriert Inventur-Services in Home Assistant"""
-
-    async def async_start(call):
-        await inventur.start(call.data.get("location_id"))
-        await sensor.async_update()
-        sensor.async_write_ha_state()
-
-    async def async_scan(call):
-        await inventur.scan_article(
-            call.data["gtin"],
-            call.data.get("count", 1),
-            call.data.get("mhd")
-        )
-        await sensor.async_update()
-        sensor.async_write_ha_state()
-
-    async def async_stop(call):
-        await inventur.stop()
-        await sensor.async_update()
-        sensor.async_write_ha_state()
-
-    hass.services.async_register(DOMAIN, "start_inventur", async_start)
-    hass.services.async_register(DOMAIN, "scan_article", async_scan)
-    hass.services.async_register(DOMAIN, "stop_inventur", async_stop)
+        self.hass.data["speisekammer_inventur"][self.entry_id] = table
+        return table
+
+    async def _update_state(self, gtins=None):
+        """Zeilen-Cache aktualisieren und Sensor benachrichtigen"""
+        if gtins is not None:
+            # Scans ändern nur ihre eigenen Zeilen: O(1) pro GTIN
+            for gtin in gtins:
+                self._rows[gtin] = self._make_row(gtin, self._inventur[gtin])
+        else:
+            self._rows = {g: self._make_row(g, data) for g, data in self._inventur.items()}
+        # Gebündelt speichern, damit schnelle Scans nicht jedes Mal schreiben
+        if self.running:
+            self._store.async_delay_save(self._data_to_save, INVENTUR_SAVE_DELAY)
+        for update_callback in list(self._listeners):
+            update_callback()
 
 
 class InventurSensor(Entity):
     """Sensor für die Flex-Table-Anzeige der Inventur"""
 
-    def __init__(self, inventur: Inventur):
+    _unrecorded_attributes = frozenset({"table_data"})
+    _attr_should_poll = False
+
+    def __init__(self, inventur: Inventur, debounce_ms: int = DEFAULT_SCAN_DEBOUNCE_MS, name: str = "Speisekammer Inventur"):
         self._inventur = inventur
-        self._state = "Idle"
+        self._name = name
+        self._debounce = debounce_ms / 1000
+        self._debouncer = None
+        self._state = "Running" if inventur._inventur else "Idle"
+        self._table_data = inventur.get_table_data()
 
     @property
     def name(self):
-        return "Speisekammer Inventur"
+        return self._name
 
     @property
     def state(self):
@@ -205,7 +336,25 @@ class InventurSensor(Entity):
 
     @property
     def extra_state_attributes(self):
-        return {"table_data": self._inventur.get_table_data()}
+        return {"table_data": self._table_data, "failed": self._inventur.failed}
+
+    async def async_added_to_hass(self):
+        # Erster Aufruf schreibt sofort, weitere im Fenster werden zu einem Write zusammengefasst
+        self._debouncer = Debouncer(
+            self.hass, _LOGGER, cooldown=self._debounce, immediate=True, function=self._async_write_state
+        )
+        self.async_on_remove(self._inventur.add_listener(self._schedule_write))
+        self.async_on_remove(self._debouncer.async_cancel)
+
+    @callback
+    def _schedule_write(self):
+        self.hass.async_create_task(self._debouncer.async_call())
+
+    async def _async_write_state(self):
+        await self.async_update()
+        self.async_write_ha_state()
 
     async def async_update(self):
         self._state = "Running" if self._inventur._inventur else "Idle"
+        # Tabelle einmal pro Write aufbauen, nicht bei jedem Attributzugriff
+        self._table_data = self._inventur.publish_table()
@@ -0,0 +1,63 @@
+import logging
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class LocationRegistry:
+    """
+    Einzige Quelle für die Lagerorte einer Community (id <-> name).
+    Die Liste wird höchstens alle `ttl` Sekunden neu abgefragt; Nachschlagen ist
+    immer ein Dict-Zugriff. Listener erfahren, welche Lagerorte neu oder weg sind.
+    """
+
+    def __init__(self, ttl: float):
+        self._ttl = ttl
+        self._fetched = 0.0
+        self.names = {}  # id -> name
+        self.ids = {}  # name -> id
+        self._listeners = []
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, location_id):
+        return location_id in self.names
+
+    def name(self, location_id: str, default: str = "Unbekannt") -> str:
+        return self.names.get(location_id, default)
+
+    def id(self, name: str):
+        return self.ids.get(name)
+
+    @property
+    def expired(self) -> bool:
+        return time.time() - self._fetched >= self._ttl
+
+    def invalidate(self):
+        """Beim nächsten Abruf die Lagerorte neu laden"""
+        self._fetched = 0.0
+
+    def restore(self, names: dict):
+        """Stand aus dem Snapshot übernehmen; gilt als veraltet, bis die API bestätigt"""
+        self.names = dict(names)
+        self.ids = {name: loc_id for loc_id, name in self.names.items()}
+
+    def update(self, locations: list):
+        """Antwort von get_storage_locations übernehmen und Listener bei Änderungen informieren"""
+        self._fetched = time.time()
+        names = {loc["id"]: loc["name"] for loc in locations}
+        added = [loc_id for loc_id in names if loc_id not in self.names]
+        removed = [loc_id for loc_id in self.names if loc_id not in names]
+        renamed = [loc_id for loc_id in names if loc_id in self.names and self.names[loc_id] != names[loc_id]]
+        self.names = names
+        self.ids = {name: loc_id for loc_id, name in names.items()}
+        if added or removed or renamed:
+            _LOGGER.debug("Lagerorte geändert: +%s -%s umbenannt %s", added, removed, renamed)
+            for listener in list(self._listeners):
+                listener(added, removed)
+
+    def add_listener(self, listener):
+        """listener(added_ids, removed_ids); liefert eine Funktion zum Abmelden"""
+        self._listeners.append(listener)
+        return lambda: self._listeners.remove(listener)
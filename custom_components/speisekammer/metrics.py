@@ -0,0 +1,129 @@
+from collections import deque
+from contextlib import contextmanager
+import logging
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+LATENCY_SAMPLES = 500
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000)
+
+
+def _percentile(values, pct: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)], 1)
+
+
+class _Call:
+    """Ergebnis eines einzelnen Aufrufs, wird im track()-Block befüllt"""
+
+    __slots__ = ("status", "bytes", "error")
+
+    def __init__(self):
+        self.status = None
+        self.bytes = 0
+        self.error = False
+
+
+class EndpointStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.bytes = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)  # Millisekunden
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def percentile(self, pct: float):
+        return _percentile(self.latencies, pct)
+
+    def as_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "rate_limited": self.rate_limited,
+            "bytes": self.bytes,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "histogram_ms": {
+                f"<={bound}" if bound else "mehr": count
+                for bound, count in zip(LATENCY_BUCKETS_MS + (None,), self.buckets)
+            },
+        }
+
+
+class Metrics:
+    """Aufrufe, Latenzen, Fehler und Cache-Treffer je Endpunkt"""
+
+    def __init__(self, slow_call_ms: int = 0):
+        self.slow_call_ms = slow_call_ms
+        self.endpoints = {}
+        self.caches = {}  # name -> [treffer, fehlschläge]
+
+    @contextmanager
+    def track(self, endpoint: str):
+        """Misst den umschlossenen Aufruf; Status und Bytes setzt der Aufrufer"""
+        call = _Call()
+        start = time.monotonic()
+        try:
+            yield call
+        except Exception:
+            call.error = True
+            raise
+        finally:
+            self.record(endpoint, (time.monotonic() - start) * 1000, call)
+
+    def record(self, endpoint: str, duration_ms: float, call: _Call):
+        stats = self.endpoints.get(endpoint)
+        if stats is None:
+            stats = self.endpoints[endpoint] = EndpointStats()
+        stats.calls += 1
+        stats.bytes += call.bytes
+        stats.latencies.append(duration_ms)
+        bucket = 0
+        while bucket < len(LATENCY_BUCKETS_MS) and duration_ms > LATENCY_BUCKETS_MS[bucket]:
+            bucket += 1
+        stats.buckets[bucket] += 1
+        if call.status == 429:
+            stats.rate_limited += 1
+        # 304 und 404 sind erwartete Antworten, keine Fehler
+        if call.error or (call.status is not None and call.status >= 400 and call.status != 404):
+            stats.errors += 1
+        if self.slow_call_ms and duration_ms > self.slow_call_ms:
+            _LOGGER.warning("Langsamer Aufruf %s: %.0f ms (Status %s)", endpoint, duration_ms, call.status)
+
+    def cache_hit(self, name: str):
+        self.caches.setdefault(name, [0, 0])[0] += 1
+
+    def cache_miss(self, name: str):
+        self.caches.setdefault(name, [0, 0])[1] += 1
+
+    def hit_rate(self, name: str = None):
+        """Trefferquote in Prozent (alle Caches, wenn kein Name angegeben)"""
+        counts = [self.caches[name]] if name else list(self.caches.values())
+        hits = sum(c[0] for c in counts if c)
+        total = hits + sum(c[1] for c in counts if c)
+        return round(hits * 100 / total, 1) if total else None
+
+    @property
+    def total_calls(self) -> int:
+        return sum(stats.calls for stats in self.endpoints.values())
+
+    @property
+    def total_errors(self) -> int:
+        return sum(stats.errors for stats in self.endpoints.values())
+
+    def percentile(self, pct: float):
+        """Perzentil über alle Endpunkte"""
+        return _percentile([ms for stats in self.endpoints.values() for ms in stats.latencies], pct)
+
+    def as_dict(self) -> dict:
+        return {
+            "endpoints": {name: stats.as_dict() for name, stats in self.endpoints.items()},
+            "caches": {
+                name: {"hits": hits, "misses": misses, "hit_rate": self.hit_rate(name)}
+                for name, (hits, misses) in self.caches.items()
+            },
+        }
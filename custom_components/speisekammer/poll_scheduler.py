@@ -0,0 +1,68 @@
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class PollScheduler:
+    """
+    Abfrageintervall je Lagerort: nach Änderungen schnell, bei ruhigen
+    Lagerorten exponentiell länger bis zur Obergrenze.
+    Alle Zeiten in Sekunden (Unix-Zeit bzw. Dauer).
+    """
+
+    def __init__(self, min_interval: float, initial_interval: float, max_interval: float):
+        self.min_interval = min_interval
+        self.initial_interval = min(max(initial_interval, min_interval), max_interval)
+        self.max_interval = max(max_interval, min_interval)
+        # location_id -> [intervall, nächste_abfrage]
+        self._locations = {}
+
+    def __len__(self):
+        return len(self._locations)
+
+    def sync_locations(self, location_ids):
+        """Neue Lagerorte sofort fällig, verschwundene vergessen"""
+        location_ids = set(location_ids)
+        for loc_id in list(self._locations):
+            if loc_id not in location_ids:
+                del self._locations[loc_id]
+        for loc_id in location_ids:
+            self._locations.setdefault(loc_id, [self.initial_interval, 0.0])
+
+    def due(self, now: float) -> list:
+        """Lagerorte, deren nächste Abfrage erreicht ist"""
+        return [loc_id for loc_id, (_, next_poll) in self._locations.items() if next_poll <= now]
+
+    def record(self, location_id: str, changed: bool, now: float):
+        """Ergebnis einer Abfrage: Änderung -> kürzestes Intervall, sonst verdoppeln"""
+        state = self._locations.setdefault(location_id, [self.initial_interval, 0.0])
+        if changed:
+            state[0] = self.min_interval
+        else:
+            state[0] = min(state[0] * 2, self.max_interval)
+        state[1] = now + state[0]
+
+    def baseline(self, location_id: str, now: float):
+        """Erster Stand eines Lagerorts: keine Änderung, Intervall bleibt beim Startwert"""
+        state = self._locations.setdefault(location_id, [self.initial_interval, 0.0])
+        state[1] = now + state[0]
+
+    def boost(self, location_id: str, now: float):
+        """Nach einem lokalen Schreibvorgang: sofort bestätigen, danach schnell weiter abfragen"""
+        self._locations[location_id] = [self.min_interval, now]
+
+    def force(self, location_ids=None, now: float = 0.0):
+        """Lagerorte (oder alle) bei der nächsten Aktualisierung abfragen"""
+        for loc_id in self._locations if location_ids is None else location_ids:
+            if loc_id in self._locations:
+                self._locations[loc_id][1] = now
+
+    def next_poll(self):
+        """Frühester Zeitpunkt, an dem ein Lagerort fällig wird"""
+        return min((next_poll for _, next_poll in self._locations.values()), default=None)
+
+    def as_dict(self, now: float) -> dict:
+        return {
+            loc_id: {"interval_s": round(interval), "due_in_s": round(max(next_poll - now, 0))}
+            for loc_id, (interval, next_poll) in self._locations.items()
+        }
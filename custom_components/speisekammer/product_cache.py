@@ -0,0 +1,120 @@
+from collections import OrderedDict
+from datetime import timedelta
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.storage import Store
+from .api import SpeisekammerAPI
+from .const import (
+    DOMAIN,
+    STORAGE_VERSION,
+    DEFAULT_PRODUCT_CACHE_TTL,
+    PRODUCT_CACHE_NEGATIVE_TTL,
+    PRODUCT_CACHE_MAX_SIZE,
+    PRODUCT_CACHE_SAVE_DELAY,
+)
+import logging
+import time
+
+_LOGGER = logging.getLogger(__name__)
+STORAGE_KEY = f"{DOMAIN}.products"
+
+
+class ProductCache:
+    """Produktdaten von OpenFoodFacts je GTIN, im Speicher (LRU) und auf der Platte"""
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        api: SpeisekammerAPI,
+        ttl: timedelta = timedelta(days=DEFAULT_PRODUCT_CACHE_TTL),
+        max_size: int = PRODUCT_CACHE_MAX_SIZE,
+    ):
+        self.hass = hass
+        self.api = api
+        self._ttl = ttl.total_seconds()
+        self._negative_ttl = PRODUCT_CACHE_NEGATIVE_TTL.total_seconds()
+        self._max_size = max_size
+        self._store = Store(hass, STORAGE_VERSION, STORAGE_KEY)
+        # gtin -> [image_url, name, abgerufen_ts, gefunden]
+        self._entries = OrderedDict()
+
+    async def async_load(self):
+        """Cache von der Platte laden, abgelaufene Einträge verwerfen"""
+        data = await self._store.async_load() or {}
+        now = time.time()
+        for gtin, entry in data.get("products", {}).items():
+            if not self._expired(entry, now):
+                self._entries[gtin] = entry
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+        _LOGGER.debug("Produktcache geladen: %d Einträge", len(self._entries))
+
+    async def async_save(self):
+        await self._store.async_save(self._data_to_save())
+
+    def _data_to_save(self):
+        return {"products": dict(self._entries)}
+
+    def _expired(self, entry, now) -> bool:
+        ttl = self._ttl if entry[3] else self._negative_ttl
+        return now - entry[2] > ttl
+
+    def _get_entry(self, gtin: str):
+        entry = self._entries.get(gtin)
+        if entry is None:
+            return None
+        if self._expired(entry, time.time()):
+            del self._entries[gtin]
+            return None
+        self._entries.move_to_end(gtin)
+        return entry
+
+    def _set_entry(self, gtin: str, entry: list):
+        self._entries[gtin] = entry
+        self._entries.move_to_end(gtin)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+        self._store.async_delay_save(self._data_to_save, PRODUCT_CACHE_SAVE_DELAY)
+
+    def is_cached(self, gtin: str) -> bool:
+        return self._get_entry(gtin) is not None
+
+    def image_url(self, gtin: str) -> str:
+        """Bild-URL aus dem Cache, ohne Netzwerkzugriff"""
+        entry = self._get_entry(gtin)
+        return entry[0] if entry else ""
+
+    def product_name(self, gtin: str) -> str:
+        """Produktname aus dem Cache, ohne Netzwerkzugriff"""
+        entry = self._get_entry(gtin)
+        return entry[1] if entry else ""
+
+    async def async_get(self, gtin: str):
+        """Produktdaten liefern, bei Cache-Miss von OpenFoodFacts holen"""
+        entry = self._get_entry(gtin)
+        if entry is None:
+            self.api.metrics.cache_miss("openfoodfacts")
+            data = await self.api.fetch_product(gtin)
+            product = data.get("product")
+            if product is not None:
+                entry = [product.get("image_front_small_url", "") or "", product.get("product_name", "") or "", time.time(), True]
+            elif data.get("status") == 0:
+                # Negativ-Cache: unbekannte GTINs nicht bei jedem Refresh erneut abfragen
+                entry = ["", "", time.time(), False]
+            else:
+                # Netzwerk-/Serverfehler nicht cachen
+                return None
+            self._set_entry(gtin, entry)
+        else:
+            self.api.metrics.cache_hit("openfoodfacts")
+        if not entry[3]:
+            return None
+        return {"image": entry[0], "name": entry[1]}
+
+    async def async_prefetch(self, gtins):
+        """Fehlende GTINs nachladen; bekannte Produkte kosten keine Anfrage"""
+        gtins = [gtin for gtin in gtins if gtin]
+        missing = [gtin for gtin in gtins if not self.is_cached(gtin)]
+        for _ in range(len(gtins) - len(missing)):
+            self.api.metrics.cache_hit("openfoodfacts")
+        if missing:
+            await self.api.gather_limited(lambda gtin=gtin: self.async_get(gtin) for gtin in missing)
@@ -0,0 +1,95 @@
+from aiohttp import web
+from homeassistant.core import HomeAssistant, callback
+from .const import DOMAIN
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def parse_push_events(body, community_id: str = None) -> list:
+    """
+    Änderungsmeldungen vereinheitlichen. Akzeptiert ein Ereignis, eine Liste
+    oder {"events": [...]}; jedes Ereignis betrifft einen Lagerort:
+      {"location_id": ..., "items": [...], "removed": [gtin, ...]}  -> einzelne Artikel
+      {"location_id": ..., "stock": [...]}                          -> ganzer Lagerort
+      {"location_id": ...}                                          -> nur Hinweis, Lagerort neu abrufen
+    Ereignisse einer fremden Community werden verworfen.
+    """
+    if isinstance(body, dict):
+        body = body.get("events", [body])
+    if not isinstance(body, list):
+        return []
+
+    events = []
+    for event in body:
+        if not isinstance(event, dict) or not event.get("location_id"):
+            _LOGGER.debug("Push: ungültiges Ereignis verworfen: %s", event)
+            continue
+        if community_id and event.get("community_id", community_id) != community_id:
+            _LOGGER.debug("Push: Ereignis für fremde Community %s verworfen", event.get("community_id"))
+            continue
+        parsed = {"location_id": str(event["location_id"])}
+        if event.get("community_id"):
+            parsed["community_id"] = str(event["community_id"])
+        if isinstance(event.get("stock"), list):
+            parsed["stock"] = [item for item in event["stock"] if isinstance(item, dict) and "gtin" in item]
+        else:
+            parsed["items"] = [item for item in event.get("items") or [] if isinstance(item, dict) and "gtin" in item]
+            parsed["removed"] = [str(gtin) for gtin in event.get("removed") or []]
+        events.append(parsed)
+    return events
+
+
+def route_push_events(events: list, coordinators: dict) -> dict:
+    """
+    Ereignisse den Coordinators zuordnen (community_id -> Ereignisse): über die
+    community_id des Ereignisses, sonst über den Lagerort. Nicht zuordenbare
+    Ereignisse gehen bei nur einer Community an diese, sonst werden sie verworfen.
+    """
+    routed = {}
+    for event in events:
+        community_id = event.get("community_id")
+        if community_id is None:
+            owners = [cid for cid, coordinator in coordinators.items() if event["location_id"] in coordinator.locations]
+            if len(owners) == 1:
+                community_id = owners[0]
+            elif len(coordinators) == 1:
+                community_id = next(iter(coordinators))
+        if community_id not in coordinators:
+            _LOGGER.debug("Push: Ereignis für Lagerort %s keiner Community zuzuordnen", event["location_id"])
+            continue
+        routed.setdefault(community_id, []).append(event)
+    return routed
+
+
+def generate_webhook_id() -> str:
+    # webhook erst hier importieren: auf HA 2024.1 zieht der Import auf Modulebene
+    # websocket_api/http im Kreis, z.B. im Benchmark außerhalb von Home Assistant
+    from homeassistant.components import webhook
+
+    return webhook.async_generate_id()
+
+
+@callback
+def async_register_webhook(hass: HomeAssistant, webhook_id: str, communities: dict):
+    """Webhook für Bestandsänderungen aller Communities eines Eintrags; liefert eine Funktion zum Abmelden"""
+    from homeassistant.components import webhook
+
+    coordinators = {community_id: community["coordinator"] for community_id, community in communities.items()}
+
+    async def handle_webhook(hass: HomeAssistant, webhook_id: str, request: web.Request):
+        try:
+            body = await request.json()
+        except ValueError:
+            return web.Response(status=400, text="Ungültiges JSON")
+        events = parse_push_events(body)
+        applied = 0
+        for community_id, community_events in route_push_events(events, coordinators).items():
+            applied += coordinators[community_id].apply_push(community_events)
+        return web.json_response({"events": len(events), "applied": applied})
+
+    webhook.async_register(hass, DOMAIN, "Speisekammer Bestand", webhook_id, handle_webhook)
+    # Die ID ist das einzige Geheimnis des Webhooks: nicht im normalen Log
+    _LOGGER.info("Push-Webhook registriert")
+    _LOGGER.debug("Push-Webhook: %s", webhook.async_generate_path(webhook_id))
+    return lambda: webhook.async_unregister(hass, webhook_id)
@@ -0,0 +1,150 @@
+from .stock_index import normalize_gtin
+import heapq
+import logging
+import math
+import re
+import unicodedata
+
+_LOGGER = logging.getLogger(__name__)
+
+FUZZY_THRESHOLD = 0.6  # Anteil gemeinsamer Trigramme, ab dem ein Suchwort als Treffer zählt
+_WORD_RE = re.compile(r"[^\W_]+")
+
+
+def normalize_text(text) -> str:
+    """Kleinbuchstaben ohne Akzente/Umlaut-Punkte, damit 'kase' auch 'Käse' findet"""
+    text = unicodedata.normalize("NFKD", str(text or "").casefold())
+    return "".join(char for char in text if not unicodedata.combining(char))
+
+
+def words(text) -> list:
+    return _WORD_RE.findall(normalize_text(text))
+
+
+def _word_trigrams(word: str) -> set:
+    # Führende Leerzeichen markieren den Wortanfang (Präfixsuche mit 1-2 Zeichen)
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _query_trigrams(word: str) -> set:
+    if len(word) < 3:
+        # Kurze Suchwörter nur als Wortanfang
+        padded = f"  {word}"
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+    # Sonst Teilstring irgendwo im Wort
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+class SearchIndex:
+    """
+    Trigramm-Index über Name, Beschreibung und GTIN aller Artikel,
+    für Präfix-, Teilstring- und unscharfe Suche ohne Netzwerkzugriff.
+    """
+
+    def __init__(self):
+        # (location_id, gtin) -> [item, suchtext, trigramme]
+        self._docs = {}
+        # trigramm -> {(location_id, gtin)}
+        self._postings = {}
+
+    def __len__(self):
+        return len(self._docs)
+
+    def rebuild(self, stock: dict):
+        self._docs = {}
+        self._postings = {}
+        for location_id, items in stock.items():
+            self.update_location(location_id, items)
+
+    def set_item(self, location_id: str, item: dict):
+        gtin = item.get("gtin")
+        if gtin is None:
+            return
+        key = (location_id, normalize_gtin(gtin))
+        text = " ".join(words(f"{item.get('name') or ''} {item.get('description') or ''} {gtin}"))
+        doc = self._docs.get(key)
+        if doc is not None and doc[1] == text:
+            # Nur Menge/MHD geändert: Eintrag tauschen, Trigramme bleiben
+            doc[0] = item
+            return
+        self.remove_item(location_id, gtin)
+        trigrams = set()
+        for word in text.split():
+            trigrams |= _word_trigrams(word)
+        self._docs[key] = [item, text, trigrams]
+        for trigram in trigrams:
+            self._postings.setdefault(trigram, set()).add(key)
+
+    def remove_item(self, location_id: str, gtin):
+        key = (location_id, normalize_gtin(gtin))
+        doc = self._docs.pop(key, None)
+        if doc is None:
+            return
+        for trigram in doc[2]:
+            keys = self._postings.get(trigram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._postings[trigram]
+
+    def update_location(self, location_id: str, items: list):
+        """Lagerort abgleichen: nur neue, umbenannte und entfernte Artikel neu indizieren"""
+        current = {normalize_gtin(item.get("gtin")): item for item in items if item.get("gtin") is not None}
+        for loc_id, gtin in [key for key in self._docs if key[0] == location_id]:
+            if gtin not in current:
+                self.remove_item(loc_id, gtin)
+        for item in current.values():
+            self.set_item(location_id, item)
+
+    def remove_location(self, location_id: str):
+        for loc_id, gtin in [key for key in self._docs if key[0] == location_id]:
+            self.remove_item(loc_id, gtin)
+
+    def search(self, query: str, limit: int = 20, location_ids=None) -> list:
+        """
+        Treffer als [(score, location_id, item)], beste zuerst. Jedes Suchwort muss
+        (unscharf) vorkommen; exakte Teilstrings zählen mehr als Tippfehler-Treffer.
+        """
+        query_words = words(query)
+        if not query_words:
+            return []
+
+        scores = None
+        for word in query_words:
+            trigrams = sorted(_query_trigrams(word), key=lambda trigram: len(self._postings.get(trigram, ())))
+            needed = math.ceil(len(trigrams) * FUZZY_THRESHOLD)
+            if scores is None:
+                # Ein Treffer braucht `needed` Trigramme, muss also in einer der
+                # seltensten len - needed + 1 Listen stehen: nur diese durchsuchen
+                candidates = set()
+                for trigram in trigrams[:len(trigrams) - needed + 1]:
+                    candidates |= self._postings.get(trigram, set())
+            else:
+                # Weitere Suchwörter nur noch auf den bisherigen Treffern prüfen
+                candidates = scores
+            word_scores = {}
+            for key in candidates:
+                doc_trigrams = self._docs[key][2]
+                count = sum(1 for trigram in trigrams if trigram in doc_trigrams)
+                if count < needed:
+                    continue
+                score = count / len(trigrams)
+                text = self._docs[key][1]
+                if f" {word}" in f" {text}":
+                    score += 1.0  # Wortanfang
+                elif word in text:
+                    score += 0.5  # Teilstring
+                word_scores[key] = score
+            if scores is None:
+                scores = word_scores
+            else:
+                scores = {key: scores[key] + score for key, score in word_scores.items()}
+            if not scores:
+                return []
+
+        if location_ids is not None:
+            location_ids = set(location_ids)
+            scores = {key: score for key, score in scores.items() if key[0] in location_ids}
+        best = heapq.nsmallest(limit, scores.items(), key=lambda entry: (-entry[1], self._docs[entry[0]][1]))
+        return [(round(score / len(query_words), 3), key[0], self._docs[key][0]) for key, score in best]
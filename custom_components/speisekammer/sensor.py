@@ -1,207 +1,482 @@
-from datetime import timedelta
 from homeassistant.components.sensor import SensorEntity
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.core import HomeAssistant
+from homeassistant.const import EntityCategory
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers import entity_registry as er
 from homeassistant.helpers.event import async_track_state_change_event
-from .api import SpeisekammerAPI
-from .const import DOMAIN, CONF_TOKEN, CONF_COMMUNITY_ID
-from .inventur import Inventur, InventurSensor, register_services
+from homeassistant.helpers.update_coordinator import CoordinatorEntity
+from homeassistant.util import dt as dt_util
+from .const import (
+    DOMAIN,
+    CONF_COMPACT_ATTRIBUTES,
+    CONF_MAX_ROWS,
+    CONF_SCAN_DEBOUNCE_MS,
+    DEFAULT_COMPACT_ATTRIBUTES,
+    DEFAULT_MAX_ROWS,
+    DEFAULT_SCAN_DEBOUNCE_MS,
+)
+from .coordinator import SpeisekammerCoordinator
+from .expiry import parse_best_before
+from .inventur import Inventur, InventurSensor
 import logging
-import aiohttp
+import time
 
 _LOGGER = logging.getLogger(__name__)
-SCAN_INTERVAL = timedelta(minutes=10)
 
 
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry, async_add_entities):
-    token = entry.data[CONF_TOKEN]
-    community_id = entry.data[CONF_COMMUNITY_ID]
-    api = SpeisekammerAPI(token=token)
-
-    # Lagerorte abrufen und Mapping speichern
-    locations = await api.get_storage_locations(community_id)
-    location_map = {loc["name"]: loc["id"] for loc in locations}
-    hass.data["speisekammer_location_map"] = location_map
+    # API (inkl. gemeinsamer HTTP-Session), Coordinator und Warteschlange je Community kommen aus __init__.py
+    data = hass.data[DOMAIN][entry.entry_id]
+    api = data["api"]
+    communities = data["communities"]
+    coordinators = [community["coordinator"] for community in communities.values()]
 
     entities = []
+    compact = entry.options.get(CONF_COMPACT_ATTRIBUTES, DEFAULT_COMPACT_ATTRIBUTES)
+    max_rows = entry.options.get(CONF_MAX_ROWS, DEFAULT_MAX_ROWS)
+    for community_id, community in communities.items():
+        coordinator = community["coordinator"]
+        # Bei mehreren Communities den Namen anhängen, damit Entities unterscheidbar bleiben
+        suffix = f" ({community['name']})" if len(communities) > 1 else ""
+
+        # Lagerplatz-Sensoren; neue oder gelöschte Lagerorte meldet das Register zur Laufzeit
+        sensors = {
+            location_id: StorageLocationSensor(coordinator, location_id, location_name, compact, max_rows, suffix)
+            for location_id, location_name in coordinator.locations.items()
+        }
+        entities.extend(sensors.values())
+        entry.async_on_unload(coordinator.registry.add_listener(
+            _location_listener(hass, coordinator, sensors, async_add_entities, compact, max_rows, suffix)
+        ))
+
+        # Ablauf-Sensoren über alle Lagerorte der Community
+        entities.append(ExpirySensor(coordinator, expired=False, max_rows=max_rows, suffix=suffix))
+        entities.append(ExpirySensor(coordinator, expired=True, max_rows=max_rows, suffix=suffix))
+
+        # Einkaufsliste aus Mindestbeständen und Summenindex
+        entities.append(ShoppingListSensor(coordinator, community["shopping"], max_rows=max_rows, suffix=suffix))
+
+        # Inventur + Sensor (eine je Community, da sie ihren Zwischenstand auf der Platte speichert)
+        inventur = Inventur(
+            hass, api, entry_id=coordinator.storage_id, community_id=community_id,
+            coordinator=coordinator, write_queue=community["write_queue"],
+        )
+        await inventur.async_restore()
+        community["inventur"] = inventur
+        entities.append(InventurSensor(
+            inventur, entry.options.get(CONF_SCAN_DEBOUNCE_MS, DEFAULT_SCAN_DEBOUNCE_MS),
+            name=f"Speisekammer Inventur{suffix}",
+        ))
+
+    # Diagnose-Sensoren (Anfragen, Latenz, Fehler, Cache) – eine API für alle Communities
+    for kind in MetricsSensor.KINDS:
+        entities.append(MetricsSensor(coordinators[0], kind))
+
+    # Single-Item Sensor für GTIN Lookup über alle Communities
+    if any(coordinator.locations for coordinator in coordinators):
+        entities.append(SingleItemSensor(coordinators))
+
+    async_add_entities(entities)
+
+
+def _location_listener(
+    hass, coordinator, sensors: dict, async_add_entities, compact: bool, max_rows: int, suffix: str = ""
+):
+    """StorageLocationSensor-Entities passend zum Lagerort-Register anlegen und entfernen"""
+
+    @callback
+    def handle_locations_changed(added: list, removed: list):
+        new = []
+        for location_id in added:
+            if location_id not in sensors:
+                sensors[location_id] = StorageLocationSensor(
+                    coordinator, location_id, coordinator.registry.name(location_id), compact, max_rows, suffix
+                )
+                new.append(sensors[location_id])
+        if new:
+            _LOGGER.info("Neue Lagerorte: %s", [sensor.name for sensor in new])
+            async_add_entities(new)
+
+        entity_registry = er.async_get(hass)
+        for location_id in removed:
+            sensor = sensors.pop(location_id, None)
+            if sensor is None:
+                continue
+            _LOGGER.info("Lagerort entfernt: %s", sensor.name)
+            if sensor.entity_id and entity_registry.async_get(sensor.entity_id):
+                # Entfernt auch die Entity selbst
+                entity_registry.async_remove(sensor.entity_id)
+            elif sensor.hass is not None:
+                hass.async_create_task(sensor.async_remove())
+
+    return handle_locations_changed
+
+
+def build_table(coordinator: SpeisekammerCoordinator, location_id: str, location_name: str) -> list:
+    """Artikeltabelle eines Lagerorts aus dem Snapshot, nach Ablaufdatum sortiert"""
+    table = []
+
+    for item in coordinator.get_items(location_id):
+        for attr in item.get("attributes", []):
+            count = attr.get("count", 0)
+            if count > 0:
+                gtin = item.get("gtin", "")
+                table.append({
+                    "Name": item.get("name", "Unbekannt"),
+                    "Menge": count,
+                    "GTIN": gtin,
+                    "Ablaufdatum": attr.get("bestBeforeDate", ""),
+                    "Lagerplatz": location_name,
+                    "Bild": coordinator.get_image(gtin) if gtin else ""
+                })
+
+    table.sort(key=_expiry_sort_key)
+    return table
+
+
+def _expiry_sort_key(row: dict):
+    # Ohne MHD ans Ende; verträgt ISO-Strings und {"ts": ms}
+    ts = parse_best_before(row.get("Ablaufdatum"))
+    return float("inf") if ts is None else ts
+
+
+def compact_table(table: list) -> tuple:
+    """Kurze Schlüssel und deduplizierte Bild-URLs: (zeilen, bilder)"""
+    images = []
+    image_pos = {}
+    rows = []
+    for row in table:
+        image = row["Bild"]
+        if image and image not in image_pos:
+            image_pos[image] = len(images)
+            images.append(image)
+        rows.append({
+            "n": row["Name"],
+            "m": row["Menge"],
+            "g": row["GTIN"],
+            "d": row["Ablaufdatum"],
+            "i": image_pos.get(image, -1),
+        })
+    return rows, images
 
-    # Lagerplatz-Sensoren
-    for location in locations:
-        location_id = location["id"]
-        location_name = location["name"]
-        entities.append(StorageLocationSensor(api, community_id, location_id, location_name))
-
-    # Single-Item Sensor für GTIN Lookup
-    if locations:
-        gtin_sensor = SingleItemSensor(api, community_id)
-        gtin_sensor.set_hass(hass)
-        entities.append(gtin_sensor)
-
-    # Inventur Sensor + Services
-    inventur = Inventur(hass, api, entry_id=entry.entry_id, community_id=community_id)
-    inventur_sensor = InventurSensor(inventur)
-    entities.append(inventur_sensor)
-
-    # Services registrieren, inkl. Übergabe des Sensors für Update
-    register_services(hass, inventur, inventur_sensor)
-
-    _LOGGER.info("Inventur-Sensor registriert und Services hinzugefügt")
-
-    async_add_entities(entities, update_before_add=True)
-
-    # --------------------------
-    # Service: Artikel hinzufügen
-    # --------------------------
-    async def handle_add_item(call):
-        gtin = call.data.get("gtin")
-        count = call.data.get("count")
-        best_before = call.data.get("best_before")
-        location_name = call.data.get("location_name")
-
-        location_map = hass.data.get("speisekammer_location_map", {})
-        location_id = location_map.get(location_name)
-        if not location_id:
-            _LOGGER.error("Unbekannter Lagerort: %s", location_name)
-            return
 
-        try:
-            await api.add_item(community_id, location_id, gtin, count, best_before)
-            _LOGGER.info("Artikel hinzugefügt: %s (%s Stück) in %s", gtin, count, location_name)
-        except Exception as e:
-            _LOGGER.error("Fehler beim Hinzufügen von Artikel %s: %s", gtin, e)
+# --------------------------
+# StorageLocationSensor
+# --------------------------
+class StorageLocationSensor(CoordinatorEntity, SensorEntity):
+    # Die Tabelle kann groß werden und gehört nicht in die Recorder-Datenbank
+    _unrecorded_attributes = frozenset({"table", "images"})
+
+    def __init__(
+        self,
+        coordinator: SpeisekammerCoordinator,
+        location_id: str,
+        location_name: str,
+        compact: bool = DEFAULT_COMPACT_ATTRIBUTES,
+        max_rows: int = DEFAULT_MAX_ROWS,
+        suffix: str = "",
+    ):
+        super().__init__(coordinator)
+        self._location_id = location_id
+        self._location_name = location_name
+        self._compact = compact
+        self._max_rows = max_rows
+        self._suffix = suffix
+        self._attr_name = f"Lagerplatz: {location_name}{suffix}"
+        self._attr_unique_id = f"speisekammer_lagerplatz_{self._location_id}"
+        self._attr_icon = "mdi:package-variant"
+        self._attr_native_unit_of_measurement = "Artikel"
+        self._state = 0
+        self._attr_extra_state_attributes = {"table": [], "Lagerplatz": location_name, "Artikelanzahl": 0}
+        self._version = None
+        self._written_available = True
+        self._update_from_snapshot()
 
-    hass.services.async_register(DOMAIN, "add_item", handle_add_item)
+    @property
+    def native_value(self):
+        return self._state
 
-    # --------------------------
-    # Service: Lagerorte für GTIN prüfen
-    # --------------------------
-    async def handle_get_locations_for_gtin(call):
-        gtin = call.data.get("gtin")
-        if not gtin:
-            _LOGGER.warning("GTIN fehlt für Lagerortprüfung")
+    @property
+    def available(self):
+        return super().available and self._location_id in self.coordinator.locations
+
+    async def async_added_to_hass(self):
+        await super().async_added_to_hass()
+        # Zur Laufzeit hinzugefügte Lagerorte bekommen ihren Bestand evtl. erst jetzt
+        if self.coordinator.get_version(self._location_id) != self._version:
+            self._update_from_snapshot()
+
+    @callback
+    def _handle_coordinator_update(self):
+        version = self.coordinator.get_version(self._location_id)
+        name = self.coordinator.registry.name(self._location_id, self._location_name)
+        if (
+            version is not None and version == self._version
+            and name == self._location_name and self.available == self._written_available
+        ):
+            # Bestand unverändert: kein Neuaufbau, keine Sortierung, kein State-Write
             return
+        if name != self._location_name:
+            # Umbenannt: Anzeigename folgt, unique_id bleibt
+            self._location_name = name
+            self._attr_name = f"Lagerplatz: {name}{self._suffix}"
+        self._update_from_snapshot()
+        self._written_available = self.available
+        super()._handle_coordinator_update()
+
+    def _update_from_snapshot(self):
+        self._version = self.coordinator.get_version(self._location_id)
+        table = build_table(self.coordinator, self._location_id, self._location_name)
+        self._state = len(table)
+
+        # Vollständige Tabelle gibt es über den Service speisekammer.get_table
+        shown = table[:self._max_rows] if self._max_rows else table
+        attributes = {"Lagerplatz": self._location_name, "Artikelanzahl": len(table)}
+        if len(shown) < len(table):
+            attributes["gekürzt"] = True
+        if self._compact:
+            attributes["table"], attributes["images"] = compact_table(shown)
+        else:
+            attributes["table"] = shown
+        self._attr_extra_state_attributes = attributes
 
-        try:
-            locations = await api.get_storage_locations(community_id)
-            location_map = {loc["name"]: loc["id"] for loc in locations}
-            hass.data["speisekammer_location_map"] = location_map
-
-            matching_locations = []
-            for loc in locations:
-                item = await api.get_item_by_gtin(community_id, loc["id"], gtin)
-                if item:
-                    matching_locations.append(loc["name"])
-
-            if not matching_locations:
-                matching_locations = [loc["name"] for loc in locations]
-
-            # Input_select Optionen setzen
-            await hass.services.async_call("input_select", "set_options", {
-                "entity_id": "input_select.lagerort_auswahl",
-                "options": matching_locations
-            })
-            await hass.services.async_call("input_select", "select_option", {
-                "entity_id": "input_select.lagerort_auswahl",
-                "option": matching_locations[0]
-            })
-
-            _LOGGER.info("Lagerorte für GTIN %s gesetzt: %s", gtin, matching_locations)
 
-        except Exception as e:
-            _LOGGER.error("Fehler beim Abrufen der Lagerorte für GTIN %s: %s", gtin, e)
+# --------------------------
+# ExpirySensor
+# --------------------------
+class ExpirySensor(CoordinatorEntity, SensorEntity):
+    """Artikel, die bald ablaufen bzw. abgelaufen sind – direkt aus dem Ablaufindex"""
+
+    _unrecorded_attributes = frozenset({"table"})
+
+    def __init__(
+        self, coordinator: SpeisekammerCoordinator, expired: bool, max_rows: int = DEFAULT_MAX_ROWS, suffix: str = ""
+    ):
+        super().__init__(coordinator)
+        self._expired = expired
+        self._max_rows = max_rows
+        if expired:
+            self._attr_name = f"Speisekammer Abgelaufen{suffix}"
+            self._attr_unique_id = f"speisekammer_abgelaufen_{coordinator.community_id}"
+            self._attr_icon = "mdi:calendar-remove"
+        else:
+            self._attr_name = f"Speisekammer Läuft bald ab{suffix}"
+            self._attr_unique_id = f"speisekammer_laeuft_bald_ab_{coordinator.community_id}"
+            self._attr_icon = "mdi:calendar-alert"
+        self._attr_native_unit_of_measurement = "Artikel"
+        self._state = 0
+        self._attr_extra_state_attributes = {}
+        self._update_from_index()
+
+    @property
+    def native_value(self):
+        return self._state
 
-    hass.services.async_register(DOMAIN, "get_locations_for_gtin", handle_get_locations_for_gtin)
+    @callback
+    def _handle_coordinator_update(self):
+        previous = (self._state, self._attr_extra_state_attributes)
+        self._update_from_index()
+        if (self._state, self._attr_extra_state_attributes) != previous:
+            super()._handle_coordinator_update()
+
+    def _update_from_index(self):
+        now = time.time()
+        if self._expired:
+            entries = self.coordinator.expiry.expired(now)
+        else:
+            entries = self.coordinator.expiry.expiring(now, self.coordinator.expiry_window)
+        shown = entries[:self._max_rows] if self._max_rows else entries
+        locations = self.coordinator.locations
+        self._state = len(entries)
+        self._attr_extra_state_attributes = {
+            "table": [
+                {
+                    "Name": name,
+                    "Menge": count,
+                    "GTIN": gtin,
+                    "Ablaufdatum": dt_util.utc_from_timestamp(ts).date().isoformat(),
+                    "Lagerplatz": locations.get(location_id, "-"),
+                }
+                for ts, location_id, gtin, name, count in shown
+            ],
+            "Artikelanzahl": len(entries),
+        }
 
 
 # --------------------------
-# StorageLocationSensor
+# ShoppingListSensor
 # --------------------------
-class StorageLocationSensor(SensorEntity):
-    def __init__(self, api: SpeisekammerAPI, community_id: str, location_id: str, location_name: str):
-        self._api = api
-        self._community_id = community_id
-        self._location_id = location_id
-        self._location_name = location_name
-        self._attr_name = f"Lagerplatz: {location_name}"
-        self._attr_unique_id = f"speisekammer_lagerplatz_{self._location_id}"
-        self._attr_icon = "mdi:package-variant"
+class ShoppingListSensor(CoordinatorEntity, SensorEntity):
+    """Produkte unter Mindestbestand – nur über die GTINs mit Mindestbestand gerechnet"""
+
+    _unrecorded_attributes = frozenset({"table"})
+
+    def __init__(self, coordinator: SpeisekammerCoordinator, shopping, max_rows: int = DEFAULT_MAX_ROWS, suffix: str = ""):
+        super().__init__(coordinator)
+        self._shopping = shopping
+        self._max_rows = max_rows
+        self._attr_name = f"Speisekammer Einkaufsliste{suffix}"
+        self._attr_unique_id = f"speisekammer_einkaufsliste_{coordinator.community_id}"
+        self._attr_icon = "mdi:cart-outline"
         self._attr_native_unit_of_measurement = "Artikel"
-        self._attr_should_poll = True
         self._state = 0
-        self._attr_extra_state_attributes = {"table": [], "Lagerplatz": location_name, "Artikelanzahl": 0}
+        self._attr_extra_state_attributes = {}
+        self._update_from_index()
 
     @property
     def native_value(self):
         return self._state
 
-    async def async_update(self):
-        try:
-            items = await self._api.get_items(self._community_id, self._location_id)
-            table = []
-
-            for item in items or []:
-                for attr in item.get("attributes", []):
-                    count = attr.get("count", 0)
-                    if count > 0:
-                        gtin = item.get("gtin", "")
-                        off_data = await fetch_openfoodfacts(gtin) if gtin else {}
-                        image_url = off_data.get("product", {}).get("image_front_small_url", "")
-                        table.append({
-                            "Name": item.get("name", "Unbekannt"),
-                            "Menge": count,
-                            "GTIN": gtin,
-                            "Ablaufdatum": attr.get("bestBeforeDate", ""),
-                            "Lagerplatz": self._location_name,
-                            "Bild": image_url
-                        })
-
-            table.sort(key=lambda x: x.get("Ablaufdatum") or "9999-12-31")
-            self._state = len(table)
-            self._attr_extra_state_attributes = {"table": table, "Lagerplatz": self._location_name, "Artikelanzahl": len(table)}
+    async def async_added_to_hass(self):
+        await super().async_added_to_hass()
+        # Geänderte Mindestbestände wirken sofort, nicht erst beim nächsten Abruf
+        self.async_on_remove(self._shopping.add_listener(self._handle_coordinator_update))
+
+    @callback
+    def _handle_coordinator_update(self):
+        previous = (self._state, self._attr_extra_state_attributes)
+        self._update_from_index()
+        if (self._state, self._attr_extra_state_attributes) != previous:
+            super()._handle_coordinator_update()
+
+    def _update_from_index(self):
+        shortfalls = self._shopping.shortfalls()
+        shown = shortfalls[:self._max_rows] if self._max_rows else shortfalls
+        self._state = len(shortfalls)
+        self._attr_extra_state_attributes = {
+            "table": [
+                {
+                    "Name": entry["name"],
+                    "GTIN": entry["gtin"],
+                    "Bestand": entry["stock"],
+                    "Mindestbestand": entry["min"],
+                    "Fehlt": entry["missing"],
+                }
+                for entry in shown
+            ],
+            "Mindestbestände": len(self._shopping),
+        }
 
-        except Exception as e:
-            _LOGGER.error("Fehler beim Update von %s: %s", self._location_name, e)
-            self._state = None
-            self._attr_extra_state_attributes = {"table": [], "Lagerplatz": self._location_name, "Artikelanzahl": 0}
+
+# --------------------------
+# MetricsSensor
+# --------------------------
+class MetricsSensor(CoordinatorEntity, SensorEntity):
+    """Diagnose-Werte der API-Metriken, aktualisiert mit jedem Coordinator-Update"""
+
+    # kind -> (Name, Icon, Einheit)
+    KINDS = {
+        "calls": ("API-Aufrufe", "mdi:counter", "Aufrufe"),
+        "latency_p95": ("API-Latenz p95", "mdi:timer-outline", "ms"),
+        "errors": ("API-Fehler", "mdi:alert-circle-outline", "Fehler"),
+        "cache_hit_rate": ("Cache-Trefferquote", "mdi:percent", "%"),
+    }
+
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+
+    def __init__(self, coordinator: SpeisekammerCoordinator, kind: str):
+        super().__init__(coordinator)
+        self._kind = kind
+        name, icon, unit = self.KINDS[kind]
+        self._attr_name = f"Speisekammer {name}"
+        self._attr_unique_id = f"speisekammer_metrics_{kind}_{coordinator.community_id}"
+        self._attr_icon = icon
+        self._attr_native_unit_of_measurement = unit
+
+    @property
+    def native_value(self):
+        metrics = self.coordinator.api.metrics
+        if self._kind == "calls":
+            return metrics.total_calls
+        if self._kind == "latency_p95":
+            return metrics.percentile(95)
+        if self._kind == "errors":
+            return metrics.total_errors
+        return metrics.hit_rate()
+
+    @property
+    def extra_state_attributes(self):
+        metrics = self.coordinator.api.metrics
+        if self._kind == "cache_hit_rate":
+            rates = {name: metrics.hit_rate(name) for name in metrics.caches}
+            # Produkt- und Bildcache zählen in den gemeinsamen Metriken
+            shared_api = self.hass.data.get("speisekammer_shared_api") if self.hass else None
+            if shared_api is not None:
+                rates.update({name: shared_api.metrics.hit_rate(name) for name in shared_api.metrics.caches})
+            return rates
+        if self._kind == "latency_p95":
+            return {"p50": metrics.percentile(50)}
+        return {
+            name: stats.calls if self._kind == "calls" else stats.errors
+            for name, stats in metrics.endpoints.items()
+        }
 
 
 # --------------------------
 # SingleItemSensor
 # --------------------------
-class SingleItemSensor(SensorEntity):
-    def __init__(self, api: SpeisekammerAPI, community_id: str):
-        self._api = api
-        self._community_id = community_id
+class SingleItemSensor(CoordinatorEntity, SensorEntity):
+    def __init__(self, coordinators: list):
+        # Sucht in allen Communities des Eintrags; die erste liefert den Coordinator der Entity
+        super().__init__(coordinators[0])
+        self._coordinators = coordinators
         self._attr_name = "Speisekammer Artikelabfrage"
         self._attr_unique_id = "speisekammer_gtin_lookup"
         self._attr_icon = "mdi:magnify"
         self._state = "–"
         self._attr_extra_state_attributes = {}
-        self.hass = None
+        # (GTIN, Versionen aller Snapshots) der letzten erfolglosen Suche
+        self._miss = None
 
     @property
     def native_value(self):
         return self._state
 
-    def set_hass(self, hass: HomeAssistant):
-        self.hass = hass
+    def _snapshot_versions(self) -> list:
+        return [dict((coordinator.data or {}).get("versions", {})) for coordinator in self._coordinators]
+
+    def _current_gtin(self):
+        gtin_state = self.hass.states.get("input_text.gtin_eingabe")
+        return gtin_state.state.strip() if gtin_state and gtin_state.state else None
+
+    async def async_added_to_hass(self):
+        await super().async_added_to_hass()
 
         async def state_listener(event):
-            await self.async_update()
+            await self._async_lookup()
             self.async_write_ha_state()
 
-        async_track_state_change_event(
-            hass,
-            "input_text.gtin_eingabe",
-            state_listener
+        self.async_on_remove(
+            async_track_state_change_event(
+                self.hass,
+                "input_text.gtin_eingabe",
+                state_listener
+            )
         )
-
-    async def async_update(self):
-        if not self.hass:
+        for coordinator in self._coordinators[1:]:
+            self.async_on_remove(coordinator.async_add_listener(self._handle_coordinator_update))
+        await self._async_lookup()
+
+    @callback
+    def _handle_coordinator_update(self):
+        if self._miss is not None and self._miss == (self._current_gtin(), self._snapshot_versions()):
+            # Unbekannte GTIN und unveränderter Bestand: nichts nachzuschlagen
             return
 
-        gtin_state = self.hass.states.get("input_text.gtin_eingabe")
-        gtin = gtin_state.state.strip() if gtin_state and gtin_state.state else None
+        # Neuer Snapshot -> aktuelle GTIN erneut im Index nachschlagen; die API
+        # wird nur bei einer neuen Eingabe gefragt
+        async def refresh():
+            previous = (self._state, self._attr_extra_state_attributes)
+            await self._async_lookup(use_api=False)
+            if (self._state, self._attr_extra_state_attributes) != previous:
+                self.async_write_ha_state()
+
+        self.hass.async_create_task(refresh())
+
+    async def _async_lookup(self, use_api: bool = True):
+        gtin = self._current_gtin()
+        versions = self._snapshot_versions()
+        self._miss = None
 
         if not gtin:
             self._state = "Keine GTIN"
@@ -209,20 +484,28 @@ class SingleItemSensor(SensorEntity):
             return
 
         try:
-            locations = await self._api.get_storage_locations(self._community_id)
             found_item = None
             found_location = None
-            for loc in locations:
-                item = await self._api.get_item_by_gtin(self._community_id, loc["id"], gtin)
-                if item:
-                    found_item = item
-                    found_location = loc["name"]
+            # Erst alle Indizes, API-Abfragen nur, wenn keine Community die GTIN kennt
+            for coordinator in self._coordinators:
+                matches = coordinator.find_gtin(gtin)
+                if matches:
+                    coordinator.api.metrics.cache_hit("gtin_index")
                     break
-
-            off_data = await fetch_openfoodfacts(gtin)
-            image_url = off_data.get("product", {}).get("image_front_small_url", "") or ""
+            else:
+                for coordinator in self._coordinators if use_api else ():
+                    matches = await coordinator.async_find_gtin(gtin)
+                    if matches:
+                        break
+            if matches:
+                location_id, found_item = matches[0]
+                found_location = coordinator.locations.get(location_id)
+
+            product = await self.coordinator.product_cache.async_get(gtin)
+            image_url = self.coordinator.local_image(product["image"]) if product else ""
 
             if not found_item:
+                self._miss = (gtin, versions)
                 self._state = "Nicht gefunden"
                 self._attr_extra_state_attributes = {
                     "GTIN": gtin,
@@ -248,18 +531,3 @@ class SingleItemSensor(SensorEntity):
             _LOGGER.error("Fehler beim GTIN-Lookup: %s", e)
             self._state = "Fehler"
             self._attr_extra_state_attributes = {"GTIN": gtin or "-", "Lagerplatz": "-", "Menge": 0}
-
-
-# --------------------------
-# Hilfsfunktion für OpenFoodFacts
-# --------------------------
-async def fetch_openfoodfacts(gtin: str) -> dict:
-    url = f"https://world.openfoodfacts.org/api/v2/product/{gtin}.json"
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.status == 200:
-                    return await response.json()
-    except Exception as e:
-        _LOGGER.warning("OpenFoodFacts Fehler für GTIN %s: %s", gtin, e)
-    return {}
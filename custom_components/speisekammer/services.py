@@ -0,0 +1,480 @@
+from homeassistant.core import HomeAssistant, ServiceCall, SupportsResponse, callback
+from homeassistant.exceptions import ServiceValidationError
+from homeassistant.util import dt as dt_util
+from .api import build_item_payload
+from .bulk import parse_bulk_entries
+from .const import DOMAIN, DEFAULT_SEARCH_LIMIT, DEFAULT_HISTORY_DAYS, DEFAULT_SHOPPING_LIST_ENTITY
+from .sensor import build_table
+from .stock_index import normalize_gtin
+import asyncio
+import logging
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+CONF_COMMUNITY = "community"  # Community-ID oder -Name im Service-Aufruf
+
+SERVICES = (
+    "update_stock",
+    "refresh",
+    "add_item",
+    "add_items_bulk",
+    "get_locations_for_gtin",
+    "get_table",
+    "search",
+    "get_consumption",
+    "get_stock_history",
+    "set_min_stock",
+    "generate_shopping_list",
+    "start_inventur",
+    "scan_article",
+    "stop_inventur",
+    "abort_inventur",
+    "scan_articles_bulk",
+)
+
+
+def _all_communities(hass: HomeAssistant) -> list:
+    """Laufzeitdaten aller Communities über alle Einträge"""
+    return [
+        community
+        for data in hass.data.get(DOMAIN, {}).values()
+        for community in data["communities"].values()
+    ]
+
+
+def _candidates(hass: HomeAssistant, data: dict) -> list:
+    """Communities, auf die der Aufruf passt (alle, wenn keine angegeben ist)"""
+    communities = _all_communities(hass)
+    wanted = data.get(CONF_COMMUNITY)
+    if not wanted:
+        return communities
+    matches = [c for c in communities if wanted in (c["community_id"], c["name"])]
+    if not matches:
+        raise ServiceValidationError(f"Unbekannte Community: {wanted}")
+    return matches
+
+
+def _single(matches: list, what: str) -> dict:
+    if not matches:
+        raise ServiceValidationError(f"Unbekannter Lagerort: {what}")
+    if len(matches) > 1:
+        raise ServiceValidationError(f"{what} ist mehrdeutig, bitte 'community' angeben")
+    return matches[0]
+
+
+def resolve_community(hass: HomeAssistant, data: dict, location_name: str = None, location_id: str = None) -> dict:
+    """Community für einen Aufruf: explizit, über den Lagerort oder die einzige vorhandene"""
+    candidates = _candidates(hass, data)
+    if location_id:
+        return _single([c for c in candidates if location_id in c["coordinator"].locations], location_id)
+    if location_name:
+        return _single([c for c in candidates if location_name in c["coordinator"].location_map], location_name)
+    if len(candidates) != 1:
+        raise ServiceValidationError("Mehrere Communities eingerichtet, bitte 'community' angeben")
+    return candidates[0]
+
+
+def resolve_location(hass: HomeAssistant, data: dict, location_name: str = None, location_id: str = None):
+    """(Community, location_id) für einen per ID oder Name angegebenen Lagerort"""
+    if not location_id and not location_name:
+        raise ServiceValidationError("Kein Lagerort angegeben")
+    community = resolve_community(hass, data, location_name, location_id)
+    return community, location_id or community["coordinator"].location_map[location_name]
+
+
+def resolve_inventur(hass: HomeAssistant, data: dict) -> dict:
+    """Community der laufenden Inventur (oder die einzige/angegebene)"""
+    candidates = [c for c in _candidates(hass, data) if "inventur" in c]
+    running = [c for c in candidates if c["inventur"].running]
+    if len(running) == 1:
+        return running[0]
+    if len(candidates) == 1:
+        return candidates[0]
+    raise ServiceValidationError("Inventur nicht eindeutig, bitte 'community' angeben")
+
+
+@callback
+def async_register_services(hass: HomeAssistant):
+    """Services einmalig registrieren; weitere Einträge nutzen dieselben Handler"""
+    if hass.services.has_service(DOMAIN, "update_stock"):
+        return
+
+    # --------------------------
+    # Service: Lagerbestand aktualisieren
+    # --------------------------
+    async def handle_update_stock(call: ServiceCall):
+        location_id = call.data.get("location_id")
+        items = call.data.get("items")
+        community = resolve_community(hass, call.data, location_id=location_id)
+        _LOGGER.debug("Update stock: location=%s, items=%s", location_id, items)
+        community["write_queue"].enqueue(location_id, items or [])
+
+    # --------------------------
+    # Service: Sofort aktualisieren
+    # --------------------------
+    async def handle_refresh(call: ServiceCall):
+        location_id = call.data.get("location_id")
+        location_name = call.data.get("location_name")
+        if not location_id and not location_name:
+            # Ohne Lagerort: alle (bzw. die angegebene) Communities komplett
+            await asyncio.gather(*(
+                community["coordinator"].async_force_refresh()
+                for community in _candidates(hass, call.data)
+            ))
+            return
+        community, location_id = resolve_location(hass, call.data, location_name, location_id)
+        await community["coordinator"].async_force_refresh([location_id])
+
+    # --------------------------
+    # Service: Artikel hinzufügen
+    # --------------------------
+    async def handle_add_item(call: ServiceCall):
+        gtin = call.data.get("gtin")
+        count = call.data.get("count")
+        best_before = call.data.get("best_before")
+        location_name = call.data.get("location_name")
+
+        community, location_id = resolve_location(hass, call.data, location_name)
+
+        # Über die Warteschlange: schnelle Scans werden gebündelt und bei Fehlern wiederholt
+        community["write_queue"].enqueue(location_id, [build_item_payload(gtin, count, best_before)], add=True)
+        _LOGGER.info("Artikel eingereiht: %s (%s Stück) in %s", gtin, count, location_name)
+
+    # --------------------------
+    # Service: Viele Artikel auf einmal hinzufügen
+    # --------------------------
+    async def handle_add_items_bulk(call: ServiceCall):
+        entries = parse_bulk_entries(call.data.get("items"), call.data.get("data"))
+        default_location = call.data.get("location_name")
+        candidates = _candidates(hass, call.data)
+
+        # Nach Community und Lagerort gruppieren -> ein gebündelter Schreibvorgang pro Lagerort
+        results = []
+        batches = {}
+        communities = {}
+        for entry in entries:
+            location_name = entry.get("location_name") or default_location
+            result = {"gtin": entry["gtin"], "count": entry.get("count"), "location_name": location_name}
+            results.append(result)
+            if "error" in entry:
+                result["status"] = entry["error"]
+                continue
+            matches = [c for c in candidates if location_name and location_name in c["coordinator"].location_map]
+            if not matches:
+                result["status"] = "Unbekannter Lagerort"
+                continue
+            if len(matches) > 1:
+                result["status"] = "Mehrdeutiger Lagerort"
+                continue
+            community = matches[0]
+            location_id = community["coordinator"].location_map[location_name]
+            communities[community["community_id"]] = community
+            result["key"] = (community["community_id"], location_id)
+            batches.setdefault(result["key"], []).append(
+                (result, build_item_payload(entry["gtin"], entry["count"], entry.get("date") or ""))
+            )
+
+        for (community_id, location_id), rows in batches.items():
+            keys = communities[community_id]["write_queue"].enqueue(
+                location_id, [payload for _, payload in rows], add=True
+            )
+            for (result, _), key in zip(rows, keys):
+                result["queue_key"] = key
+        summaries = await asyncio.gather(*(
+            community["write_queue"].async_flush() for community in communities.values()
+        ))
+        summaries = dict(zip(communities, summaries))
+
+        for result in results:
+            key = result.pop("key", None)
+            if key is None:
+                continue
+            community_id, location_id = key
+            queue_key = result.pop("queue_key")
+            summary = summaries[community_id]
+            reason = summary["rejected"].get((location_id, normalize_gtin(result["gtin"])))
+            if (location_id, queue_key) in summary["written_keys"]:
+                result["status"] = "geschrieben"
+            elif reason is not None:
+                result["status"] = f"abgelehnt: {reason}"
+            elif communities[community_id]["write_queue"].is_pending(location_id, queue_key):
+                result["status"] = "ausstehend"
+            else:
+                # Schon von einem anderen Schreibvorgang übertragen
+                result["status"] = "geschrieben"
+
+        _LOGGER.info("Bulk-Hinzufügen: %d Einträge in %d Lagerorten", len(entries), len(batches))
+        return {"results": results}
+
+    # --------------------------
+    # Service: Lagerorte für GTIN prüfen
+    # --------------------------
+    async def handle_get_locations_for_gtin(call: ServiceCall):
+        gtin = call.data.get("gtin")
+        if not gtin:
+            _LOGGER.warning("GTIN fehlt für Lagerortprüfung")
+            return
+
+        try:
+            matching_locations = []
+            all_locations = []
+            for community in _candidates(hass, call.data):
+                coordinator = community["coordinator"]
+                locations = coordinator.locations
+                all_locations.extend(locations.values())
+                matching_locations.extend(
+                    locations[location_id] for location_id, _ in await coordinator.async_find_gtin(gtin)
+                    if location_id in locations
+                )
+
+            if not matching_locations:
+                matching_locations = all_locations
+
+            # Input_select Optionen setzen
+            await hass.services.async_call("input_select", "set_options", {
+                "entity_id": "input_select.lagerort_auswahl",
+                "options": matching_locations
+            })
+            await hass.services.async_call("input_select", "select_option", {
+                "entity_id": "input_select.lagerort_auswahl",
+                "option": matching_locations[0]
+            })
+
+            _LOGGER.info("Lagerorte für GTIN %s gesetzt: %s", gtin, matching_locations)
+
+        except Exception as e:
+            _LOGGER.error("Fehler beim Abrufen der Lagerorte für GTIN %s: %s", gtin, e)
+
+    # --------------------------
+    # Service: Vollständige Tabelle abrufen
+    # --------------------------
+    async def handle_get_table(call: ServiceCall):
+        """Liefert die ungekürzte Artikeltabelle als Service-Antwort"""
+        location_name = call.data.get("location_name")
+        community = resolve_community(hass, call.data, location_name)
+        coordinator = community["coordinator"]
+        locations = {
+            location_id: name for location_id, name in coordinator.locations.items()
+            if not location_name or name == location_name
+        }
+        return {
+            "locations": {
+                name: build_table(coordinator, location_id, name)
+                for location_id, name in locations.items()
+            },
+            "inventur": community["inventur"].get_table_data() if "inventur" in community else [],
+        }
+
+    # --------------------------
+    # Service: Artikel suchen
+    # --------------------------
+    async def handle_search(call: ServiceCall):
+        """Unscharfe Suche über Name, Beschreibung und GTIN – nur im Speicher, ohne API"""
+        start = time.perf_counter()
+        query = call.data.get("query", "")
+        limit = call.data.get("limit", DEFAULT_SEARCH_LIMIT)
+        location_name = call.data.get("location_name")
+
+        hits = []
+        for community in _candidates(hass, call.data):
+            coordinator = community["coordinator"]
+            location_ids = None
+            if location_name:
+                location_id = coordinator.location_map.get(location_name)
+                if location_id is None:
+                    continue
+                location_ids = [location_id]
+            for score, location_id, item in coordinator.search.search(query, limit, location_ids):
+                hits.append((score, community, location_id, item))
+        hits.sort(key=lambda hit: -hit[0])
+
+        results = []
+        for score, community, location_id, item in hits[:limit]:
+            attributes = item.get("attributes") or []
+            results.append({
+                "gtin": item.get("gtin"),
+                "name": item.get("name") or "Unbekannt",
+                "description": item.get("description", ""),
+                "count": sum(attr.get("count", 0) for attr in attributes),
+                "best_before": attributes[0].get("bestBeforeDate") if attributes else None,
+                "location_id": location_id,
+                "location_name": community["coordinator"].locations.get(location_id, "-"),
+                "community": community["name"],
+                "score": score,
+            })
+        return {"results": results, "took_ms": round((time.perf_counter() - start) * 1000, 2)}
+
+    # --------------------------
+    # Services: Verbrauch und Verlauf
+    # --------------------------
+    async def handle_get_consumption(call: ServiceCall):
+        """Verbrauch pro Tag und Reichweite je Produkt, aggregiert in der Verlaufsdatenbank"""
+        start = time.perf_counter()
+        gtin = call.data.get("gtin")
+        days = call.data.get("days", DEFAULT_HISTORY_DAYS)
+        limit = call.data.get("limit")
+
+        products = []
+        for community in _candidates(hass, call.data):
+            coordinator = community["coordinator"]
+            consumption = await community["history"].async_consumption(days, gtin)
+            for product_gtin, stats in consumption.items():
+                stock = coordinator.total_count(product_gtin)
+                per_day = stats["per_day"]
+                items = coordinator.index.lookup(product_gtin)
+                name = next((item.get("name") for item in items.values() if item.get("name")), None)
+                products.append({
+                    "gtin": product_gtin,
+                    "name": name or "Unbekannt",
+                    "community": community["name"],
+                    "stock": stock,
+                    "consumed": stats["consumed"],
+                    "per_day": per_day,
+                    "days_until_empty": round(stock / per_day, 1) if per_day > 0 else None,
+                })
+        # Was zuerst leer wird, steht oben; ohne Verbrauch ans Ende
+        products.sort(key=lambda product: (
+            product["days_until_empty"] is None, product["days_until_empty"] or 0, -product["per_day"]
+        ))
+        if limit:
+            products = products[:limit]
+        return {"days": days, "products": products, "took_ms": round((time.perf_counter() - start) * 1000, 2)}
+
+    async def handle_get_stock_history(call: ServiceCall):
+        """Bestandsverlauf einer GTIN, rückwärts aus dem aktuellen Bestand rekonstruiert"""
+        start = time.perf_counter()
+        gtin = str(call.data["gtin"]).strip()
+        days = call.data.get("days", DEFAULT_HISTORY_DAYS)
+
+        results = []
+        for community in _candidates(hass, call.data):
+            changes = await community["history"].async_changes(gtin, days)
+            level = community["coordinator"].total_count(gtin)
+            points = []
+            for ts, delta in reversed(changes):
+                points.append({"time": dt_util.utc_from_timestamp(ts).isoformat(), "change": delta, "level": level})
+                level -= delta
+            points.reverse()
+            if points:
+                results.append({"community": community["name"], "start_level": level, "points": points})
+        return {"gtin": gtin, "history": results, "took_ms": round((time.perf_counter() - start) * 1000, 2)}
+
+    # --------------------------
+    # Services: Einkaufsliste
+    # --------------------------
+    async def handle_set_min_stock(call: ServiceCall):
+        community = resolve_community(hass, call.data)
+        community["shopping"].set_threshold(
+            str(call.data["gtin"]).strip(),
+            call.data["min"],
+            call.data.get("expiry_days"),
+            call.data.get("name"),
+        )
+
+    async def handle_generate_shopping_list(call: ServiceCall):
+        """Fehlmengen aus dem Summenindex auf eine Todo-Liste schreiben (ohne Abfrage der Lagerorte)"""
+        entity_id = call.data.get("entity_id", DEFAULT_SHOPPING_LIST_ENTITY)
+        expiry_days = call.data.get("expiry_days")
+        items = [
+            {**entry, "community": community["name"]}
+            for community in _candidates(hass, call.data)
+            for entry in community["shopping"].shortfalls(expiry_days)
+        ]
+        if call.data.get("dry_run") or not items:
+            return {"items": items, "added": []}
+
+        if hass.states.get(entity_id) is None:
+            raise ServiceValidationError(f"Unbekannte Einkaufsliste: {entity_id}")
+        response = await hass.services.async_call(
+            "todo", "get_items", {"status": ["needs_action"]},
+            target={"entity_id": entity_id}, blocking=True, return_response=True,
+        )
+        open_items = [item["summary"] for item in (response or {}).get(entity_id, {}).get("items", [])]
+
+        added = []
+        for entry in items:
+            # Schon offen (auch mit anderer Menge): nicht doppelt eintragen
+            if any(summary == entry["name"] or summary.startswith(f"{entry['name']} (") for summary in open_items):
+                continue
+            missing = entry["missing"]
+            summary = f"{entry['name']} ({int(missing) if float(missing).is_integer() else missing})"
+            await hass.services.async_call(
+                "todo", "add_item", {"item": summary}, target={"entity_id": entity_id}, blocking=True
+            )
+            open_items.append(summary)
+            added.append(summary)
+        _LOGGER.info("Einkaufsliste %s: %d Artikel eingetragen", entity_id, len(added))
+        return {"items": items, "added": added}
+
+    # --------------------------
+    # Inventur-Services
+    # --------------------------
+    async def handle_start_inventur(call: ServiceCall):
+        location_id = call.data.get("location_id")
+        location_name = None
+        if not location_id:
+            # Ohne ID entscheidet die Auswahl im Dashboard über Lagerort und Community
+            lagerort_entity = hass.states.get("input_select.lagerort_auswahl")
+            location_name = lagerort_entity.state if lagerort_entity else None
+        if not location_id and not location_name:
+            _LOGGER.warning("Kein Lagerort ausgewählt – Inventur kann nicht starten")
+            return
+        community, location_id = resolve_location(hass, call.data, location_name, location_id)
+        await community["inventur"].start(location_id)
+
+    async def handle_scan_article(call: ServiceCall):
+        await resolve_inventur(hass, call.data)["inventur"].scan_article(
+            call.data["gtin"],
+            call.data.get("count", 1),
+            call.data.get("mhd")
+        )
+
+    async def handle_stop_inventur(call: ServiceCall):
+        await resolve_inventur(hass, call.data)["inventur"].stop(call.data.get("discard_failed", False))
+
+    async def handle_abort_inventur(call: ServiceCall):
+        await resolve_inventur(hass, call.data)["inventur"].abort()
+
+    async def handle_scan_articles_bulk(call: ServiceCall):
+        entries = parse_bulk_entries(call.data.get("items"), call.data.get("data"))
+        results = await resolve_inventur(hass, call.data)["inventur"].scan_articles(entries)
+        return {"results": results}
+
+    hass.services.async_register(DOMAIN, "update_stock", handle_update_stock)
+    hass.services.async_register(DOMAIN, "refresh", handle_refresh)
+    hass.services.async_register(DOMAIN, "add_item", handle_add_item)
+    hass.services.async_register(
+        DOMAIN, "add_items_bulk", handle_add_items_bulk, supports_response=SupportsResponse.OPTIONAL
+    )
+    hass.services.async_register(DOMAIN, "get_locations_for_gtin", handle_get_locations_for_gtin)
+    hass.services.async_register(
+        DOMAIN, "get_table", handle_get_table, supports_response=SupportsResponse.ONLY
+    )
+    hass.services.async_register(
+        DOMAIN, "search", handle_search, supports_response=SupportsResponse.ONLY
+    )
+    hass.services.async_register(
+        DOMAIN, "get_consumption", handle_get_consumption, supports_response=SupportsResponse.ONLY
+    )
+    hass.services.async_register(
+        DOMAIN, "get_stock_history", handle_get_stock_history, supports_response=SupportsResponse.ONLY
+    )
+    hass.services.async_register(DOMAIN, "set_min_stock", handle_set_min_stock)
+    hass.services.async_register(
+        DOMAIN, "generate_shopping_list", handle_generate_shopping_list, supports_response=SupportsResponse.OPTIONAL
+    )
+    hass.services.async_register(DOMAIN, "start_inventur", handle_start_inventur)
+    hass.services.async_register(DOMAIN, "scan_article", handle_scan_article)
+    hass.services.async_register(DOMAIN, "stop_inventur", handle_stop_inventur)
+    hass.services.async_register(DOMAIN, "abort_inventur", handle_abort_inventur)
+    hass.services.async_register(
+        DOMAIN, "scan_articles_bulk", handle_scan_articles_bulk, supports_response=SupportsResponse.OPTIONAL
+    )
+    _LOGGER.info("Speisekammer-Services registriert")
+
+
+@callback
+def async_unregister_services(hass: HomeAssistant):
+    for service in SERVICES:
+        hass.services.async_remove(DOMAIN, service)
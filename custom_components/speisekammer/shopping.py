@@ -0,0 +1,88 @@
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.storage import Store
+from .const import DOMAIN, STORAGE_VERSION, SHOPPING_SAVE_DELAY, DEFAULT_SHOPPING_EXPIRY_DAYS
+from .stock_index import normalize_gtin
+import logging
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+DAY = 86400
+
+
+class ShoppingList:
+    """
+    Mindestbestände je GTIN und die daraus folgenden Fehlmengen. Gerechnet wird
+    nur über die GTINs mit Mindestbestand und gegen den Summenindex des
+    Coordinators, ohne Tabellen oder API-Abfragen.
+    """
+
+    def __init__(self, hass: HomeAssistant, coordinator, storage_id: str, expiry_days: int = DEFAULT_SHOPPING_EXPIRY_DAYS):
+        self.hass = hass
+        self.coordinator = coordinator
+        self.expiry_days = expiry_days
+        # gtin -> {"min": Menge, "expiry_days": Tage oder None, "name": Name oder None}
+        self.thresholds = {}
+        self._listeners = []
+        self._store = Store(hass, STORAGE_VERSION, f"{DOMAIN}.shopping.{storage_id}")
+
+    def __len__(self):
+        return len(self.thresholds)
+
+    async def async_load(self):
+        data = await self._store.async_load() or {}
+        self.thresholds = data.get("thresholds", {})
+
+    def _data_to_save(self):
+        return {"thresholds": self.thresholds}
+
+    @callback
+    def set_threshold(self, gtin, min_count: float, expiry_days: int = None, name: str = None):
+        """Mindestbestand setzen; 0 entfernt die GTIN von der Liste"""
+        gtin = normalize_gtin(gtin)
+        if min_count <= 0:
+            self.thresholds.pop(gtin, None)
+        else:
+            self.thresholds[gtin] = {"min": min_count, "expiry_days": expiry_days, "name": name}
+        self._store.async_delay_save(self._data_to_save, SHOPPING_SAVE_DELAY)
+        for listener in list(self._listeners):
+            listener()
+
+    @callback
+    def add_listener(self, update_callback):
+        self._listeners.append(update_callback)
+        return lambda: self._listeners.remove(update_callback)
+
+    def _name(self, gtin: str, threshold: dict) -> str:
+        if threshold.get("name"):
+            return threshold["name"]
+        for item in self.coordinator.index.lookup(gtin).values():
+            if item.get("name"):
+                return item["name"]
+        return self.coordinator.product_cache.product_name(gtin) or gtin
+
+    def shortfalls(self, expiry_days: int = None, now: float = None) -> list:
+        """
+        Fehlmengen als [{gtin, name, stock, usable, min, missing}]. Ware, die
+        innerhalb des Ablauffensters abläuft, zählt nicht zum Bestand.
+        """
+        now = now or time.time()
+        totals = self.coordinator.totals
+        result = []
+        for gtin, threshold in self.thresholds.items():
+            days = threshold.get("expiry_days")
+            if days is None:
+                days = self.expiry_days if expiry_days is None else expiry_days
+            usable = totals.usable(gtin, now + days * DAY)
+            missing = threshold["min"] - usable
+            if missing > 0:
+                result.append({
+                    "gtin": gtin,
+                    "name": self._name(gtin, threshold),
+                    "stock": totals.total(gtin),
+                    "usable": usable,
+                    "min": threshold["min"],
+                    "missing": missing,
+                })
+        result.sort(key=lambda entry: (-entry["missing"], entry["name"]))
+        return result
@@ -0,0 +1,67 @@
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def normalize_gtin(gtin) -> str:
+    return str(gtin).strip()
+
+
+def to_stock_item(item: dict, previous: dict = None) -> dict:
+    """Schreib-Payload (update_stock/add_item) in die Form der Bestandsliste bringen"""
+    if "attributes" in item:
+        stock_item = dict(item)
+    else:
+        stock_item = {
+            "gtin": item.get("gtin"),
+            "attributes": [{
+                "count": item.get("count", 0),
+                "bestBeforeDate": item.get("bestBeforeDate"),
+            }],
+        }
+    if previous:
+        # Name/Beschreibung kennt nur der Server, daher vom alten Eintrag übernehmen
+        for key in ("name", "description"):
+            if not stock_item.get(key) and previous.get(key):
+                stock_item[key] = previous[key]
+    return stock_item
+
+
+class StockIndex:
+    """Invertierter Index GTIN -> {location_id: item} über alle Lagerorte"""
+
+    def __init__(self):
+        self._by_gtin = {}
+
+    def __len__(self):
+        return len(self._by_gtin)
+
+    def rebuild(self, stock: dict):
+        """Index komplett aus dem Snapshot (location_id -> items) neu aufbauen"""
+        by_gtin = {}
+        for location_id, items in stock.items():
+            for item in items:
+                gtin = item.get("gtin")
+                if gtin is None:
+                    continue
+                by_gtin.setdefault(normalize_gtin(gtin), {})[location_id] = item
+        self._by_gtin = by_gtin
+
+    def lookup(self, gtin) -> dict:
+        """Alle Lagerorte mit dieser GTIN als {location_id: item}"""
+        return self._by_gtin.get(normalize_gtin(gtin), {})
+
+    def get(self, gtin, location_id: str):
+        return self.lookup(gtin).get(location_id)
+
+    def set_item(self, location_id: str, item: dict):
+        self._by_gtin.setdefault(normalize_gtin(item.get("gtin")), {})[location_id] = item
+
+    def remove_item(self, location_id: str, gtin):
+        gtin = normalize_gtin(gtin)
+        locations = self._by_gtin.get(gtin)
+        if locations is None:
+            return
+        locations.pop(location_id, None)
+        if not locations:
+            del self._by_gtin[gtin]
@@ -0,0 +1,84 @@
+from .expiry import parse_best_before
+from .stock_index import normalize_gtin
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class TotalsIndex:
+    """Gesamtmenge je GTIN über alle Lagerorte, bei jeder Änderung nur für betroffene Artikel nachgeführt"""
+
+    def __init__(self):
+        self._totals = {}  # gtin -> Gesamtmenge
+        # (location_id, gtin) -> [(menge, mhd_ts)], für Mengen ohne bald ablaufende Ware
+        self._parts = {}
+        self._by_location = {}  # location_id -> {gtin}
+        self._by_gtin = {}  # gtin -> {location_id}
+
+    def __len__(self):
+        return len(self._totals)
+
+    def rebuild(self, stock: dict):
+        self._totals = {}
+        self._parts = {}
+        self._by_location = {}
+        self._by_gtin = {}
+        for location_id, items in stock.items():
+            self.update_location(location_id, items)
+
+    def set_item(self, location_id: str, item: dict):
+        gtin = item.get("gtin")
+        if gtin is None:
+            return
+        gtin = normalize_gtin(gtin)
+        self.remove_item(location_id, gtin)
+        parts = [
+            (attr.get("count", 0) or 0, parse_best_before(attr.get("bestBeforeDate")))
+            for attr in item.get("attributes") or []
+            if (attr.get("count", 0) or 0) > 0
+        ]
+        if not parts:
+            return
+        self._parts[(location_id, gtin)] = parts
+        self._by_location.setdefault(location_id, set()).add(gtin)
+        self._by_gtin.setdefault(gtin, set()).add(location_id)
+        self._totals[gtin] = self._totals.get(gtin, 0) + sum(count for count, _ in parts)
+
+    def remove_item(self, location_id: str, gtin):
+        gtin = normalize_gtin(gtin)
+        parts = self._parts.pop((location_id, gtin), None)
+        if parts is None:
+            return
+        self._by_location[location_id].discard(gtin)
+        self._by_gtin[gtin].discard(location_id)
+        if self._by_gtin[gtin]:
+            self._totals[gtin] -= sum(count for count, _ in parts)
+        else:
+            del self._totals[gtin]
+            del self._by_gtin[gtin]
+
+    def update_location(self, location_id: str, items: list):
+        current = {normalize_gtin(item.get("gtin")): item for item in items if item.get("gtin") is not None}
+        for gtin in list(self._by_location.get(location_id, ())):
+            if gtin not in current:
+                self.remove_item(location_id, gtin)
+        for item in current.values():
+            self.set_item(location_id, item)
+
+    def remove_location(self, location_id: str):
+        for gtin in list(self._by_location.get(location_id, ())):
+            self.remove_item(location_id, gtin)
+        self._by_location.pop(location_id, None)
+
+    def total(self, gtin) -> float:
+        return self._totals.get(normalize_gtin(gtin), 0)
+
+    def usable(self, gtin, until: float) -> float:
+        """Menge, deren MHD nach `until` liegt (ohne MHD zählt immer)"""
+        gtin = normalize_gtin(gtin)
+        return sum(
+            count
+            for location_id in self._by_gtin.get(gtin, ())
+            for count, ts in self._parts[(location_id, gtin)]
+            if ts is None or ts > until
+        )
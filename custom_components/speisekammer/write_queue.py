@@ -0,0 +1,197 @@
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.event import async_call_later
+from homeassistant.helpers.storage import Store
+from .api import SpeisekammerAPI, SpeisekammerApiError
+from .const import (
+    DOMAIN,
+    STORAGE_VERSION,
+    STOCK_BATCH_SIZE,
+    QUEUE_FLUSH_DELAY,
+    QUEUE_SAVE_DELAY,
+    QUEUE_BACKOFF_BASE,
+    QUEUE_BACKOFF_MAX,
+)
+from .stock_index import normalize_gtin
+import aiohttp
+import asyncio
+import itertools
+import logging
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class WriteQueue:
+    """Persistente Warteschlange für Bestandsänderungen mit Zusammenfassen, Retry und Backoff"""
+
+    def __init__(self, hass: HomeAssistant, api: SpeisekammerAPI, community_id: str, entry_id: str, on_written=None):
+        self.hass = hass
+        self.api = api
+        self.community_id = community_id
+        # Callback(location_id, items) nach erfolgreichem Schreiben
+        self._on_written = on_written
+        self._store = Store(hass, STORAGE_VERSION, f"{DOMAIN}.queue.{entry_id}")
+        # location_id -> {schlüssel: payload}. Absolute Mengen (update_stock, Inventur)
+        # stehen unter der GTIN, spätere ersetzen frühere. Zugänge (add_item) bekommen
+        # je Aufruf einen eigenen Schlüssel und werden erst beim Schreiben je
+        # (GTIN, MHD) zusammengezählt.
+        self._pending = {}
+        self._add_ids = itertools.count(int(time.time() * 1000))
+        self._failures = 0
+        self._not_before = 0.0
+        self._unsub_flush = None
+        self._lock = asyncio.Lock()
+
+    def __len__(self):
+        return sum(len(items) for items in self._pending.values())
+
+    def is_pending(self, location_id: str, key: str) -> bool:
+        return key in self._pending.get(location_id, {})
+
+    async def async_load(self):
+        """Nicht übertragene Änderungen nach einem Neustart wieder einreihen"""
+        data = await self._store.async_load() or {}
+        self._pending = data.get("pending", {})
+        if self._pending:
+            _LOGGER.info("Schreib-Warteschlange wiederhergestellt: %d Änderungen", len(self))
+            self._schedule_flush(0)
+
+    async def async_shutdown(self):
+        if self._unsub_flush:
+            self._unsub_flush()
+            self._unsub_flush = None
+        await self._store.async_save(self._data_to_save())
+
+    def _data_to_save(self):
+        return {"pending": self._pending}
+
+    @callback
+    def enqueue(self, location_id: str, items: list, add: bool = False) -> list:
+        """
+        Änderungen einreihen; sie werden gesammelt und gebündelt geschrieben.
+        add=True für Zugänge, die sich addieren statt einander zu ersetzen.
+        Liefert die Schlüssel der eingereihten Einträge.
+        """
+        location = self._pending.setdefault(location_id, {})
+        keys = []
+        for item in items:
+            gtin = normalize_gtin(item["gtin"])
+            key = f"{gtin}|add|{next(self._add_ids)}" if add else gtin
+            location[key] = item
+            keys.append(key)
+        self._store.async_delay_save(self._data_to_save, QUEUE_SAVE_DELAY)
+        self._schedule_flush(QUEUE_FLUSH_DELAY)
+        return keys
+
+    @callback
+    def _schedule_flush(self, delay: float):
+        if self._unsub_flush:
+            # Es ist schon ein Flush geplant – die neuen Änderungen gehen dort mit
+            return
+        delay = max(delay, self._not_before - time.time())
+        self._unsub_flush = async_call_later(self.hass, delay, self._handle_flush_timer)
+
+    async def _handle_flush_timer(self, _now):
+        self._unsub_flush = None
+        await self.async_flush()
+
+    async def async_flush(self) -> dict:
+        """Alle Änderungen schreiben: ein (gestückelter) PUT pro Lagerort, Lagerorte parallel"""
+        async with self._lock:
+            if time.time() < self._not_before:
+                self._schedule_flush(0)
+                return {"written": 0, "written_keys": set(), "rejected": {}, "pending": len(self)}
+
+            location_ids = [loc_id for loc_id, items in self._pending.items() if items]
+            results = await self.api.gather_limited(
+                lambda loc_id=loc_id: self._flush_location(loc_id) for loc_id in location_ids
+            )
+
+            written = 0
+            written_keys = set()
+            rejected = {}
+            retry_after = None
+            for location_id, (location_written, keys, location_rejected, location_retry) in zip(location_ids, results):
+                written += len(keys)
+                written_keys.update((location_id, key) for key in keys)
+                rejected.update(location_rejected)
+                if location_written and self._on_written:
+                    self._on_written(location_id, location_written)
+                if location_retry is not None:
+                    retry_after = max(retry_after or 0, location_retry)
+
+            self._pending = {loc_id: items for loc_id, items in self._pending.items() if items}
+            self._store.async_delay_save(self._data_to_save, QUEUE_SAVE_DELAY)
+
+            if retry_after is not None:
+                self._failures += 1
+                backoff = min(QUEUE_BACKOFF_BASE * 2 ** (self._failures - 1), QUEUE_BACKOFF_MAX)
+                delay = max(retry_after, backoff)
+                self._not_before = time.time() + delay
+                _LOGGER.warning("Schreiben verschoben, neuer Versuch in %.0f s (%d ausstehend)", delay, len(self))
+                self._schedule_flush(delay)
+            else:
+                self._failures = 0
+                self._not_before = 0.0
+
+            return {"written": written, "written_keys": written_keys, "rejected": rejected, "pending": len(self)}
+
+    @staticmethod
+    def _group(entries: list) -> list:
+        """Zugänge mit gleicher GTIN und gleichem MHD zu einer Position zusammenzählen"""
+        groups = {}
+        for key, item in entries:
+            if "|add|" not in key:
+                groups[key] = [item, [(key, item)]]
+                continue
+            attributes = item.get("attributes") or [{}]
+            merge_key = (normalize_gtin(item["gtin"]), repr(attributes[0].get("bestBeforeDate")))
+            group = groups.get(merge_key)
+            if group is None:
+                groups[merge_key] = [item, [(key, item)]]
+                continue
+            merged = dict(group[0])
+            merged_attr = dict((merged.get("attributes") or [{}])[0])
+            merged_attr["count"] = (merged_attr.get("count") or 0) + (attributes[0].get("count") or 0)
+            merged["attributes"] = [merged_attr]
+            group[0] = merged
+            group[1].append((key, item))
+        return list(groups.values())
+
+    async def _flush_location(self, location_id: str):
+        """
+        Gibt (geschriebene Positionen, geschriebene Schlüssel,
+        abgelehnte {(location_id, gtin): Grund}, retry_after) zurück
+        """
+        pending = self._pending[location_id]
+        groups = self._group(list(pending.items()))
+        written, written_keys, rejected = [], [], {}
+        for start in range(0, len(groups), STOCK_BATCH_SIZE):
+            chunk = groups[start:start + STOCK_BATCH_SIZE]
+            try:
+                await self.api.put_stock(self.community_id, location_id, [payload for payload, _ in chunk])
+            except SpeisekammerApiError as e:
+                if e.retryable:
+                    return written, written_keys, rejected, e.retry_after or 0
+                # Dauerhafter Fehler (z.B. 400): nicht endlos wiederholen
+                _LOGGER.error("Änderung in %s abgelehnt: %s", location_id, e)
+                for payload, entries in chunk:
+                    rejected[(location_id, normalize_gtin(payload["gtin"]))] = str(e)
+                    for key, item in entries:
+                        self._discard(pending, key, item)
+                continue
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                _LOGGER.warning("Verbindungsfehler beim Schreiben in %s: %s", location_id, e)
+                return written, written_keys, rejected, 0
+            for payload, entries in chunk:
+                written.append(payload)
+                for key, item in entries:
+                    written_keys.append(key)
+                    self._discard(pending, key, item)
+        return written, written_keys, rejected, None
+
+    @staticmethod
+    def _discard(pending: dict, key: str, item: dict):
+        # Nur entfernen, wenn inzwischen keine neuere Änderung eingereiht wurde
+        if pending.get(key) is item:
+            del pending[key]
@@ -0,0 +1,5 @@
+from pathlib import Path
+import sys
+
+# Wie die Benchmarks: custom_components aus dem Repo importieren (Home Assistant muss installiert sein)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
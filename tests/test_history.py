@@ -0,0 +1,94 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("homeassistant")
+
+from custom_components.speisekammer import history as history_module  # noqa: E402
+from custom_components.speisekammer.history import DAY, ConsumptionHistory, stock_deltas  # noqa: E402
+
+GTIN = "4000417025005"
+OTHER = "8001250120342"
+
+
+class _Hass:
+    """Nur was ConsumptionHistory braucht: Executor-Jobs"""
+
+    async def async_add_executor_job(self, target, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, target, *args)
+
+
+def _items(*counts) -> list:
+    return [{"gtin": gtin, "attributes": [{"count": count}]} for gtin, count in counts]
+
+
+@pytest.fixture(autouse=True)
+def _no_flush_timer(monkeypatch):
+    # Gebündeltes Schreiben übernimmt hier async_flush, kein Timer von Home Assistant
+    monkeypatch.setattr(history_module, "async_call_later", lambda hass, delay, action: lambda: None)
+
+
+def _run(path, scenario):
+    async def main():
+        history = ConsumptionHistory(_Hass(), str(path))
+        await history.async_open()
+        try:
+            return await scenario(history)
+        finally:
+            await history.async_close()
+
+    return asyncio.run(main())
+
+
+def test_stock_deltas_only_reports_changes():
+    old = _items((GTIN, 5), (OTHER, 1))
+    new = _items((GTIN, 3), (OTHER, 1), ("4014400900057", 2))
+    assert stock_deltas(old, new) == {GTIN: -2, "4014400900057": 2}
+
+
+def test_consumption_counts_only_removals_in_window(tmp_path):
+    now = time.time()
+
+    async def scenario(history):
+        history.record("kuehlschrank", _items((GTIN, 5)), _items((GTIN, 3)), ts=now - 2 * DAY)
+        history.record("kuehlschrank", _items((GTIN, 3)), _items((GTIN, 7)), ts=now - 2 * DAY + 60)
+        history.record("kuehlschrank", _items((GTIN, 7)), _items((GTIN, 6)), ts=now - 3600)
+        history.record("keller", _items((GTIN, 2)), _items((GTIN, 1)), ts=now - 1800)
+        return await history.async_consumption(7), await history.async_consumption(1)
+
+    week, day = _run(tmp_path / "history.db", scenario)
+    # Zugänge (+4) zählen nicht als Verbrauch, Lagerorte werden zusammengezählt
+    assert week[GTIN]["consumed"] == 4
+    assert day[GTIN]["consumed"] == 2
+    # Aufzeichnung ist jünger als ein Tag: Rate bezieht sich auf mindestens einen Tag
+    assert day[GTIN]["per_day"] == 2
+
+
+def test_consumption_filters_gtin_and_survives_reopen(tmp_path):
+    now = time.time()
+    path = tmp_path / "history.db"
+
+    async def record(history):
+        history.record("kuehlschrank", _items((GTIN, 4), (OTHER, 2)), _items((GTIN, 1), (OTHER, 1)), ts=now - 60)
+
+    async def query(history):
+        # Laufender Gesamtverbrauch wird beim Öffnen aus der Datei übernommen
+        history.record("kuehlschrank", _items((GTIN, 1)), _items((GTIN, 0)), ts=now - 30)
+        return await history.async_consumption(1, GTIN)
+
+    _run(path, record)
+    result = _run(path, query)
+    assert result == {GTIN: {"consumed": 4, "per_day": 4}}
+
+
+def test_changes_are_summed_per_timestamp(tmp_path):
+    now = int(time.time())
+
+    async def scenario(history):
+        history.record("kuehlschrank", _items((GTIN, 5)), _items((GTIN, 3)), ts=now - 120)
+        history.record("keller", _items((GTIN, 1)), _items((GTIN, 4)), ts=now - 120)
+        history.record("keller", _items((GTIN, 4)), _items((GTIN, 2)), ts=now - 60)
+        return await history.async_changes(GTIN, 1)
+
+    assert _run(tmp_path / "history.db", scenario) == [(now - 120, 1), (now - 60, -2)]
@@ -0,0 +1,68 @@
+import pytest
+
+pytest.importorskip("homeassistant")
+
+from custom_components.speisekammer.search_index import SearchIndex  # noqa: E402
+
+
+def _item(gtin: str, name: str, description: str = "") -> dict:
+    return {"gtin": gtin, "name": name, "description": description, "attributes": [{"count": 1}]}
+
+
+@pytest.fixture
+def index():
+    index = SearchIndex()
+    index.rebuild({
+        "kuehlschrank": [
+            _item("4000417025005", "Käse Gouda", "jung, am Stück"),
+            _item("8001250120342", "Kaffee Crema"),
+        ],
+        "keller": [_item("4014400900057", "Milch")],
+    })
+    return index
+
+
+def _names(hits: list) -> list:
+    return [item["name"] for _, _, item in hits]
+
+
+def test_search_ignores_umlauts_and_case(index):
+    assert _names(index.search("KASE")) == ["Käse Gouda"]
+
+
+def test_short_query_matches_word_start(index):
+    assert sorted(_names(index.search("ka"))) == ["Kaffee Crema", "Käse Gouda"]
+    assert index.search("ch") == []
+
+
+def test_exact_match_scores_above_typo(index):
+    exact = index.search("gouda")
+    typo = index.search("goudx")
+    assert _names(exact) == _names(typo) == ["Käse Gouda"]
+    assert exact[0][0] > typo[0][0]
+
+
+def test_every_query_word_must_match(index):
+    assert _names(index.search("käse stück")) == ["Käse Gouda"]
+    assert index.search("käse milch") == []
+
+
+def test_search_finds_gtin_substring(index):
+    assert _names(index.search("0417025")) == ["Käse Gouda"]
+
+
+def test_search_filters_locations(index):
+    hits = index.search("milch", location_ids=["kuehlschrank"])
+    assert hits == []
+    assert [location_id for _, location_id, _ in index.search("milch", location_ids=["keller"])] == ["keller"]
+
+
+def test_limit_keeps_best_hits(index):
+    hits = index.search("ka", limit=1)
+    assert len(hits) == 1
+
+
+def test_update_location_removes_missing_items(index):
+    index.update_location("kuehlschrank", [_item("8001250120342", "Kaffee Crema")])
+    assert index.search("gouda") == []
+    assert len(index) == 2
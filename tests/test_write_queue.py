@@ -0,0 +1,53 @@
+import pytest
+
+pytest.importorskip("homeassistant")
+
+from custom_components.speisekammer.api import build_item_payload  # noqa: E402
+from custom_components.speisekammer.write_queue import WriteQueue  # noqa: E402
+
+
+def _count(payload: dict):
+    return payload["attributes"][0]["count"]
+
+
+def test_group_sums_adds_with_same_gtin_and_best_before():
+    first = build_item_payload("4000417025005", 2, "2025-12-31")
+    second = build_item_payload("4000417025005", 3, "2025-12-31")
+    groups = WriteQueue._group([("4000417025005|add|1", first), ("4000417025005|add|2", second)])
+
+    assert len(groups) == 1
+    payload, entries = groups[0]
+    assert _count(payload) == 5
+    assert entries == [("4000417025005|add|1", first), ("4000417025005|add|2", second)]
+    # Die eingereihten Einträge bleiben unverändert (Identität zählt beim Entfernen)
+    assert _count(first) == 2
+    assert _count(second) == 3
+
+
+def test_group_keeps_different_best_before_dates_apart():
+    first = build_item_payload("4000417025005", 2, "2025-12-31")
+    second = build_item_payload("4000417025005", 3, "2026-01-31")
+    groups = WriteQueue._group([("4000417025005|add|1", first), ("4000417025005|add|2", second)])
+
+    assert [_count(payload) for payload, _ in groups] == [2, 3]
+
+
+def test_group_does_not_merge_absolute_counts_with_adds():
+    add = build_item_payload("4000417025005", 2, "2025-12-31")
+    absolute = {"gtin": "4000417025005", "count": 7, "bestBeforeDate": "2025-12-31"}
+    groups = WriteQueue._group([("4000417025005|add|1", add), ("4000417025005", absolute)])
+
+    assert [payload for payload, _ in groups] == [add, absolute]
+    assert [entries for _, entries in groups] == [
+        [("4000417025005|add|1", add)],
+        [("4000417025005", absolute)],
+    ]
+
+
+def test_group_normalizes_gtin_before_merging():
+    first = build_item_payload(4000417025005, 1, "2025-12-31")
+    second = build_item_payload(" 4000417025005 ", 1, "2025-12-31")
+    groups = WriteQueue._group([("4000417025005|add|1", first), ("4000417025005|add|2", second)])
+
+    assert len(groups) == 1
+    assert _count(groups[0][0]) == 2